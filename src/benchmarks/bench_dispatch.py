@@ -0,0 +1,108 @@
+"""
+Micro-benchmark of the command dispatch cost.
+
+Compares the dispatch used before the command registry was introduced (dispatch
+dictionary built for each command and ``inspect.signature`` called on the handler)
+with the registry dispatch and with the handlers bound at compile time. The handlers
+used in the benchmark only yield a ``null`` message, so the results show the dispatch
+overhead per command.
+
+Run from the ``src`` directory:
+
+    python -m benchmarks.bench_dispatch
+"""
+
+import argparse
+import contextlib
+import inspect
+import io
+import time
+from types import SimpleNamespace
+
+from megatron.logger import LogSettings
+from megatron.megatron_control import megatron_command_registry, process_megatron_command
+from megatron.motor_control import motor_command_registry
+
+# Commands with handlers that yield 'null' and do not access the devices
+_commands = [
+    ("print", ("text",)),
+    ("var", ("name", "1")),
+    ("lograte", ("1",)),
+    ("setdo", ("Magnetron 5 Relay", "1")),
+    ("setao", ("ION Power", "250")),
+    ("pr", ("-8500000",)),
+    ("sp", ("1898000",)),
+    ("pa", ("0",)),
+]
+
+
+def _legacy_dispatch(command, args, context, current_script_path=None):
+    """
+    Dispatch as implemented before the command registry was introduced.
+    """
+    registry = megatron_command_registry if command in megatron_command_registry else motor_command_registry
+    command_dispatcher = {name: registry.get(name).function for name in registry}
+    command_function = command_dispatcher[command]
+
+    sig = inspect.signature(command_function)
+    params = list(sig.parameters)
+
+    kwargs = {"args": args, "context": context, "current_script_path": current_script_path}
+    dynamic_args = [kwargs[param] for param in params if param in kwargs]
+
+    yield from command_function(*dynamic_args)
+
+
+def _registry_dispatch(command, args, context):
+    if command in megatron_command_registry:
+        return process_megatron_command(command, args, context)
+    return motor_command_registry.dispatch(command, args, context)
+
+
+def _measure(dispatch, n_commands, context):
+    start = time.perf_counter()
+    for n in range(n_commands):
+        command, args = _commands[n % len(_commands)]
+        for _ in dispatch(command, args, context):
+            pass
+    return (time.perf_counter() - start) / n_commands
+
+
+def run_benchmark(n_commands=100000):
+    """
+    Returns the dictionary with the dispatch time (seconds per command) for each method.
+    """
+    context = SimpleNamespace(
+        galil_abs_rel=0, galil_pos=0, galil_speed=1000000, device_mapping={}, log_settings=LogSettings()
+    )
+    handlers = {name: megatron_command_registry.get(name) or motor_command_registry.get(name) for name, _ in _commands}
+
+    def bound_dispatch(command, args, context):
+        return handlers[command](args, context)
+
+    results = {}
+    with contextlib.redirect_stdout(io.StringIO()) as output:
+        for name, dispatch in (
+            ("legacy", _legacy_dispatch),
+            ("registry", _registry_dispatch),
+            ("bound", bound_dispatch),
+        ):
+            results[name] = _measure(dispatch, n_commands, context)
+            output.seek(0)
+            output.truncate()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the command dispatch.")
+    parser.add_argument("-n", "--n-commands", type=int, default=100000, help="Number of dispatched commands.")
+    args = parser.parse_args()
+
+    results = run_benchmark(args.n_commands)
+    baseline = results["legacy"]
+    for name, t in results.items():
+        print(f"{name:>10}: {t * 1e6:8.2f} us/command ({baseline / t:5.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
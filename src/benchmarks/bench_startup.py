@@ -0,0 +1,114 @@
+"""
+Startup time of the ``megatron`` command line interface.
+
+Each case is run in a new interpreter (the best of several runs is reported) and
+compared with its time budget. Importing the package and the subcommands that do not
+execute scripts must not import ophyd (and the package itself must not import bluesky).
+The exit status is 1 if any budget is exceeded.
+
+Run from the ``src`` directory:
+
+    python -m benchmarks.bench_startup
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+_script = """\
+# Section
+setdo "Relay 1", 1
+l3
+setao "ION Power", 250
+t1
+n
+run "sub"
+"""
+
+# Name, arguments of 'python', time budget (seconds)
+_cases = [
+    ("import megatron", ["-c", "import megatron"], 0.2),
+    ("megatron --help", ["-m", "megatron", "--help"], 0.3),
+    ("check --help", ["-m", "megatron", "check", "--help"], 0.3),
+    ("search --help", ["-m", "megatron", "search", "--help"], 0.3),
+    ("search", ["-m", "megatron", "search", "{script}", "-u", "setdo"], 0.4),
+    ("check", ["-m", "megatron", "check", "--no-cache", "{script}"], 0.9),
+    ("estimate", ["-m", "megatron", "estimate", "{script}"], 0.9),
+]
+
+# Modules that must not be imported by the cases (prefix of the case name -> modules)
+_forbidden_modules = {
+    "import megatron": ("bluesky", "ophyd"),
+    "megatron --help": ("bluesky", "ophyd"),
+    "search": ("bluesky", "ophyd"),
+    "check": ("ophyd",),
+    "estimate": ("ophyd",),
+}
+
+
+def _run(args, env):
+    start = time.perf_counter()
+    subprocess.run([sys.executable, *args], env=env, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return time.perf_counter() - start
+
+
+def _imported_modules(args, env):
+    """
+    Returns the names of the top-level packages imported by the case.
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", *args], env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+        text=True
+    )
+    names = set()
+    for line in result.stderr.splitlines():
+        if line.startswith("import time:") and "|" in line:
+            names.add(line.rsplit("|", 1)[1].strip().split(".")[0])
+    return names
+
+
+def run_benchmark(n_runs=5):
+    """
+    Returns the list of ``(name, best time, budget, forbidden modules imported)``.
+    """
+    src_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [src_dir, os.environ.get("PYTHONPATH")])))
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        script_path = os.path.join(tmp_dir, "script.txt")
+        with open(script_path, "w") as f:
+            f.write(_script)
+        with open(os.path.join(tmp_dir, "sub.txt"), "w") as f:
+            f.write("t1\n")
+
+        for name, args, budget in _cases:
+            args = [_.format(script=script_path) for _ in args]
+            # The first run warms up the file system cache and writes the byte code
+            _run(args, env)
+            best = min(_run(args, env) for _ in range(n_runs))
+            forbidden = next((v for k, v in _forbidden_modules.items() if name.startswith(k)), ())
+            imported = sorted(_imported_modules(args, env).intersection(forbidden))
+            results.append((name, best, budget, imported))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the startup time of the command line interface.")
+    parser.add_argument("-n", "--n-runs", type=int, default=5, help="Number of runs of each case.")
+    args = parser.parse_args()
+
+    failed = False
+    for name, best, budget, imported in run_benchmark(args.n_runs):
+        ok = best <= budget and not imported
+        failed = failed or not ok
+        status = "ok" if ok else "FAILED"
+        extra = f" (imports {', '.join(imported)})" if imported else ""
+        print(f"{name:>16}: {best * 1000:7.1f} ms, budget {budget * 1000:6.0f} ms  {status}{extra}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
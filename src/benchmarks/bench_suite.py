@@ -0,0 +1,288 @@
+"""
+Benchmark suite of the interpreter, the command dispatch and the logger.
+
+The scripts are executed by a real RunEngine against ``ophyd.sim`` devices: the Galil
+motor is simulated by ``SynAxis`` and each signal referenced by the script is
+a ``Signal``. 'sleep' messages ('t' commands) advance a virtual clock instead of waiting
+and the wait conditions ('waitai', 'waitdi') are met immediately, so the results show
+the cost of the interpreter and the RunEngine. The MLL recipes are used as the fixtures.
+
+Reported metrics:
+
+- ``lines_per_second``: executed instructions per second (loops expanded, sub-scripts included),
+- ``messages_per_command``: RunEngine messages per executed instruction,
+- ``dispatch_us``: registry dispatch time per command (see ``bench_dispatch``),
+- ``log_jitter_ms``: 99th percentile of the deviation of the logger tick intervals
+  from the logging period while the script is executed,
+- ``log_bytes_per_row``: bytes written to the CSV log per row,
+- ``peak_rss_mb``: peak resident memory of the benchmark process.
+
+The results may be saved to a JSON file and compared with the results of another
+commit (the exit status is 1 if any metric is worse than the baseline by more than
+the tolerance).
+
+Run from the ``src`` directory:
+
+    python -m benchmarks.bench_suite --output results.json
+    python -m benchmarks.bench_suite --baseline results.json
+"""
+
+import argparse
+import contextlib
+import json
+import math
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import numpy as np
+from bluesky.run_engine import RunEngine
+from ophyd import Component as Cpt
+from ophyd import Signal
+from ophyd.sim import SynAxis
+
+from benchmarks.bench_dispatch import run_benchmark as run_dispatch_benchmark
+from megatron.context import create_shared_context
+from megatron.interpreter import MegatronInterpreter
+from megatron.logger import ts_periodic_logging_wrapper
+from megatron.signal_registry import find_script_signals
+
+_src_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+DEFAULT_SCRIPT = os.path.join(_src_dir, "scripts", "MLL", "2022_2nd 40BL rate test G1 and 2_250W_8pctN2.txt")
+
+# Metric -> 1 if higher is better, -1 if lower is better
+METRICS = {
+    "lines_per_second": 1,
+    "messages_per_command": -1,
+    "dispatch_us": -1,
+    "log_jitter_ms": -1,
+    "log_bytes_per_row": -1,
+    "peak_rss_mb": -1,
+}
+
+
+class _SimGalil(SynAxis):
+    """
+    Simulated Galil motor with the signals accessed by the motor commands.
+    """
+
+    channel_enable = Cpt(Signal, value=0, kind="omitted")
+    motor_done_move = Cpt(Signal, value=1, kind="omitted")
+    home_reverse = Cpt(Signal, value=0, kind="omitted")
+    homing_monitor = Cpt(Signal, value=0, kind="omitted")
+    homing_velocity = Cpt(Signal, value=0, kind="omitted")
+    error_limit = Cpt(Signal, value=0, kind="omitted")
+    integrator_limit = Cpt(Signal, value=0, kind="omitted")
+    kp = Cpt(Signal, value=0, kind="omitted")
+    ki = Cpt(Signal, value=0, kind="omitted")
+    kd = Cpt(Signal, value=0, kind="omitted")
+
+
+class _VirtualClock:
+    """
+    Replacement of the RunEngine 'sleep' command that advances the virtual time.
+    """
+
+    def __init__(self):
+        self.time = 0.0
+
+    async def sleep(self, msg):
+        self.time += msg.args[0]
+
+
+async def _condition_met(msg):
+    # No status is added to the group, so the following 'wait' completes immediately
+    return None
+
+
+def _limit_messages(plan, max_messages, is_stopped):
+    """
+    Pass through at most ``max_messages`` messages of the plan, stop when ``is_stopped()`` is ``True``.
+    """
+    response = None
+    for _ in range(max_messages):
+        if is_stopped():
+            break
+        try:
+            msg = plan.send(response)
+        except StopIteration:
+            return
+        response = yield msg
+    plan.close()
+
+
+def _create_interpreter(script_path, optimize=False):
+    """
+    Returns the interpreter with the simulated devices for all signals referenced by the script.
+    """
+    devices = {
+        "galil": _SimGalil(name="galil"),
+        "galil_val": Signal(name="galil_val", value=0),
+        "galil_rbv": Signal(name="galil_rbv", value=0),
+    }
+    device_mapping = {}
+    for n, signal_name in enumerate(find_script_signals(script_path)):
+        device_name = f"sim_signal_{n}"
+        devices[device_name] = Signal(name=device_name, value=0)
+        device_mapping[signal_name] = device_name
+    context = create_shared_context(devices)
+    context.device_mapping = {**context.device_mapping, **device_mapping}
+    return MegatronInterpreter(shared_context=context, optimize=optimize)
+
+
+def _run_script(script_path, max_messages, log_file_path=None, log_period=0.01, optimize=False):
+    """
+    Execute the script. Returns the dictionary with the number of executed instructions,
+    RunEngine messages, elapsed (wall) time and virtual time.
+    """
+    interpreter = _create_interpreter(script_path, optimize)
+    RE = RunEngine({})
+    clock = _VirtualClock()
+    RE.register_command("sleep", clock.sleep)
+    RE.register_command("set_condition", _condition_met)
+    RE.register_command("set_conditions", _condition_met)
+
+    counts = {"instructions": 0, "messages": 0}
+    execute_instruction = interpreter.execute_instruction
+    exited = []
+
+    def counting_execute_instruction(instruction):
+        counts["instructions"] += 1
+        if instruction.command == "exit":
+            # 'exit' raises SystemExit, which would stop the RunEngine event loop
+            exited.append(instruction)
+            return iter(())
+        return execute_instruction(instruction)
+
+    def msg_hook(msg):
+        counts["messages"] += 1
+
+    interpreter.execute_instruction = counting_execute_instruction
+    RE.msg_hook = msg_hook
+
+    plan = _limit_messages(interpreter.execute_script(script_path), max_messages, lambda: bool(exited))
+    if log_file_path:
+        plan = ts_periodic_logging_wrapper(
+            plan, interpreter.context.logged_signals, log_file_path, period=log_period, flush_interval=0.5
+        )
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        start = time.perf_counter()
+        RE(plan)
+        elapsed = time.perf_counter() - start
+    return dict(counts, elapsed=elapsed, virtual_time=clock.time)
+
+
+def _read_log_timestamps(log_file_path):
+    timestamps = []
+    with open(log_file_path, "rt") as f:
+        next(f, None)
+        for line in f:
+            if line.strip():
+                timestamps.append(datetime.fromisoformat(line.split(",", 1)[0]).timestamp())
+    return np.array(timestamps)
+
+
+def run_suite(script_path=DEFAULT_SCRIPT, max_messages=100000, log_period=0.01, n_dispatch=100000, optimize=False):
+    """
+    Run the benchmarks. Returns the dictionary of the metrics (see ``METRICS``) and the details.
+    """
+    results = {"script": os.path.relpath(script_path, _src_dir), "max_messages": max_messages, "optimize": optimize}
+
+    run = _run_script(script_path, max_messages, optimize=optimize)
+    results["instructions"] = run["instructions"]
+    results["virtual_time_s"] = run["virtual_time"]
+    results["elapsed_s"] = run["elapsed"]
+    results["lines_per_second"] = run["instructions"] / run["elapsed"]
+    results["messages_per_command"] = run["messages"] / max(run["instructions"], 1)
+
+    dispatch = run_dispatch_benchmark(n_dispatch)
+    results["dispatch_us"] = dispatch["registry"] * 1e6
+    results["dispatch_bound_us"] = dispatch["bound"] * 1e6
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        log_file_path = os.path.join(tmp_dir, "log.csv")
+        run = _run_script(script_path, max_messages, log_file_path, log_period, optimize)
+        timestamps = _read_log_timestamps(log_file_path) if os.path.exists(log_file_path) else np.array([])
+        n_rows = len(timestamps)
+        log_bytes = os.path.getsize(log_file_path) if n_rows else 0
+    intervals = np.diff(timestamps)
+    results["log_rows"] = n_rows
+    results["log_bytes"] = log_bytes
+    results["log_bytes_per_row"] = log_bytes / n_rows if n_rows else math.nan
+    results["log_jitter_ms"] = (
+        float(np.percentile(np.abs(intervals - log_period), 99)) * 1000 if len(intervals) else math.nan
+    )
+    results["log_max_interval_ms"] = float(intervals.max()) * 1000 if len(intervals) else math.nan
+
+    # ru_maxrss is in kilobytes on Linux
+    results["peak_rss_mb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """
+    Compare the metrics with the baseline. Returns the list of
+    ``(metric, value, baseline value, change, regressed)``.
+    """
+    comparison = []
+    for metric, direction in METRICS.items():
+        value, base = results.get(metric), baseline.get(metric)
+        if value is None or base is None or not base or math.isnan(value) or math.isnan(base):
+            continue
+        change = (value - base) / base
+        comparison.append((metric, value, base, change, change * direction < -tolerance))
+    return comparison
+
+
+def _get_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=_src_dir, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the interpreter, the command dispatch and the logger.")
+    parser.add_argument("-s", "--script", type=str, default=DEFAULT_SCRIPT, help="Script used as the fixture.")
+    parser.add_argument(
+        "-m", "--max-messages", type=int, default=100000, help="Maximum number of RunEngine messages of each run."
+    )
+    parser.add_argument("--log-period", type=float, default=0.01, help="Logging period (seconds).")
+    parser.add_argument("-O", "--optimize", action="store_true", help="Optimize the scripts (see megatron.optimizer).")
+    parser.add_argument("-o", "--output", type=str, default=None, help="Save the results to the JSON file.")
+    parser.add_argument("-b", "--baseline", type=str, default=None, help="Compare with the results (JSON file).")
+    parser.add_argument(
+        "-t", "--tolerance", type=float, default=0.2, help="Relative change of the metrics considered a regression."
+    )
+    args = parser.parse_args()
+
+    results = run_suite(args.script, args.max_messages, args.log_period, optimize=args.optimize)
+    results["commit"] = _get_commit()
+    for key, value in results.items():
+        print(f"{key:>22}: {value:.4g}" if isinstance(value, float) else f"{key:>22}: {value}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, "r") as f:
+            baseline = json.load(f)
+        print(f"\nComparison with {baseline.get('commit') or args.baseline}:")
+        regressed = False
+        for metric, value, base, change, is_regression in compare(results, baseline, args.tolerance):
+            regressed = regressed or is_regression
+            status = "REGRESSION" if is_regression else "ok"
+            print(f"{metric:>22}: {value:10.4g} (baseline {base:10.4g}, {change:+7.1%})  {status}")
+        sys.exit(1 if regressed else 0)
+
+
+if __name__ == "__main__":
+    main()
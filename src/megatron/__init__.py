@@ -1,7 +1,62 @@
-from .interpreter import *
-from .megatron_control import *
-from .motor_control import *
-from .exceptions import *
-from .support import *
-from .context import *
-from .logger import *
+# The submodules are imported when their names are first accessed (PEP 562), so that
+# the tools that do not execute scripts do not pay for importing bluesky and ophyd.
+# The names are resolved as by 'from .<submodule> import *' in this order (the names
+# of the later submodules take precedence).
+import importlib
+
+_submodules = (
+    "interpreter",
+    "compiler",
+    "script_cache",
+    "registry",
+    "signal_cache",
+    "megatron_control",
+    "motor_control",
+    "exceptions",
+    "support",
+    "context",
+    "logger",
+    "log_archive",
+    "log_reader",
+    "dry_run",
+    "validator",
+    "query",
+    "signal_registry",
+    "metrics",
+    "trace",
+    "optimizer",
+    "checkpoint",
+)
+
+
+def _public_names(module):
+    names = getattr(module, "__all__", None)
+    if names is None:
+        names = [_ for _ in vars(module) if not _.startswith("_")]
+    return names
+
+
+def __getattr__(name):
+    if name == "__all__":
+        # 'from megatron import *' imports all submodules
+        return __dir__()
+    if name in _submodules:
+        return importlib.import_module(f"{__name__}.{name}")
+    if name.startswith("_"):
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    for submodule in reversed(_submodules):
+        module = importlib.import_module(f"{__name__}.{submodule}")
+        if name in _public_names(module):
+            value = getattr(module, name)
+            globals()[name] = value
+            return value
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__():
+    names = {_ for _ in globals() if not _.startswith("_")} - {"importlib"}
+    names.update(_submodules)
+    for submodule in _submodules:
+        module = importlib.import_module(f"{__name__}.{submodule}")
+        names.update(_public_names(module))
+    return sorted(names)
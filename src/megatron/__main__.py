@@ -0,0 +1,4 @@
+import sys
+from megatron.cli import main
+
+sys.exit(main())
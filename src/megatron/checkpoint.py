@@ -0,0 +1,351 @@
+"""
+Checkpoints of the script execution.
+
+While the script is executed, the interpreter (see ``MegatronInterpreter``) saves its
+position before each instruction: the stack of the executed scripts (the top-level
+script and the sub-scripts called by 'run'), the instruction index and the loop
+counters of each script, and the state of the context changed by the commands
+(the motion parameters set by 'pa', 'pr' and 'sp', the logged and plotted signals,
+the logging settings and the 'failif' conditions). An interrupted run is resumed
+at the saved instruction without executing the preceding instructions; the instruction
+that was interrupted (e.g. a timer or a move) is executed again.
+
+The checkpoint file has two fixed-size slots written alternately with a single ``pwrite``
+(without ``fsync``). Each slot holds the sequence number, the length and the CRC of
+the JSON state, so the last complete state is found even if the process is killed
+while a slot is written.
+"""
+
+import os
+import json
+import time
+import struct
+import zlib
+from megatron.exceptions import CheckpointError
+
+CHECKPOINT_VERSION = 1
+
+SLOT_SIZE = 1 << 16
+
+_magic = b"MEGCKPT1"
+_header = struct.Struct("<8sQII")  # Magic, sequence number, length and CRC32 of the state
+
+# Fields of the context changed by the motion commands, saved with each checkpoint
+_motion_fields = ("galil_abs_rel", "galil_pos", "galil_speed")
+
+# Commands that change the other saved fields of the context
+_context_commands = frozenset(("log", "lograte", "plot", "failif", "failifoff"))
+
+
+class ScriptFrame:
+    """
+    Position in the script executed by the interpreter.
+
+    Parameters
+    ----------
+    script_path : str
+        Absolute path to the script.
+    ip : int
+        Index of the next instruction of the compiled script.
+    loops : list
+        Stack of the active loops, ``[iteration, loop_count]`` (the elements after the
+        first two are not saved).
+    """
+
+    __slots__ = ("script_path", "stat", "ip", "loops", "_prefix")
+
+    def __init__(self, script_path, ip=0, loops=(), stat=None):
+        self.script_path = script_path
+        self.stat = stat if stat is not None else _stat(script_path)
+        self.ip = ip
+        self.loops = loops
+        self._prefix = None
+
+    def to_list(self):
+        return [self.script_path, self.stat, self.ip, [_[:2] for _ in self.loops]]
+
+    def to_json(self):
+        # The frame is serialized for each checkpoint, only the position is formatted each time
+        if self._prefix is None:
+            self._prefix = json.dumps([self.script_path, self.stat])[:-1]
+        loops = ",".join([f"[{_[0]},{_[1]}]" for _ in self.loops])
+        return f"{self._prefix},{self.ip},[{loops}]]"
+
+    @classmethod
+    def from_list(cls, data):
+        script_path, stat, ip, loops = data
+        return cls(script_path, ip, [list(_) for _ in loops], stat=list(stat) if stat is not None else [])
+
+
+def _stat(script_path):
+    try:
+        st = os.stat(script_path)
+    except OSError:
+        return None
+    return [st.st_size, st.st_mtime_ns]
+
+
+def _format_number(value):
+    text = repr(value)
+    # 'nan' and 'inf' are not valid JSON numbers
+    return text if text[-1].isdigit() else json.dumps(value)
+
+
+def save_context_state(context):
+    """
+    Returns the state of the context changed by the commands (JSON-serializable).
+    """
+    log_settings = context.log_settings
+    return {
+        "galil_abs_rel": context.galil_abs_rel,
+        "galil_pos": context.galil_pos,
+        "galil_speed": context.galil_speed,
+        "logged_signals": list(context.logged_signals),
+        "plotted_signals": {k: list(v) for k, v in context.plotted_signals.items()},
+        "log_period": log_settings.period,
+        "log_settings": {
+            k: [v.rate, v.deadband, v.rdeadband] for k, v in log_settings.signals.items()
+        },
+        "failif_conditions": {k: list(v) for k, v in getattr(context, "failif_conditions", {}).items()},
+    }
+
+
+def restore_context_state(context, state):
+    """
+    Restore the state saved by ``save_context_state``. The logged signals are added to
+    ``context.logged_signals`` and the 'failif' conditions are set again.
+    """
+    from megatron.megatron_control import failif
+    from megatron.signal_cache import signal_cache
+
+    context.galil_abs_rel = state["galil_abs_rel"]
+    context.galil_pos = state["galil_pos"]
+    context.galil_speed = state["galil_speed"]
+    for signal_name in state["logged_signals"]:
+        if signal_name in context.device_mapping:
+            signal = getattr(context.devices, context.device_mapping[signal_name])
+            context.logged_signals[signal_name] = signal
+            signal_cache.add(signal)
+    context.plotted_signals.update({k: tuple(v) for k, v in state["plotted_signals"].items()})
+    context.log_settings.period = state["log_period"]
+    for signal_name, (rate, deadband, rdeadband) in state["log_settings"].items():
+        context.log_settings.set_signal(signal_name, rate=rate, deadband=deadband, rdeadband=rdeadband)
+    for pv_name, (expected_value, fail_script) in state["failif_conditions"].items():
+        for _ in failif((pv_name, expected_value, fail_script), context):
+            pass
+
+
+class Checkpoint:
+    """
+    Saved execution state (see ``load_checkpoint``).
+
+    Attributes
+    ----------
+    frames : list(ScriptFrame)
+        Stack of the executed scripts, the top-level script is the first. The list
+        is empty if the script was completed.
+    context : dict
+        State of the context (see ``save_context_state``).
+    options : dict
+        Options of the interpreter that change the compiled scripts.
+    time : float
+        Time when the checkpoint was saved (seconds since the epoch).
+    instructions : int
+        Number of the instructions executed before the checkpoint.
+    """
+
+    def __init__(self, frames, context, options, time=None, instructions=0):
+        self.frames = frames
+        self.context = context
+        self.options = options
+        self.time = time
+        self.instructions = instructions
+
+    @property
+    def completed(self):
+        return not self.frames
+
+    def to_dict(self):
+        return {
+            "version": CHECKPOINT_VERSION,
+            "time": self.time,
+            "instructions": self.instructions,
+            "options": self.options,
+            "frames": [_.to_list() for _ in self.frames],
+            "motion": {_: self.context[_] for _ in _motion_fields},
+            "context": {k: v for k, v in self.context.items() if k not in _motion_fields},
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        if data.get("version") != CHECKPOINT_VERSION:
+            raise CheckpointError(f"Unsupported checkpoint version: {data.get('version')!r}")
+        return cls(
+            [ScriptFrame.from_list(_) for _ in data["frames"]], {**data["context"], **data["motion"]},
+            data["options"], data["time"], data["instructions"]
+        )
+
+    def check(self, options):
+        """
+        Check that the checkpoint can be resumed: the scripts are unchanged and the
+        interpreter ``options`` are the same (the instruction indices depend on them).
+
+        Raises
+        ------
+        CheckpointError
+        """
+        if self.completed:
+            raise CheckpointError("The script was completed, there is nothing to resume")
+        if self.options != options:
+            raise CheckpointError(f"The checkpoint was saved with different options: {self.options}")
+        for frame in self.frames:
+            if _stat(frame.script_path) != frame.stat:
+                raise CheckpointError(f"The script was changed after the checkpoint: {frame.script_path!r}")
+
+    def format(self):
+        if self.completed:
+            return "Completed"
+        saved = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(self.time))
+        lines = [f"Saved {saved} after {self.instructions} instructions"]
+        for depth, frame in enumerate(self.frames):
+            loops = ", ".join(f"{it}/{count}" for it, count, *_ in frame.loops)
+            lines.append(
+                f"{'  ' * depth}{frame.script_path}: instruction {frame.ip}" + (f", loops {loops}" if loops else "")
+            )
+        return "\n".join(lines)
+
+
+class CheckpointWriter:
+    """
+    Writes the execution state to the checkpoint file (see the module documentation).
+    The interpreter calls ``push`` and ``pop`` when the scripts are started and completed
+    and ``save`` before each instruction. Only the position and the motion parameters
+    are serialized for each checkpoint, the rest of the context state is serialized
+    again after the commands that change it.
+
+    Parameters
+    ----------
+    path : str
+        Path to the checkpoint file. The file is replaced.
+    every : int
+        Save the state before every ``every``-th instruction. The instructions executed
+        after the last saved state are executed again when the run is resumed.
+    """
+
+    def __init__(self, path, every=1):
+        self.path = path
+        self.every = every
+        self.context = None  # Set by the interpreter (see ``bind``)
+        self.options = None
+        self.frames = []
+        self.instructions = 0
+        self._countdown = 0
+        self._sequence = 0
+        self._fd = None
+        self._context_json = None  # Serialized state of the context without the motion fields
+        self._options_json = None
+        self._context_changed = False
+
+    def bind(self, context, options):
+        """
+        Set the shared context and the options of the interpreter that change the compiled scripts.
+        """
+        self.context = context
+        self.options = options
+
+    def open(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+        return self
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def push(self, script_path):
+        frame = ScriptFrame(script_path)
+        self.frames.append(frame)
+        return frame
+
+    def pop(self):
+        self.frames.pop()
+
+    def save(self, frame, ip, loops, command=None):
+        """
+        Save the position before executing the instruction ``ip`` (``command``) of the ``frame``.
+        """
+        frame.ip = ip
+        frame.loops = loops
+        if self._context_changed:
+            self._context_json = None
+        self._context_changed = command in _context_commands
+        self.instructions += 1
+        self._countdown -= 1
+        if self._countdown <= 0:
+            self._countdown = self.every
+            self.write()
+
+    def write(self, completed=False):
+        """
+        Write the state to the checkpoint file.
+        """
+        if self._fd is None:
+            self.open()
+        context = self.context
+        if self._context_json is None:
+            state = save_context_state(context)
+            self._context_json = json.dumps({k: v for k, v in state.items() if k not in _motion_fields})
+        if self._options_json is None:
+            self._options_json = json.dumps(self.options)
+        # Same as json.dumps(Checkpoint(...).to_dict()), formatted directly since this is done for each instruction
+        frames = "" if completed else ",".join([_.to_json() for _ in self.frames])
+        motion = ",".join([f'"{_}":{_format_number(getattr(context, _))}' for _ in _motion_fields])
+        data = (
+            f'{{"version":{CHECKPOINT_VERSION},"time":{time.time()!r},"instructions":{self.instructions},'
+            f'"options":{self._options_json},"frames":[{frames}],"motion":{{{motion}}},"context":{self._context_json}}}'
+        ).encode()
+        if len(data) + _header.size > SLOT_SIZE:
+            raise CheckpointError(f"The execution state is too large: {len(data)} bytes")
+        self._sequence += 1
+        header = _header.pack(_magic, self._sequence, len(data), zlib.crc32(data))
+        os.pwrite(self._fd, header + data, (self._sequence % 2) * SLOT_SIZE)
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def load_checkpoint(path):
+    """
+    Returns the last complete ``Checkpoint`` saved to the file.
+
+    Raises
+    ------
+    CheckpointError
+        The file does not exist or does not contain a complete checkpoint.
+    """
+    try:
+        with open(path, "rb") as f:
+            data = f.read(2 * SLOT_SIZE)
+    except OSError as ex:
+        raise CheckpointError(f"Failed to read the checkpoint {path!r}: {ex}")
+
+    best = None
+    for offset in (0, SLOT_SIZE):
+        slot = data[offset:offset + SLOT_SIZE]
+        if len(slot) < _header.size:
+            continue
+        magic, sequence, length, crc = _header.unpack_from(slot)
+        state = slot[_header.size:_header.size + length]
+        if magic != _magic or len(state) != length or zlib.crc32(state) != crc:
+            continue
+        if best is None or sequence > best[0]:
+            best = (sequence, state)
+    if best is None:
+        raise CheckpointError(f"No complete checkpoint in {path!r}")
+    return Checkpoint.from_dict(json.loads(best[1]))
@@ -0,0 +1,210 @@
+"""
+Command line interface of Megatron::
+
+    python -m megatron run <script>           # execute the script
+    python -m megatron check <paths>          # validate the scripts (see megatron.validator)
+    python -m megatron estimate <script>      # estimate the execution time (see megatron.dry_run)
+    python -m megatron search <paths>         # query the scripts (see megatron.query)
+    python -m megatron optimize <paths>       # report the optimizer changes (see megatron.optimizer)
+
+Only the modules needed by the subcommand are imported: the tools that do not execute
+scripts do not import ophyd or create the RunEngine.
+"""
+
+import os
+import sys
+import argparse
+
+_subcommands = {
+    "run": "Execute the script.",
+    "check": "Validate the scripts and the sub-scripts they run.",
+    "estimate": "Estimate the execution time of the script (dry run).",
+    "search": "Query the scripts by their structure (loops, commands and their arguments).",
+    "optimize": "Report the changes made by the script optimizer ('run --optimize').",
+}
+
+
+def run_main(argv=None, prog=None):
+    """
+    Execute the script with the RunEngine. Returns the exit status.
+    """
+    parser = argparse.ArgumentParser(prog=prog, description=_subcommands["run"])
+    parser.add_argument("path", type=str, help="The path to the Megatron script to execute.")
+    parser.add_argument(
+        "-s", "--signals", type=str, default="signals.yaml", help="Signal registry (YAML or CSV file)."
+    )
+    parser.add_argument("--timeout", type=float, default=10.0, help="Connection timeout of all signals (seconds).")
+    parser.add_argument("--prefix", type=str, default="Test{DMC:1}A", help="PV prefix of the Galil motor.")
+    parser.add_argument("--log-dir", type=str, default="./logs", help="Directory of the logs.")
+    parser.add_argument("--log-format", choices=("csv", "parquet"), default="csv", help="Format of the log.")
+    parser.add_argument("--streaming", action="store_true", help="Stream the script instead of compiling it.")
+    parser.add_argument(
+        "--scripts-root", type=str, default=None,
+        help="Root of the scripts tree, the sub-scripts are not searched above it (the current directory by default)."
+    )
+    parser.add_argument(
+        "-O", "--optimize", action="store_true",
+        help="Remove blank lines, no-op commands and 'l1' loops and merge the timers (ignored with --streaming)."
+    )
+    parser.add_argument(
+        "--metrics", type=str, default=None, help="Export the command latency histograms to the Prometheus text file."
+    )
+    parser.add_argument(
+        "--metrics-json", type=str, default=None, help="Export the command latency histograms to the JSON file."
+    )
+    parser.add_argument("--metrics-interval", type=float, default=10.0, help="Export interval of the metrics (seconds).")
+    parser.add_argument("--no-metrics", action="store_true", help="Do not record the command latencies.")
+    parser.add_argument(
+        "--trace", type=str, default=None,
+        help="Event trace (JSONL file), '<log-dir>/<timestamp>.trace.jsonl' by default."
+    )
+    parser.add_argument("--no-trace", action="store_true", help="Do not write the event trace.")
+    parser.add_argument(
+        "--checkpoint", type=str, default=None,
+        help="Checkpoint file of the execution position, '<log-dir>/<script name>.checkpoint' by default."
+    )
+    parser.add_argument(
+        "--checkpoint-every", type=int, default=1, help="Save the checkpoint before every N-th instruction."
+    )
+    parser.add_argument("--no-checkpoint", action="store_true", help="Do not save the checkpoints.")
+    parser.add_argument(
+        "--resume", action="store_true", help="Resume the interrupted run of the script from the checkpoint."
+    )
+    parser.add_argument("-q", "--quiet", action="store_true", help="Report only the warnings and errors.")
+    parser.add_argument("-v", "--verbose", action="store_true", help="Report also the debugging messages.")
+    parser.add_argument(
+        "--console-rate", type=float, default=20.0, help="Maximum number of the messages printed per second."
+    )
+    args = parser.parse_args(argv)
+
+    from datetime import datetime
+    from bluesky.utils import ProgressBarManager
+    from bluesky.run_engine import RunEngine
+    import bluesky.preprocessors as bp
+    from ophyd import EpicsSignal, EpicsSignalRO
+    from megatron.context import create_shared_context
+    from megatron.interpreter import MegatronInterpreter
+    from megatron.logger import ts_periodic_logging_decorator
+    from megatron.metrics import CommandMetrics
+    from megatron.trace import start_trace
+    from megatron.checkpoint import CheckpointWriter, load_checkpoint
+    from megatron.exceptions import CheckpointError
+    from megatron.script_cache import CACHE_DIR_NAME
+    from megatron.signal_registry import SignalRegistry, connect_signals, find_script_signals
+    from megatron.support import register_custom_instructions, EpicsMotorGalil
+    from megatron.validator import CACHE_FILE_NAME
+
+    checkpoint_path = args.checkpoint or os.path.join(args.log_dir, os.path.basename(args.path) + ".checkpoint")
+    checkpoint = None
+    if args.resume:
+        try:
+            if args.streaming:
+                raise CheckpointError("The streaming mode can not be resumed")
+            checkpoint = load_checkpoint(checkpoint_path)
+            if not checkpoint.completed and checkpoint.frames[0].script_path != os.path.abspath(args.path):
+                raise CheckpointError(f"The checkpoint was saved for {checkpoint.frames[0].script_path!r}")
+            checkpoint.check(checkpoint.options)
+        except CheckpointError as ex:
+            print(ex)
+            return 1
+        print(f"Resuming: {checkpoint.format()}")
+
+    galil = EpicsMotorGalil(args.prefix, name="galil")
+    galil_val = EpicsSignal(f"{args.prefix}.VAL", name="galil_val", auto_monitor=True)
+    galil_rbv = EpicsSignalRO(f"{args.prefix}.RBV", name="galil_rbv", auto_monitor=True)
+
+    # Only the signals referenced by the script (and its sub-scripts) are created,
+    # all signals are connected concurrently
+    registry = SignalRegistry.from_file(args.signals) if os.path.isfile(args.signals) else SignalRegistry()
+    devices = {"galil": galil, "galil_val": galil_val, "galil_rbv": galil_rbv}
+    signal_names = find_script_signals(
+        args.path, cache_path=os.path.join(CACHE_DIR_NAME, CACHE_FILE_NAME), scripts_root=args.scripts_root
+    )
+    devices.update(registry.create_signals(signal_names))
+    try:
+        connect_signals(devices.values(), timeout=args.timeout)
+    except TimeoutError as ex:
+        print(ex)
+        return 1
+
+    RE = RunEngine({})
+    RE.waiting_hook = ProgressBarManager()
+    register_custom_instructions(re=RE)
+
+    context = create_shared_context(devices, registry)
+    metrics = None if args.no_metrics else CommandMetrics(args.metrics, args.metrics_json, args.metrics_interval)
+    checkpoint_writer = None
+    if not (args.no_checkpoint or args.streaming):
+        checkpoint_writer = CheckpointWriter(checkpoint_path, every=args.checkpoint_every)
+    interpreter = MegatronInterpreter(
+        shared_context=context, streaming=args.streaming, metrics=metrics, optimize=args.optimize,
+        checkpoint=checkpoint_writer, scripts_root=args.scripts_root
+    )
+    if checkpoint is not None:
+        try:
+            checkpoint.check(interpreter.compile_options)
+        except CheckpointError as ex:
+            print(ex)
+            return 1
+
+    extension = ".csv" if args.log_format == "csv" else ".parquet"
+    log_name = datetime.now().strftime("%Y%m%d_%H%M%S")
+    log_file_path = os.path.join(args.log_dir, log_name + extension)
+    trace_path = None if args.no_trace else args.trace or os.path.join(args.log_dir, log_name + ".trace.jsonl")
+
+    @bp.reset_positions_decorator([galil.velocity])
+    @ts_periodic_logging_decorator(
+        signals=context.logged_signals, log_file_path=log_file_path, log_settings=context.log_settings,
+        log_format=args.log_format
+    )
+    def run_with_logging(script_path):
+        if checkpoint is not None:
+            yield from interpreter.resume_script(checkpoint)
+        else:
+            yield from interpreter.execute_script(script_path)
+
+    trace = start_trace(trace_path, quiet=args.quiet, verbose=args.verbose, console_rate=args.console_rate)
+    try:
+        RE(run_with_logging(args.path))
+    finally:
+        if checkpoint_writer is not None:
+            checkpoint_writer.close()
+        trace.stop()
+        if metrics is not None:
+            metrics.export()
+            print(metrics.summary())
+    return 0
+
+
+def _get_main(subcommand):
+    if subcommand == "run":
+        return run_main
+    if subcommand == "check":
+        from megatron.validator import main
+    elif subcommand == "estimate":
+        from megatron.dry_run import main
+    elif subcommand == "optimize":
+        from megatron.optimizer import main
+    else:
+        from megatron.query import main
+    return main
+
+
+def main(argv=None):
+    """
+    Entry point of the command line interface. Returns the exit status.
+    """
+    parser = argparse.ArgumentParser(
+        prog="megatron", description="Megatron control software.", formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="\n".join(f"  {name:<10}{help}" for name, help in _subcommands.items())
+        + "\n\nRun 'megatron <command> --help' for the options of the command.",
+    )
+    parser.add_argument("command", choices=list(_subcommands), metavar="command", help="Subcommand (see below).")
+    parser.add_argument("args", nargs=argparse.REMAINDER, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    return _get_main(args.command)(args.args, prog=f"megatron {args.command}") or 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
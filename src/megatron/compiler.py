@@ -0,0 +1,261 @@
+import re
+from megatron.exceptions import CommandNotFoundError, InvalidArgumentError, LoopSyntaxError
+
+# Version of the compiled script format. Must be changed each time the compiler output
+# changes, so that the cached compiled scripts are invalidated.
+COMPILER_VERSION = 3
+
+# Opcodes of the compiled instruction array
+OP_NULL = 0     # blank line, yields a single 'null' message
+OP_TIMER = 1    # 't<seconds>' timer
+OP_COMMAND = 2  # regular Megatron or motor command
+OP_LOOP = 3     # 'l<count>' loop start, 'target' is the index of the matching 'n'
+OP_NEXT = 4     # 'n' loop end, 'target' is the index of the matching 'l'
+OP_ERROR = 5    # line that could not be compiled, 'args' holds the error message (see ``is_fatal_error``)
+OP_GROUP = 6    # group of instructions executed together, 'args' holds the instructions
+
+_timer_pattern = re.compile(r"t([\d.]+)", re.IGNORECASE)
+_loop_pattern = re.compile(r"l(\d+)", re.IGNORECASE)
+_token_pattern = re.compile(r'(?:(?:"([^"]+)")|([^\s,]+))')
+
+
+class Instruction:
+    """
+    Single instruction of a compiled Megatron script.
+
+    Parameters
+    ----------
+    opcode : int
+        One of the ``OP_*`` constants.
+    command : str or None
+        Lower case command name (``OP_TIMER`` and ``OP_COMMAND``).
+    args : tuple
+        Pre-tokenized command arguments. For ``OP_LOOP`` the only element is the loop count,
+        for ``OP_ERROR`` it is the error message followed by the command arguments if they
+        are invalid.
+    handler : callable or None
+        Handler resolved for the command at compile time.
+    target : int or None
+        Jump target of ``OP_LOOP`` and ``OP_NEXT`` instructions.
+    line_no : int
+        Line number (1-based) of the instruction in the source script.
+    """
+
+    __slots__ = ("opcode", "command", "args", "handler", "target", "line_no")
+
+    def __init__(self, opcode, command=None, args=(), handler=None, target=None, line_no=0):
+        self.opcode = opcode
+        self.command = command
+        self.args = args
+        self.handler = handler
+        self.target = target
+        self.line_no = line_no
+
+    def __repr__(self):
+        return (
+            f"Instruction(opcode={self.opcode}, command={self.command!r}, args={self.args!r}, "
+            f"target={self.target}, line_no={self.line_no})"
+        )
+
+
+def tokenize_command(line):
+    """
+    Split a command line into tokens. Quoted strings are returned as single tokens,
+    commas and white space separate the tokens.
+    """
+    return [t[0] or t[1] for t in _token_pattern.findall(line) if t[0] or t[1]]
+
+
+def parse_line(line, line_no=0, resolve_handler=None):
+    """
+    Compile a single script line. Loop instructions are returned without jump targets,
+    they are linked by ``link_loops``.
+
+    Parameters
+    ----------
+    line : str
+        Script line.
+    line_no : int
+        Line number, saved in the instruction.
+    resolve_handler : callable or None
+        Function that accepts a command name and returns its handler or ``None``
+        if the command is not supported. If the handler has ``validate`` method,
+        it is called with the arguments and may raise ``InvalidArgumentError``.
+
+    Returns
+    -------
+    Instruction or None
+        ``None`` is returned for comments.
+    """
+    line = line.strip()
+    if line.startswith("#"):
+        return None
+
+    if not line:
+        return Instruction(OP_NULL, line_no=line_no)
+
+    if line.lower() == "n":
+        return Instruction(OP_NEXT, command="n", line_no=line_no)
+
+    match_t = _timer_pattern.match(line)
+    if match_t:
+        handler = resolve_handler("t") if resolve_handler else None
+        return _make_instruction(OP_TIMER, "t", (match_t.group(1),), handler, line_no)
+
+    match_l = _loop_pattern.match(line)
+    if match_l:
+        return Instruction(OP_LOOP, command="l", args=(int(match_l.group(1)),), line_no=line_no)
+
+    command, *args = tokenize_command(line)
+    command = command.lower()
+    handler = resolve_handler(command) if resolve_handler else None
+    if resolve_handler and handler is None:
+        return Instruction(OP_ERROR, command=command, args=(str(CommandNotFoundError(command)),), line_no=line_no)
+
+    return _make_instruction(OP_COMMAND, command, tuple(args), handler, line_no)
+
+
+def _make_instruction(opcode, command, args, handler, line_no):
+    validate = getattr(handler, "validate", None)
+    if validate is not None:
+        try:
+            validate(args)
+        except InvalidArgumentError as ex:
+            return Instruction(OP_ERROR, command=command, args=(str(ex), args), line_no=line_no)
+    return Instruction(opcode, command=command, args=args, handler=handler, line_no=line_no)
+
+
+def is_fatal_error(instruction):
+    """
+    Returns ``True`` if the ``OP_ERROR`` instruction is a command with invalid arguments.
+    Such command must not be skipped (e.g. a move after 'sp' with an invalid speed would
+    use the previous speed), the interpreter stops the script with ``InvalidArgumentError``.
+    Unknown commands and unmatched loops are only reported.
+    """
+    return len(instruction.args) > 1
+
+
+def raise_fatal_error(instruction):
+    """
+    Raise ``InvalidArgumentError`` for the fatal ``OP_ERROR`` instruction (see ``is_fatal_error``).
+    """
+    raise InvalidArgumentError(instruction.command, list(instruction.args[1]))
+
+
+def link_loops(program):
+    """
+    Compute jump targets of the loop instructions in place. Unmatched 'l' instructions
+    are replaced with errors, unmatched 'n' instructions are reported as unknown commands.
+    The function must be called after each pass that changes the instruction indices.
+    """
+    stack = []
+    for n, instruction in enumerate(program):
+        if instruction.opcode == OP_LOOP:
+            stack.append(n)
+        elif instruction.opcode == OP_NEXT:
+            if stack:
+                start = stack.pop()
+                program[start].target = n
+                instruction.target = start
+            else:
+                program[n] = Instruction(
+                    OP_ERROR, command="n", args=(str(CommandNotFoundError("n")),), line_no=instruction.line_no
+                )
+
+    for n in stack:
+        program[n] = Instruction(
+            OP_ERROR, command="l", args=(str(LoopSyntaxError()),), line_no=program[n].line_no
+        )
+
+    return program
+
+
+def compile_lines(lines, resolve_handler=None):
+    """
+    Compile script lines to a flat array of instructions with pre-tokenized arguments,
+    pre-resolved handlers and precomputed loop jump targets.
+    """
+    program = []
+    parsed_lines = {}  # Scripts repeat the same lines many times, each line is parsed once
+    for line_no, line in enumerate(lines, 1):
+        parsed = parsed_lines.get(line)
+        if parsed is None:
+            parsed = parsed_lines[line] = parse_line(line, line_no, resolve_handler) or False
+        if parsed:
+            program.append(Instruction(parsed.opcode, parsed.command, parsed.args, parsed.handler, line_no=line_no))
+    return link_loops(program)
+
+
+def group_instructions(program, commands, group_handler, *, unique_outputs=False):
+    """
+    Replace runs of consecutive commands from ``commands`` with single ``OP_GROUP``
+    instructions. A run is ended by any other instruction (including blank lines, timers
+    and loop boundaries).
+
+    Parameters
+    ----------
+    program : list(Instruction)
+        Compiled script. The list is not modified, but the jump targets of its loop
+        instructions are updated.
+    commands : tuple(str)
+        Commands that may be grouped.
+    group_handler : callable
+        Handler of the grouped instruction, called with the tuple of grouped instructions
+        and the context.
+    unique_outputs : bool
+        End the run at a second command with the same first argument (output name),
+        so that the order of operations on each output is preserved.
+
+    Returns
+    -------
+    list(Instruction)
+    """
+    result, run, outputs = [], [], set()
+
+    def end_run():
+        if len(run) > 1:
+            result.append(Instruction(OP_GROUP, command="group", args=tuple(run), handler=group_handler,
+                                      line_no=run[0].line_no))
+        else:
+            result.extend(run)
+        run.clear()
+        outputs.clear()
+
+    for instruction in program:
+        if instruction.opcode == OP_COMMAND and instruction.command in commands:
+            if unique_outputs:
+                output = instruction.args[0]
+                if output in outputs:
+                    end_run()
+                outputs.add(output)
+            run.append(instruction)
+        else:
+            end_run()
+            result.append(instruction)
+    end_run()
+
+    return link_loops(result)
+
+
+def group_writes(program, group_handler):
+    """
+    Group consecutive output writes ('setdo' and 'setao'), so that the values are set
+    in parallel. A second write to the same output starts a new group.
+    """
+    return group_instructions(program, ("setdo", "setao"), group_handler, unique_outputs=True)
+
+
+def group_waits(program, group_handler):
+    """
+    Group consecutive 'waitai' and 'waitdi' commands, so that the conditions are
+    evaluated concurrently with a single wait.
+    """
+    return group_instructions(program, ("waitai", "waitdi"), group_handler)
+
+
+def compile_script(script_path, resolve_handler=None):
+    """
+    Read and compile a script file. See ``compile_lines``.
+    """
+    with open(script_path, "r") as script_file:
+        return compile_lines(script_file, resolve_handler)
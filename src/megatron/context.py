@@ -1,4 +1,6 @@
 from types import SimpleNamespace
+from megatron.logger import LogSettings
+from megatron.signal_registry import LazyDevices
 
 _device_mapping = {
     "Galil RBV": "galil_rbv",
@@ -7,19 +9,27 @@ _device_mapping = {
 
 _required_devices = ("galil", "galil_val", "galil_rbv")
 
-def create_shared_context(devices):
+def create_shared_context(devices, registry=None):
+    # Signals of the registry that are not in 'devices' are created when they are first accessed
     for device in _required_devices:
         if device not in devices:
             raise RuntimeError(f"Device {device} is missing in the devices list")
 
+    device_mapping = _device_mapping
+    if registry is not None:
+        device_mapping = {**registry.device_mapping, **_device_mapping}
+
     return SimpleNamespace(
-        devices=SimpleNamespace(**devices),
+        devices=LazyDevices(devices, registry) if registry is not None else SimpleNamespace(**devices),
         galil_abs_rel=0,  # 0 - absolute, 1 - relative
         galil_pos=0,
         galil_speed=1000000,
-        device_mapping=_device_mapping,  
+        device_mapping=device_mapping,  
         required_devices=_required_devices,
         logged_signals={},
+        log_settings=LogSettings(),
+        plotted_signals={},
+        failif_conditions={},  # PV name -> (expected value, fail script) of the active 'failif' conditions
         script_dir = "",
         fail_condition_triggered = False, 
     )
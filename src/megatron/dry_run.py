@@ -0,0 +1,362 @@
+import os
+import bisect
+import sys
+import argparse
+from collections import Counter, defaultdict
+from megatron.compiler import (
+    OP_TIMER, OP_COMMAND, OP_LOOP, OP_NEXT, OP_ERROR, OP_GROUP, is_fatal_error, tokenize_command
+)
+
+
+class CostModel:
+    """
+    Execution times of the commands used by the dry run. Timers ('t') take exactly the
+    requested time, the time of other commands is estimated by the model.
+
+    Parameters
+    ----------
+    command_costs : dict or None
+        Command name -> execution time (seconds), e.g. ``{"waitai": 30, "setdo": 0.05}``.
+        Wait times are the expected times until the conditions are met.
+    default_cost : float
+        Execution time of the commands that are not in ``command_costs``.
+    move_overhead : float
+        Time needed to start the move ('bg'): enabling the channel and stopping the motor.
+    moves_block : bool
+        If ``True``, the move must be completed before the next move is started and before
+        the script ends ('bg' does not wait for the move, so the motion overlaps
+        with the following commands).
+    acceleration : float or None
+        Acceleration of the motor (position units per s^2) used to estimate the time
+        of the move. The acceleration is ignored if ``None``.
+    home_time : float
+        Time of homing the motor ('hm').
+    """
+
+    def __init__(
+        self, command_costs=None, *, default_cost=0.0, move_overhead=0.4, moves_block=False, acceleration=None,
+        home_time=0.0
+    ):
+        self.command_costs = dict(command_costs or {})
+        self.default_cost = default_cost
+        self.move_overhead = move_overhead
+        self.moves_block = moves_block
+        self.acceleration = acceleration
+        self.home_time = home_time
+
+    @classmethod
+    def from_file(cls, path):
+        """
+        Load the cost model from the YAML file with the keys matching the parameters
+        of the constructor.
+        """
+        import yaml
+
+        with open(path, "rt") as f:
+            config = yaml.safe_load(f) or {}
+        return cls(config.pop("command_costs", None), **config)
+
+    def command_time(self, command):
+        return self.command_costs.get(command, self.default_cost)
+
+    def move_time(self, distance, velocity):
+        """
+        Time of the move of the motor over ``distance`` (triangular or trapezoidal
+        velocity profile if the acceleration is set).
+        """
+        distance = abs(distance)
+        if not distance:
+            return 0.0
+        if velocity <= 0:
+            return float("inf")
+        if not self.acceleration:
+            return distance / velocity
+        ramp_distance = velocity ** 2 / self.acceleration
+        if distance <= ramp_distance:
+            return 2 * (distance / self.acceleration) ** 0.5
+        return distance / velocity + velocity / self.acceleration
+
+
+class DryRunReport:
+    """
+    Results of the dry run. All times are in seconds of the virtual clock.
+    """
+
+    def __init__(self, script_path):
+        self.script_path = script_path
+        self.total_time = 0.0
+        self.command_counts = Counter()  # Command -> number of executions
+        self.command_times = defaultdict(float)  # Command -> total time
+        self.section_times = {}  # Section of the top-level script -> total time (including sub-scripts)
+        self.script_times = defaultdict(float)  # Script path -> total time (including nested scripts)
+        self.script_calls = Counter()  # Script path -> number of calls
+        self.move_count = 0
+        self.move_distance = 0.0
+        self.move_time = 0.0
+        self.errors = []  # (script path, line number, message)
+
+    def format(self, top=15):
+        """
+        Returns the human readable report.
+        """
+        lines = [f"Script: {self.script_path}", f"Estimated time: {_format_time(self.total_time)}"]
+        lines.append(
+            f"Moves: {self.move_count}, distance: {self.move_distance:g}, motion time: {_format_time(self.move_time)}"
+        )
+        lines.append("")
+        lines.append("Sections:")
+        for section, t in self.section_times.items():
+            lines.append(f"  {_format_time(t):>14}  {section}")
+        lines.append("")
+        lines.append("Commands:")
+        for command, count in self.command_counts.most_common(top):
+            lines.append(f"  {command:>8}  {count:>9}  {_format_time(self.command_times[command]):>14}")
+        lines.append("")
+        lines.append("Scripts:")
+        for script_path, t in sorted(self.script_times.items(), key=lambda _: -_[1])[:top]:
+            lines.append(f"  {_format_time(t):>14}  {self.script_calls[script_path]:>7} calls  {script_path}")
+        if self.errors:
+            lines.append("")
+            lines.append(f"Errors ({len(self.errors)}):")
+            for script_path, line_no, message in self.errors[:top]:
+                lines.append(f"  {os.path.basename(script_path)}:{line_no}: {message}")
+        return "\n".join(lines)
+
+
+def _format_time(t):
+    if t == float("inf"):
+        return "inf"
+    h, rem = divmod(t, 3600)
+    m, s = divmod(rem, 60)
+    return f"{int(h)}:{int(m):02d}:{s:06.3f}"
+
+
+def _read_sections(script_path, is_command):
+    """
+    Returns the sorted lists of line numbers and names of the sections of the script.
+    Sections start at the comment lines, commented out commands are not section names.
+    """
+    line_numbers, names = [0], ["(start)"]
+    with open(script_path, "rt", encoding="utf-8", errors="replace") as f:
+        for line_no, line in enumerate(f, 1):
+            line = line.strip()
+            if not line.startswith("#"):
+                continue
+            name = line.strip("#* \t")
+            tokens = tokenize_command(name) if name else []
+            if not tokens or is_command(tokens[0].lower()):
+                continue
+            line_numbers.append(line_no)
+            names.append(name)
+    return line_numbers, names
+
+
+class _ExitScript(Exception):
+    """
+    Raised by 'exit' and by the commands with invalid arguments to end the dry run.
+    """
+
+
+class DryRun:
+    """
+    Execution of the script without the RunEngine and devices. Loops and sub-scripts
+    are expanded, timers advance the virtual clock and the time of other commands is
+    estimated by the cost model. The state of the motor (position, speed and
+    absolute/relative mode) is tracked to estimate the time of the moves.
+
+    Parameters
+    ----------
+    interpreter : MegatronInterpreter
+        Interpreter used to compile the scripts and resolve the names of sub-scripts.
+    cost_model : CostModel or None
+        Cost model, the default model if ``None``.
+    max_depth : int
+        Maximum nesting depth of sub-scripts (protects against recursive scripts).
+    """
+
+    def __init__(self, interpreter, cost_model=None, *, max_depth=50):
+        self.interpreter = interpreter
+        self.cost_model = cost_model or CostModel()
+        self.max_depth = max_depth
+
+    def run(self, script_path):
+        """
+        Estimate the execution time of the script.
+
+        Returns
+        -------
+        DryRunReport
+        """
+        script_path = os.path.abspath(os.path.expanduser(script_path))
+        self.report = DryRunReport(script_path)
+        self.clock = 0.0
+        self.position = 0.0
+        self.move_end = 0.0
+        self.abs_rel = self.interpreter.context.galil_abs_rel
+        self.target = self.interpreter.context.galil_pos
+        self.speed = self.interpreter.context.galil_speed
+        self._depth = 0
+        self._sections = _read_sections(script_path, lambda _: self.interpreter.resolve_handler(_) is not None)
+        self._section = None
+        self._section_start = 0.0
+
+        try:
+            self._run_script(script_path)
+        except _ExitScript:
+            pass
+        self._end_section()
+        if self.cost_model.moves_block:
+            self.clock = max(self.clock, self.move_end)
+        self.report.total_time = self.clock
+        return self.report
+
+    def _end_section(self):
+        if self._section is not None:
+            times = self.report.section_times
+            times[self._section] = times.get(self._section, 0.0) + self.clock - self._section_start
+        self._section_start = self.clock
+
+    def _run_script(self, script_path):
+        if self._depth >= self.max_depth:
+            self.report.errors.append((script_path, 0, f"Maximum script depth {self.max_depth} exceeded"))
+            return
+        start = self.clock
+        self._depth += 1
+        try:
+            program = self.interpreter.compile_script(script_path)
+            self._run_program(program, script_path)
+        except OSError as ex:
+            self.report.errors.append((script_path, 0, str(ex)))
+        finally:
+            self._depth -= 1
+            self.report.script_times[script_path] += self.clock - start
+            self.report.script_calls[script_path] += 1
+
+    def _run_program(self, program, script_path):
+        loops = []
+        ip = 0
+        n_instructions = len(program)
+        is_top_level = self._depth == 1
+        line_numbers, names = self._sections
+        while ip < n_instructions:
+            instruction = program[ip]
+            opcode = instruction.opcode
+            if is_top_level:
+                section = names[bisect.bisect_right(line_numbers, instruction.line_no) - 1]
+                if section != self._section:
+                    self._end_section()
+                    self._section = section
+
+            if opcode == OP_LOOP:
+                loop_count = instruction.args[0]
+                if loop_count < 1:
+                    ip = instruction.target + 1
+                    continue
+                loops.append([1, loop_count])
+            elif opcode == OP_NEXT:
+                loop = loops[-1]
+                if loop[0] < loop[1]:
+                    loop[0] += 1
+                    ip = instruction.target + 1
+                    continue
+                loops.pop()
+            elif opcode == OP_TIMER:
+                self._count("t", float(instruction.args[0]))
+            elif opcode == OP_COMMAND:
+                if not self._run_command(instruction.command, instruction.args, script_path):
+                    return
+            elif opcode == OP_GROUP:
+                # Grouped commands are executed in parallel
+                start = self.clock
+                end = start
+                for grouped in instruction.args:
+                    self.clock = start
+                    self._run_command(grouped.command, grouped.args, script_path)
+                    end = max(end, self.clock)
+                self.clock = end
+            elif opcode == OP_ERROR:
+                self.report.errors.append((script_path, instruction.line_no, instruction.args[0]))
+                if is_fatal_error(instruction):
+                    # The interpreter stops the run at the command with invalid arguments
+                    raise _ExitScript()
+            ip += 1
+
+    def _count(self, command, t):
+        self.report.command_counts[command] += 1
+        self.report.command_times[command] += t
+        self.clock += t
+
+    def _run_command(self, command, args, script_path):
+        """
+        Simulate the command. Returns ``False`` if the script is stopped.
+        """
+        cost_model = self.cost_model
+        if command == "t":
+            self._count(command, float(args[0]))
+        elif command == "run":
+            self._count(command, cost_model.command_time(command))
+            script_dir = os.path.dirname(script_path)
+            self._run_script(self.interpreter.resolve_script_path(args[0], script_dir))
+        elif command == "stop":
+            self._count(command, 0.0)
+            return False
+        elif command == "exit":
+            self._count(command, 0.0)
+            raise _ExitScript()
+        elif command in ("pa", "pr"):
+            self.abs_rel = 0 if command == "pa" else 1
+            self.target = float(args[0])
+            self._count(command, cost_model.command_time(command))
+        elif command == "sp":
+            self.speed = float(args[0])
+            self._count(command, cost_model.command_time(command))
+        elif command == "bg":
+            self._move()
+        elif command == "hm":
+            self._count(command, cost_model.home_time)
+            self.position = 0.0
+        else:
+            self._count(command, cost_model.command_time(command))
+        return True
+
+    def _move(self):
+        cost_model = self.cost_model
+        if cost_model.moves_block:
+            self.clock = max(self.clock, self.move_end)
+        # Positions and speeds are in the units of the script (see 'bg' command)
+        target = self.target / 1000000
+        distance = target if self.abs_rel else target - self.position
+        self.position += distance
+        motion_time = cost_model.move_time(distance, self.speed / 1000000)
+
+        self._count("bg", cost_model.move_overhead)
+        self.move_end = self.clock + motion_time
+        report = self.report
+        report.move_count += 1
+        report.move_distance += abs(distance)
+        report.move_time += motion_time
+
+
+def main(argv=None, prog=None):
+    """
+    Command line interface of the dry run.
+    """
+    parser = argparse.ArgumentParser(prog=prog, description="Estimate the execution time of a Megatron script.")
+    parser.add_argument("path", type=str, help="The path to the Megatron script.")
+    parser.add_argument("-c", "--cost-model", type=str, default=None, help="Cost model (YAML file).")
+    parser.add_argument("--moves-block", action="store_true", help="Moves are completed before the next move.")
+    args = parser.parse_args(argv)
+
+    from megatron.context import create_shared_context, _required_devices
+    from megatron.interpreter import MegatronInterpreter
+
+    cost_model = CostModel.from_file(args.cost_model) if args.cost_model else CostModel()
+    cost_model.moves_block = cost_model.moves_block or args.moves_block
+    # Devices are not accessed by the dry run
+    context = create_shared_context({_: None for _ in _required_devices})
+    interpreter = MegatronInterpreter(shared_context=context)
+    print(DryRun(interpreter, cost_model).run(args.path).format())
+
+
+if __name__ == "__main__":
+    sys.exit(main())
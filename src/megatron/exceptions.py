@@ -26,6 +26,10 @@ class InvalidScriptPathError(Exception):
         self.path = path
         super().__init__(f"Error: Script path '{path}' is invalid or unreadable")
 
+class CheckpointError(MegatronError):
+    """Raised when the checkpoint cannot be saved, loaded or resumed."""
+    pass
+
 class StopScript(Exception):
     """Exception to signal the interpreter to stop the current script."""
     pass
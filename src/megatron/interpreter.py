@@ -1,133 +1,318 @@
-import re
 import os
+import time
+import logging
+import functools
 from bluesky import plan_stubs as bps
-from megatron.megatron_control import process_megatron_command
-from megatron.motor_control import process_motor_command
+from megatron.megatron_control import megatron_command_registry, set_outputs, wait_for_all
+from megatron.motor_control import motor_command_registry
+from megatron.registry import registry_signature
+from megatron.compiler import (
+    OP_NULL, OP_TIMER, OP_COMMAND, OP_LOOP, OP_NEXT, OP_ERROR, OP_GROUP, compile_script, group_waits,
+    group_writes, is_fatal_error, parse_line, raise_fatal_error, tokenize_command
+)
+from megatron.script_cache import CompiledScriptCache, SubScriptCache, default_scripts_root
+from megatron.dry_run import DryRun
+from megatron.optimizer import optimize_program
+from megatron.checkpoint import restore_context_state
 from megatron.exceptions import CommandNotFoundError, LoopSyntaxError, StopScript
 
+_log = logging.getLogger(__name__)
+
 class MegatronInterpreter:
-    def __init__(self, *, shared_context):
+    def __init__(
+        self, *, shared_context, use_cache=True, cache_dir=None, streaming=False, group_writes=True,
+        group_waits=True, simultaneous_waits=False, metrics=None, optimize=False, checkpoint=None, scripts_root=None
+    ):
         self.context = shared_context
+        self.streaming = streaming  # Stream the top-level script instead of compiling it
+        self.group_writes = group_writes  # Set consecutive 'setdo'/'setao' outputs in parallel
+        self.group_waits = group_waits  # Wait for consecutive 'waitai'/'waitdi' conditions together
+        self.simultaneous_waits = simultaneous_waits  # Grouped conditions must be met at the same time
+        self.optimize = optimize  # Apply the peephole optimizer to the compiled scripts (see ``megatron.optimizer``)
+        self.optimization_reports = {}  # Script path -> ``OptimizationReport``
+        # Saves the execution position (``CheckpointWriter``), not used in the streaming mode
+        self.checkpoint = checkpoint
+        if checkpoint is not None:
+            checkpoint.bind(shared_context, self.compile_options)
+        self.metrics = metrics  # Latency histograms of the commands, scripts and loops (``CommandMetrics``)
+        # Root of the scripts tree, the sub-scripts are not searched above it (see ``SubScriptCache.resolve``)
+        self.scripts_root = os.path.abspath(os.path.expanduser(scripts_root)) if scripts_root else None
+        self._script_depth = 0
+        self._root_script_dir = ""
+        self._scripts_root = None
+        if use_cache:
+            signature = registry_signature(megatron_command_registry, motor_command_registry)
+            self.script_cache = CompiledScriptCache(cache_dir, signature)
+        else:
+            self.script_cache = None
+        self.subscript_cache = SubScriptCache(self._load_script)
         self.context.run_script_callback = self.execute_script  # Set the callback for running sub-scripts
-        self.megatron_commands = ["email", "exit", "failif", "failifoff", "l", "log", "lograte", "plot", "print", "run", "setao", "setdo", "stop", "t", "var", "waitai", "waitdi"]
-        self.motor_commands = ["ac", "af", "ba", "bg", "bi", "bl", "bm", "bt", "bz", "cc", "ce", "cn", "dc", "dp", "er", "fa", "fe", "fl", "fv", "hm", "hv", "ib", "iht", "il", "kd", "ki", "kp", "ld", "mo", "mt", "op", "pa", "pr", "pv", "sc", "sh", "sp", "st", "ta", "tp", "xq"]
+        self.context.resolve_script_callback = self.resolve_script_path
+        self.megatron_commands = sorted(megatron_command_registry)
+        self.motor_commands = sorted(motor_command_registry)
+
+    def resolve_handler(self, command):
+        """
+        Returns the registered handler (``Command``) or ``None`` if the command is not recognized.
+        """
+        return megatron_command_registry.get(command) or motor_command_registry.get(command)
+
+    def _load_script(self, script_path):
+        if self.script_cache:
+            program = self.script_cache.load(script_path, self.resolve_handler)
+        else:
+            program = compile_script(script_path, self.resolve_handler)
+        if self.group_writes:
+            program = group_writes(program, set_outputs)
+        if self.group_waits:
+            program = group_waits(program, functools.partial(wait_for_all, simultaneous=self.simultaneous_waits))
+        if self.optimize:
+            program, report = optimize_program(program, script_path)
+            self.optimization_reports[script_path] = report
+            if report.changed:
+                _log.info("%s", report.format())
+        return program
+
+    @property
+    def compile_options(self):
+        """
+        Options that change the compiled scripts (and so the instruction indices saved in the checkpoints).
+        """
+        return {"group_writes": self.group_writes, "group_waits": self.group_waits, "optimize": self.optimize}
+
+    def compile_script(self, script_path):
+        """
+        Returns the compiled script. Scripts are compiled once and reused while the file is unchanged.
+        """
+        return self.subscript_cache.load(script_path)
+
+    def resolve_script_path(self, script_name, script_dir=None):
+        """
+        Resolve the name of the script called from the current script (see ``SubScriptCache.resolve``).
+        """
+        script_dir = script_dir if script_dir is not None else self.context.script_dir
+        script_dir = script_dir or os.getcwd()
+        scripts_root = self._scripts_root or self.scripts_root or default_scripts_root(script_dir)
+        return self.subscript_cache.resolve(script_name, script_dir, scripts_root)
 
-    def execute_script(self, script_path):
+    def dry_run(self, script_path, cost_model=None):
+        """
+        Estimate the execution time of the script without executing it (see ``DryRun``).
 
+        Returns
+        -------
+        DryRunReport
+        """
+        return DryRun(self, cost_model).run(script_path)
+
+    def resume_script(self, checkpoint):
+        """
+        Resume the execution at the position saved in the checkpoint (see ``megatron.checkpoint``).
+        The saved state of the context is restored first.
+
+        Parameters
+        ----------
+        checkpoint : Checkpoint
+
+        Raises
+        ------
+        CheckpointError
+            The scripts or the options of the interpreter were changed after the checkpoint.
+        """
+        checkpoint.check(self.compile_options)
+        restore_context_state(self.context, checkpoint.context)
+        yield from self.execute_script(checkpoint.frames[0].script_path, resume=checkpoint.frames)
+
+    def execute_script(self, script_path, *, resume=None):
+        """
+        Execute the script. ``resume`` is the list of the ``ScriptFrame`` of the script
+        and the sub-scripts it was executing (see ``resume_script``).
+        """
         script_path = os.path.expanduser(script_path)
         script_path = os.path.abspath(script_path)
+        parent_script_dir = getattr(self.context, "script_dir", "")
         self.context.script_dir = os.path.split(script_path)[0]
 
-        with open(script_path, "r") as script_file:
-            script_lines = script_file.readlines()
-
-        def plan():
-            i = 0
-            while i < len(script_lines):
-                line = script_lines[i].strip()
-                if line.startswith('#'):  # Ignore comments
-                    i += 1
-                    continue
-
-                if not line:
-                    yield from bps.null()
-                    i += 1
-                    continue
-
-                match_t = re.match(r"t([\d.]+)", line, re.IGNORECASE)
-                match_l = re.match(r"l(\d+)", line, re.IGNORECASE)
-
-                try:
-                    if match_t:
-                        timer_value = match_t.group(1)
-                        yield from self.handle_timer(timer_value)
-                    elif match_l:
-                        loop_count = int(match_l.group(1))
-                        loop_end = self.find_end_of_loop(script_lines, i)
-                        if loop_end == -1:
-                            raise LoopSyntaxError()
-                        loop_block = script_lines[i + 1:loop_end]
-                        yield from self.handle_loop(loop_count, loop_block)
-                        i = loop_end
-                    else:
-                        command, *args = self.tokenize_command(line)
-                        if command in self.megatron_commands:
-                            yield from process_megatron_command(command, args, self.context)
-                        elif command in self.motor_commands:
-                            yield from process_motor_command(command, args, self.context)
-                        else:
-                            raise CommandNotFoundError(command)
-                except StopScript:
-                    break
-                except (CommandNotFoundError, LoopSyntaxError) as e:
-                    print(e)
-                    yield from bps.null()
-                i += 1
-
-        yield from plan()
+        self._script_depth += 1
+        if self._script_depth == 1:
+            self._root_script_dir = self.context.script_dir
+            self._scripts_root = self.scripts_root or default_scripts_root(self._root_script_dir)
+        start = time.perf_counter()
+        checkpoint = None if self.streaming else self.checkpoint
+        frame = checkpoint.push(script_path) if checkpoint is not None else None
+        try:
+            if self.streaming and self._script_depth == 1:
+                with open(script_path, "rb") as script_file:
+                    yield from self.stream_program(script_file)
+            else:
+                program = self.compile_script(script_path)
+                yield from self.execute_program(program, frame, resume)
+            if checkpoint is not None and self._script_depth == 1:
+                checkpoint.write(completed=True)
+        finally:
+            if frame is not None:
+                checkpoint.pop()
+            if self.metrics is not None:
+                script_name = os.path.relpath(script_path, self._root_script_dir)
+                self.metrics.observe("script", script_name, time.perf_counter() - start)
+            self._script_depth -= 1
+            self.context.script_dir = parent_script_dir
 
-    def tokenize_command(self, line):
-        regex = r'(?:(?:"([^"]+)")|([^\s,]+))'
-        tokens = re.findall(regex, line)
-        return [t[0] or t[1] for t in tokens if t[0] or t[1]]
-
-    def handle_timer(self, timer_value):
-        print(f"Processing timer for {timer_value} seconds")
-        yield from process_megatron_command("t", [timer_value], self.context)
-
-    def handle_loop(self, loop_count, block):
-        for _ in range(loop_count):
-            print(f"Executing loop iteration {_ + 1} of {loop_count}")
-            yield from self.execute_block(block)
-
-    def find_end_of_loop(self, lines, start_index):
-        loop_depth = 0
-        for i in range(start_index + 1, len(lines)):
-            line = lines[i].strip().lower()
-            if line.startswith("l"):
-                loop_depth += 1
-            elif line == "n":
-                if loop_depth == 0:
-                    return i
+    def execute_program(self, program, frame=None, resume=None):
+        """
+        Execute the compiled script. The instructions are executed in order, loops
+        are implemented as jumps between the matching 'l' and 'n' instructions.
+        The position is saved to the checkpoint ``frame`` before each instruction.
+        The execution starts at the position of the first of the ``resume`` frames.
+        """
+        loops = []  # Stack of [iteration, loop_count, start_time] for the active loops
+        ip = 0
+        if resume:
+            ip = resume[0].ip
+            loops = [[iteration, loop_count, time.perf_counter()] for iteration, loop_count, *_ in resume[0].loops]
+            if len(resume) > 1:
+                # The instruction at the position is 'run', resume the sub-script instead of executing it.
+                # The position of the 'run' is saved with the checkpoints written by the sub-script.
+                if frame is not None:
+                    frame.ip = ip
+                    frame.loops = loops
+                yield from self.execute_script(resume[1].script_path, resume=resume[1:])
+                ip += 1
+        save = self.checkpoint.save if frame is not None else None
+        n_instructions = len(program)
+        while ip < n_instructions:
+            instruction = program[ip]
+            opcode = instruction.opcode
+
+            try:
+                if opcode == OP_LOOP:
+                    loop_count = instruction.args[0]
+                    if loop_count < 1:
+                        ip = instruction.target + 1
+                        continue
+                    loops.append([1, loop_count, time.perf_counter()])
+                    _log.info("Executing loop iteration 1 of %s", loop_count)
+                elif opcode == OP_NEXT:
+                    loop = loops[-1]
+                    if loop[0] < loop[1]:
+                        loop[0] += 1
+                        _log.info("Executing loop iteration %s of %s", loop[0], loop[1])
+                        ip = instruction.target + 1
+                        continue
+                    self._observe_loop(loops)
                 else:
-                    loop_depth -= 1
-        return -1
+                    if save is not None:
+                        save(frame, ip, loops, instruction.command)
+                    yield from self.execute_instruction(instruction)
+            except StopScript:
+                break
+            except (CommandNotFoundError, LoopSyntaxError) as e:
+                _log.error("%s", e)
+                yield from bps.null()
+            ip += 1
+
+    def stream_program(self, script_file):
+        """
+        Execute the script while reading it line by line. Only the byte offsets of the
+        active loops are kept in memory, the file is rewound to the start of the loop
+        body at each 'n'. Unmatched 'l' are reported when the end of the script is reached.
 
-    def execute_block(self, block):
-        i = 0
-        while i < len(block):
-            line = block[i].strip()
+        Parameters
+        ----------
+        script_file : file
+            Script file opened in binary mode.
+        """
+        loops = []  # Stack of [body_offset, line_no, iteration, loop_count, start_time] for the active loops
+        skip_depth = 0  # Nesting depth inside the loop with zero iterations
+        line_no = 0
+        while True:
+            line = script_file.readline()
             if not line:
-                yield from bps.null()
-                i += 1
+                break
+            line_no += 1
+            instruction = parse_line(line.decode("utf-8", errors="replace"), line_no, self.resolve_handler)
+            if instruction is None:
                 continue
+            opcode = instruction.opcode
 
-            match_t = re.match(r"t([\d.]+)", line, re.IGNORECASE)
-            match_l = re.match(r"l(\d+)", line, re.IGNORECASE)
-
-            if match_t:
-                timer_value = match_t.group(1)
-                yield from self.handle_timer(timer_value)
-                i += 1
+            if skip_depth:
+                if opcode == OP_LOOP:
+                    skip_depth += 1
+                elif opcode == OP_NEXT:
+                    skip_depth -= 1
                 continue
 
-            elif match_l:
-                loop_count = int(match_l.group(1))
-                loop_end = self.find_end_of_loop(block, i)
+            try:
+                if opcode == OP_LOOP:
+                    loop_count = instruction.args[0]
+                    if loop_count < 1:
+                        skip_depth = 1
+                        continue
+                    loops.append([script_file.tell(), line_no, 1, loop_count, time.perf_counter()])
+                    _log.info("Executing loop iteration 1 of %s", loop_count)
+                elif opcode == OP_NEXT:
+                    if not loops:
+                        raise CommandNotFoundError("n")
+                    loop = loops[-1]
+                    if loop[2] < loop[3]:
+                        loop[2] += 1
+                        _log.info("Executing loop iteration %s of %s", loop[2], loop[3])
+                        script_file.seek(loop[0])
+                        line_no = loop[1]
+                        continue
+                    self._observe_loop(loops)
+                else:
+                    yield from self.execute_instruction(instruction)
+            except StopScript:
+                return
+            except (CommandNotFoundError, LoopSyntaxError) as e:
+                _log.error("%s", e)
+                yield from bps.null()
 
-                if loop_end == -1:
-                    raise LoopSyntaxError()
+        for _ in loops:
+            _log.error("%s", LoopSyntaxError())
+            yield from bps.null()
 
-                nested_block = block[i + 1:loop_end]
-                yield from self.handle_loop(loop_count, nested_block)
-                i = loop_end + 1
-                continue
+    def _observe_loop(self, loops):
+        """
+        Remove the finished loop from the stack and record its time (by nesting depth).
+        """
+        start = loops.pop()[-1]
+        if self.metrics is not None:
+            self.metrics.observe("loop", len(loops) + 1, time.perf_counter() - start)
 
-            command, *args = self.tokenize_command(line)
+    def execute_instruction(self, instruction):
+        """
+        Execute a single instruction other than 'l' and 'n'.
+        """
+        if self.metrics is not None and instruction.handler is not None:
+            start = time.perf_counter()
+            yield from self._dispatch_instruction(instruction)
+            if instruction.opcode == OP_GROUP:
+                name = f"{instruction.args[0].command} (group)"
+            else:
+                name = instruction.command
+            self.metrics.observe("command", name, time.perf_counter() - start)
+        else:
+            yield from self._dispatch_instruction(instruction)
 
-            if command in self.megatron_commands:
-                yield from process_megatron_command(command, args, self.context)
-            elif command in self.motor_commands:
-                yield from process_motor_command(command, args, self.context)
+    def _dispatch_instruction(self, instruction):
+        opcode = instruction.opcode
+        if opcode == OP_COMMAND or opcode == OP_GROUP:
+            yield from instruction.handler(instruction.args, self.context)
+        elif opcode == OP_TIMER:
+            yield from self.handle_timer(instruction.args[0], instruction.handler)
+        elif opcode == OP_NULL:
+            yield from bps.null()
+        elif opcode == OP_ERROR:
+            _log.error("Line %s: %s", instruction.line_no, instruction.args[0])
+            if is_fatal_error(instruction):
+                raise_fatal_error(instruction)
+            yield from bps.null()
+
+    def tokenize_command(self, line):
+        return tokenize_command(line)
 
-            i += 1
+    def handle_timer(self, timer_value, handler=None):
+        handler = handler or megatron_command_registry.get("t")
+        yield from handler((timer_value,), self.context)
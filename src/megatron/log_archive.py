@@ -0,0 +1,313 @@
+import os
+import csv
+import glob
+import math
+import time
+import argparse
+from datetime import datetime
+
+# pyarrow is imported when the archive is written or read, so that importing the
+# package does not require loading it.
+
+TIMESTAMP_COLUMN = "Timestamp"
+_CHUNK_PATTERN = "chunk-*.parquet"
+
+
+def _import_pyarrow():
+    import pyarrow
+    import pyarrow.parquet
+
+    return pyarrow
+
+
+def _to_float(value):
+    if value is None or value == "":
+        return math.nan
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _make_column(pa, values, column_type=None):
+    """
+    Create the typed column: float64 if all values are numbers or empty (stored as NaN),
+    otherwise string (empty values are stored as null). ``column_type`` is the type
+    of the column in the previous chunks, the column that had string values stays string
+    (so that a chunk of empty values does not change the type of the column).
+    """
+    if column_type is None or column_type != pa.string():
+        floats = [_to_float(_) for _ in values]
+        if all(_ is not None for _ in floats):
+            return pa.array(floats, type=pa.float64())
+    return pa.array([None if _ is None or _ == "" else str(_) for _ in values], type=pa.string())
+
+
+def _unify_column_types(pa, tables):
+    """
+    Cast the columns that have different types in the tables (float64 in the chunks
+    written before the first non-numeric value, string in the later chunks) to string,
+    so that the tables can be concatenated. NaN values become null.
+    """
+    import pyarrow.compute as pc
+
+    column_types = {}
+    for table in tables:
+        for field in table.schema:
+            column_types.setdefault(field.name, set()).add(field.type)
+    mixed = {name for name, types in column_types.items() if len(types) > 1}
+    if not mixed:
+        return tables
+    result = []
+    for table in tables:
+        for name in mixed.intersection(table.column_names):
+            column = table.column(name)
+            if column.type == pa.string():
+                continue
+            if pa.types.is_floating(column.type):
+                column = pc.if_else(pc.is_nan(column), pa.scalar(None, column.type), column)
+            table = table.set_column(table.schema.get_field_index(name), name, column.cast(pa.string()))
+        result.append(table)
+    return result
+
+
+class ParquetLogSink:
+    """
+    Log sink that appends the rows to the compressed columnar archive. The archive is
+    a directory of Parquet files, each containing a chunk of ``chunk_size`` rows with the
+    timestamps (int64, nanoseconds since epoch) and the values of the signals (float64
+    or string for non-numeric values, a column keeps the string type in the following chunks).
+    Each chunk is written to the temporary file and
+    renamed, so that an interrupted run leaves only complete chunks in the archive
+    (at most one chunk of rows is lost).
+
+    Parameters
+    ----------
+    archive_path : str
+        Path to the archive directory. The directory is created if needed. New chunks
+        are added if the archive already exists.
+    chunk_size : int
+        Number of rows in each chunk.
+    chunk_interval : float or None
+        Maximum time (seconds) the rows are buffered before the chunk is written even
+        if it is not full.
+    compression : str
+        Parquet compression codec.
+    """
+
+    def __init__(self, archive_path, *, chunk_size=3600, chunk_interval=600.0, compression="zstd"):
+        self.archive_path = archive_path
+        self.chunk_size = max(chunk_size, 1)
+        self.chunk_interval = chunk_interval
+        self.compression = compression
+        self.written_chunks = 0
+        self._rows = []
+        self._chunk_start = None
+        self._next_index = None
+        self._column_types = {}  # Name -> type of the column in the written chunks
+
+    def _get_next_index(self):
+        if self._next_index is None:
+            os.makedirs(self.archive_path, exist_ok=True)
+            indices = [_chunk_index(_) for _ in glob.glob(os.path.join(glob.escape(self.archive_path), _CHUNK_PATTERN))]
+            self._next_index = max(indices, default=-1) + 1
+        index = self._next_index
+        self._next_index += 1
+        return index
+
+    def write(self, rows):
+        """
+        Append the rows. Each row is the tuple ``(timestamp_ns, names, values)``.
+        """
+        if not rows:
+            return
+        if self._chunk_start is None:
+            self._chunk_start = time.monotonic()
+        self._rows.extend(rows)
+        while len(self._rows) >= self.chunk_size:
+            self._write_chunk(self._rows[: self.chunk_size])
+            del self._rows[: self.chunk_size]
+            self._chunk_start = time.monotonic() if self._rows else None
+        if (
+            self._rows and self.chunk_interval is not None
+            and time.monotonic() - self._chunk_start >= self.chunk_interval
+        ):
+            self.flush()
+
+    def flush(self):
+        """
+        Write the buffered rows as the (incomplete) chunk.
+        """
+        if self._rows:
+            self._write_chunk(self._rows)
+            self._rows = []
+        self._chunk_start = None
+
+    def close(self):
+        self.flush()
+
+    def _write_chunk(self, rows):
+        pa = _import_pyarrow()
+        table_columns = {TIMESTAMP_COLUMN: pa.array([_[0] for _ in rows], type=pa.int64())}
+        column_types = self._column_types
+        names = rows[0][1]
+        if all(_[1] == names for _ in rows):
+            columns = zip(*[_[2] for _ in rows]) if names else ()
+            table_columns.update(
+                {name: _make_column(pa, values, column_types.get(name)) for name, values in zip(names, columns)}
+            )
+        else:
+            # Signals were added while the log is running, columns are taken from all rows
+            row_dicts = [dict(zip(row_names, row_values)) for _, row_names, row_values in rows]
+            names = {}
+            for row_dict in row_dicts:
+                names.update(dict.fromkeys(row_dict))
+            for name in names:
+                table_columns[name] = _make_column(pa, [_.get(name, "") for _ in row_dicts], column_types.get(name))
+        table = pa.table(table_columns)
+        self._save_table(table)
+        column_types.update({_.name: _.type for _ in table.schema})
+
+    def _save_table(self, table):
+        pa = _import_pyarrow()
+        chunk_path = os.path.join(self.archive_path, f"chunk-{self._get_next_index():06d}.parquet")
+        tmp_path = f"{chunk_path}.{os.getpid()}.tmp"
+        pa.parquet.write_table(table, tmp_path, compression=self.compression)
+        os.replace(tmp_path, chunk_path)
+        self.written_chunks += 1
+
+
+def _chunk_index(chunk_path):
+    name = os.path.basename(chunk_path)
+    try:
+        return int(name[len("chunk-"): -len(".parquet")])
+    except ValueError:
+        return -1
+
+
+def iter_log_archive(archive_path, columns=None):
+    """
+    Read the log archive chunk by chunk.
+
+    Parameters
+    ----------
+    archive_path : str
+        Path to the archive directory.
+    columns : list(str) or None
+        Names of the signals to read, all signals are read if ``None``.
+
+    Yields
+    ------
+    pyarrow.Table
+        Table with the timestamp column and the selected columns found in the chunk.
+    """
+    pa = _import_pyarrow()
+    chunk_paths = sorted(
+        glob.glob(os.path.join(glob.escape(archive_path), _CHUNK_PATTERN)), key=_chunk_index
+    )
+    for chunk_path in chunk_paths:
+        if columns is None:
+            yield pa.parquet.read_table(chunk_path)
+        else:
+            names = pa.parquet.read_schema(chunk_path).names
+            yield pa.parquet.read_table(chunk_path, columns=[_ for _ in [TIMESTAMP_COLUMN, *columns] if _ in names])
+
+
+def get_log_archive_columns(archive_path):
+    """
+    Returns the names of the signals in the log archive (in the order of appearance).
+    """
+    pa = _import_pyarrow()
+    names = {}
+    chunk_paths = sorted(
+        glob.glob(os.path.join(glob.escape(archive_path), _CHUNK_PATTERN)), key=_chunk_index
+    )
+    for chunk_path in chunk_paths:
+        names.update(dict.fromkeys(pa.parquet.read_schema(chunk_path).names))
+    return [_ for _ in names if _ != TIMESTAMP_COLUMN]
+
+
+def read_log_archive(archive_path, columns=None, as_pandas=True):
+    """
+    Read the log archive.
+
+    Parameters
+    ----------
+    archive_path : str
+        Path to the archive directory.
+    columns : list(str) or None
+        Names of the signals to read, all signals are read if ``None``.
+    as_pandas : bool
+        Return ``pandas.DataFrame`` indexed by the timestamp (``datetime64[ns]``, UTC)
+        if ``True``, otherwise return ``pyarrow.Table``.
+    """
+    pa = _import_pyarrow()
+    tables = _unify_column_types(pa, list(iter_log_archive(archive_path, columns)))
+    if tables:
+        table = pa.concat_tables(tables, promote_options="permissive")
+    else:
+        table = pa.table({TIMESTAMP_COLUMN: pa.array([], type=pa.int64())})
+
+    if not as_pandas:
+        return table
+    df = table.to_pandas()
+    df[TIMESTAMP_COLUMN] = df[TIMESTAMP_COLUMN].astype("datetime64[ns]").dt.tz_localize("UTC")
+    return df.set_index(TIMESTAMP_COLUMN)
+
+
+def convert_csv_log(csv_path, archive_path, *, chunk_size=3600, compression="zstd"):
+    """
+    Convert the CSV log written by ``ts_periodic_logging_wrapper`` to the log archive.
+    The timestamps of the CSV log are in local time. Returns the number of converted rows.
+
+    The header of the CSV log is written once, the values of the signals added to the log
+    later are appended to the rows without names. They are saved in the columns named
+    by their position in the CSV row (e.g. ``"Column 5"``).
+    """
+    sink = ParquetLogSink(archive_path, chunk_size=chunk_size, chunk_interval=None, compression=compression)
+    n_rows = 0
+    with open(csv_path, "rt", newline="") as f:
+        reader = csv.reader(f)
+        header = next(reader, None)
+        if not header:
+            return 0
+        header_names = tuple(header[1:])
+        names_by_length = {}
+        rows = []
+        for row in reader:
+            if not row:
+                continue
+            timestamp_ns = int(datetime.fromisoformat(row[0]).timestamp() * 1_000_000) * 1000
+            values = tuple(row[1:])
+            names = header_names
+            if len(values) < len(header_names):
+                values += ("",) * (len(header_names) - len(values))
+            elif len(values) > len(header_names):
+                names = names_by_length.get(len(values))
+                if names is None:
+                    extra_names = tuple(f"Column {n + 2}" for n in range(len(header_names), len(values)))
+                    names = names_by_length[len(values)] = header_names + extra_names
+            rows.append((timestamp_ns, names, values))
+            if len(rows) >= chunk_size:
+                sink.write(rows)
+                n_rows += len(rows)
+                rows = []
+        sink.write(rows)
+        n_rows += len(rows)
+    sink.close()
+    return n_rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert CSV logs to the compressed columnar log archive.")
+    parser.add_argument("csv_path", type=str, help="Path to the CSV log.")
+    parser.add_argument(
+        "archive_path", type=str, nargs="?", default=None,
+        help="Path to the archive directory, the CSV path with '.parquet' extension by default."
+    )
+    parser.add_argument("--chunk-size", type=int, default=3600, help="Number of rows in each chunk.")
+    args = parser.parse_args()
+
+    archive_path = args.archive_path or os.path.splitext(args.csv_path)[0] + ".parquet"
+    n_rows = convert_csv_log(args.csv_path, archive_path, chunk_size=args.chunk_size)
+    print(f"Converted {n_rows} rows from {args.csv_path!r} to {archive_path!r}")
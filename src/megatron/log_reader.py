@@ -0,0 +1,379 @@
+import os
+import csv
+import math
+import argparse
+from datetime import datetime
+import numpy as np
+
+# Size of the blocks of lines read from the log file
+_READ_SIZE = 1 << 20
+
+
+def _parse_time(value):
+    """
+    Convert the time (``datetime``, ISO string or seconds since epoch) to seconds since epoch.
+    Naive times are in local time (as the timestamps of the CSV logs).
+    """
+    if value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value.strip())
+    return value.timestamp()
+
+
+def _line_time(line):
+    """
+    Returns the timestamp (seconds since epoch) of the log line or ``None`` if the line
+    can not be parsed (e.g. the incomplete last line of the log).
+    """
+    try:
+        return datetime.fromisoformat(line[: line.index(b",")].decode()).timestamp()
+    except ValueError:
+        return None
+
+
+class _TimeParser:
+    """
+    Fast parser of the log timestamps. Conversion of the date and time (up to minutes)
+    to the epoch time is cached, since the consecutive rows mostly differ in seconds only.
+    """
+
+    def __init__(self):
+        self._key = None
+        self._minute = None
+
+    def __call__(self, line):
+        key = line[:16]
+        if key != self._key:
+            t = _line_time(line)
+            if t is None:
+                return None
+            self._key, self._minute = key, t - t % 60
+        try:
+            return self._minute + float(line[17:line.index(b",")])
+        except ValueError:
+            return _line_time(line)
+
+
+def _to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return math.nan
+
+
+class LogReader:
+    """
+    Reader of the CSV logs written by ``ts_periodic_logging_wrapper``. The log is never
+    loaded whole: the start of the time range is found by binary search over the file
+    offsets (the rows are ordered by time) and the rows are read in blocks.
+
+    Parameters
+    ----------
+    log_file_path : str
+        Path to the CSV log.
+    """
+
+    def __init__(self, log_file_path):
+        self.log_file_path = log_file_path
+        with open(log_file_path, "rb") as f:
+            header = f.readline()
+            self._data_offset = f.tell()
+        self.columns = next(csv.reader([header.decode()]))[1:]
+
+    def get_time_range(self):
+        """
+        Returns the timestamps of the first and the last rows, ``(None, None)`` if the log is empty.
+        """
+        with open(self.log_file_path, "rb") as f:
+            f.seek(self._data_offset)
+            first = _line_time(f.readline())
+            f.seek(0, os.SEEK_END)
+            size = f.tell()
+            last = None
+            block_size = 4096
+            while last is None and size > self._data_offset:
+                offset = max(size - block_size, self._data_offset)
+                f.seek(offset)
+                lines = f.read(size - offset).splitlines()
+                # The first line may be incomplete unless the block starts at the first row
+                for line in reversed(lines if offset == self._data_offset else lines[1:]):
+                    last = _line_time(line)
+                    if last is not None:
+                        break
+                if offset == self._data_offset:
+                    break
+                block_size *= 2
+        return first, last
+
+    def _seek(self, f, start):
+        """
+        Move to the first row with the timestamp not earlier than ``start``.
+        """
+        f.seek(0, os.SEEK_END)
+        lo, hi = self._data_offset, f.tell()
+        while lo < hi:
+            mid = (lo + hi) // 2
+            f.seek(mid)
+            if mid > self._data_offset:
+                f.readline()  # Skip to the start of the next row
+            pos = f.tell()
+            line = f.readline()
+            t = _line_time(line) if line else None
+            if t is None or t >= start:
+                hi = mid
+            else:
+                lo = pos + len(line)
+        # 'lo' may point to the middle of the row if it was last set from 'hi'
+        if lo > self._data_offset:
+            f.seek(lo - 1)
+            f.readline()
+        else:
+            f.seek(lo)
+
+    def iter_chunks(self, start=None, end=None, columns=None):
+        """
+        Read the rows within the time range in chunks.
+
+        Parameters
+        ----------
+        start, end : datetime, str, float or None
+            Time range (see ``_parse_time``), not limited if ``None``.
+        columns : list(str) or None
+            Names of the columns, all columns if ``None``.
+
+        Yields
+        ------
+        list(tuple)
+            Rows ``(timestamp, values)``, where timestamp is in seconds since epoch and
+            values of the selected columns are floats (``nan`` for empty or non-numeric cells).
+        """
+        start, end = _parse_time(start), _parse_time(end)
+        columns = self.columns if columns is None else columns
+        missing = [_ for _ in columns if _ not in self.columns]
+        if missing:
+            raise KeyError(f"Columns not found in the log {self.log_file_path!r}: {missing}")
+        indices = [self.columns.index(_) + 1 for _ in columns]
+        max_index = max(indices, default=0) + 1
+        parse_time = _TimeParser()
+
+        with open(self.log_file_path, "rb") as f:
+            if start is not None:
+                self._seek(f, start)
+            else:
+                f.seek(self._data_offset)
+            while True:
+                lines = f.readlines(_READ_SIZE)
+                if not lines:
+                    break
+                rows = []
+                for line in lines:
+                    t = parse_time(line)
+                    if t is None or (start is not None and t < start):
+                        continue
+                    if end is not None and t > end:
+                        if rows:
+                            yield rows
+                        return
+                    if b'"' in line:
+                        cells = next(csv.reader([line.decode(errors="replace")]))
+                    else:
+                        cells = line.rstrip(b"\r\n").split(b",", max_index)
+                    n_cells = len(cells)
+                    rows.append((t, [_to_float(cells[_]) if _ < n_cells else math.nan for _ in indices]))
+                if rows:
+                    yield rows
+
+
+class MinMaxDecimator:
+    """
+    Min/max decimation of the time series. The time range is split into ``max_points // 2``
+    buckets and the minimum and the maximum values (with their timestamps) are kept for
+    each bucket, so that spikes are preserved. Memory does not depend on the number of rows.
+
+    Parameters
+    ----------
+    start, end : float
+        Time range (seconds since epoch).
+    columns : list(str)
+        Names of the columns.
+    max_points : int
+        Maximum number of points for each column.
+    """
+
+    def __init__(self, start, end, columns, max_points=2000):
+        self.start = start
+        self.columns = list(columns)
+        self.n_buckets = max(max_points // 2, 1)
+        self.bucket_width = max(end - start, 1e-9) / self.n_buckets
+        shape = (len(self.columns), self.n_buckets)
+        self._min_values = np.full(shape, np.inf)
+        self._min_times = np.zeros(shape)
+        self._max_values = np.full(shape, -np.inf)
+        self._max_times = np.zeros(shape)
+
+    def update(self, rows):
+        """
+        Add the rows ``(timestamp, values)``.
+        """
+        if not rows:
+            return
+        times = np.array([_[0] for _ in rows])
+        values = np.array([_[1] for _ in rows], dtype=float).reshape(len(rows), len(self.columns))
+        buckets = np.clip(((times - self.start) / self.bucket_width).astype(np.int64), 0, self.n_buckets - 1)
+        for n in range(len(self.columns)):
+            v = values[:, n]
+            valid = ~np.isnan(v)
+            b, t, v = buckets[valid], times[valid], v[valid]
+            if not len(v):
+                continue
+            # Sort by bucket and value, the first and the last row of each bucket are min and max
+            order = np.lexsort((v, b))
+            b, t, v = b[order], t[order], v[order]
+            first = np.flatnonzero(np.r_[True, b[1:] != b[:-1]])
+            last = np.r_[first[1:] - 1, len(b) - 1]
+            self._merge(self._min_values[n], self._min_times[n], b[first], v[first], t[first], np.less)
+            self._merge(self._max_values[n], self._max_times[n], b[last], v[last], t[last], np.greater)
+
+    @staticmethod
+    def _merge(values, times, buckets, new_values, new_times, compare):
+        better = compare(new_values, values[buckets])
+        values[buckets[better]] = new_values[better]
+        times[buckets[better]] = new_times[better]
+
+    def result(self):
+        """
+        Returns the dictionary: column name -> list of points ``(timestamp, value)`` ordered by time.
+        """
+        result = {}
+        for n, name in enumerate(self.columns):
+            points = []
+            for bucket in np.flatnonzero(np.isfinite(self._min_values[n])):
+                min_t, min_v = float(self._min_times[n, bucket]), float(self._min_values[n, bucket])
+                max_t, max_v = float(self._max_times[n, bucket]), float(self._max_values[n, bucket])
+                if min_t == max_t:
+                    points.append((min_t, min_v))
+                elif min_t < max_t:
+                    points.extend([(min_t, min_v), (max_t, max_v)])
+                else:
+                    points.extend([(max_t, max_v), (min_t, min_v)])
+            result[name] = points
+        return result
+
+
+def _get_archive_time_range(archive_path):
+    from megatron.log_archive import iter_log_archive, TIMESTAMP_COLUMN
+
+    first = last = None
+    for table in iter_log_archive(archive_path, columns=[]):
+        times = table.column(TIMESTAMP_COLUMN)
+        if len(times):
+            first = times[0].as_py() / 1e9 if first is None else first
+            last = times[-1].as_py() / 1e9
+    return first, last
+
+
+def _iter_archive_chunks(archive_path, start, end, columns):
+    """
+    Read the rows of the log archive within the time range chunk by chunk
+    (see ``LogReader.iter_chunks``).
+    """
+    from megatron.log_archive import iter_log_archive, TIMESTAMP_COLUMN
+
+    for table in iter_log_archive(archive_path, columns):
+        times = [_ / 1e9 for _ in table.column(TIMESTAMP_COLUMN).to_pylist()]
+        if not times or (start is not None and times[-1] < start) or (end is not None and times[0] > end):
+            continue
+        data = []
+        for name in columns:
+            if name in table.column_names:
+                data.append([math.nan if _ is None else _to_float(_) for _ in table.column(name).to_pylist()])
+            else:
+                data.append([math.nan] * len(times))
+        yield [
+            (t, values) for t, values in zip(times, zip(*data) if data else [()] * len(times))
+            if (start is None or t >= start) and (end is None or t <= end)
+        ]
+
+
+def query_log(log_path, start=None, end=None, columns=None, max_points=2000):
+    """
+    Read the decimated time series from the CSV log or the log archive (directory, see
+    ``ParquetLogSink``).
+
+    Parameters
+    ----------
+    log_path : str
+        Path to the CSV log or the log archive.
+    start, end : datetime, str, float or None
+        Time range, the whole log if ``None``.
+    columns : list(str) or None
+        Names of the columns, all columns if ``None``.
+    max_points : int
+        Maximum number of points for each column.
+
+    Returns
+    -------
+    dict
+        Column name -> list of points ``(timestamp, value)``, timestamps are in seconds since epoch.
+    """
+    start, end = _parse_time(start), _parse_time(end)
+    if os.path.isdir(log_path):
+        if columns is None:
+            from megatron.log_archive import get_log_archive_columns
+
+            columns = get_log_archive_columns(log_path)
+        first, last = _get_archive_time_range(log_path)
+        chunks = _iter_archive_chunks(log_path, start, end, columns)
+    else:
+        reader = LogReader(log_path)
+        columns = reader.columns if columns is None else columns
+        first, last = reader.get_time_range()
+        chunks = reader.iter_chunks(start, end, columns)
+    if first is None:
+        return {_: [] for _ in columns}
+
+    start = first if start is None else max(start, first)
+    end = last if end is None else min(end, last)
+    decimator = MinMaxDecimator(start, end, columns, max_points)
+    for rows in chunks:
+        decimator.update(rows)
+    return decimator.result()
+
+
+def plot_log(log_path, start=None, end=None, columns=None, max_points=2000):
+    """
+    Plot the decimated time series from the log (see ``query_log``). Each column is
+    plotted on a separate axis.
+    """
+    import matplotlib.pyplot as plt
+
+    series = query_log(log_path, start, end, columns, max_points)
+    fig, axes = plt.subplots(len(series), 1, sharex=True, squeeze=False)
+    for ax, (name, points) in zip(axes[:, 0], series.items()):
+        ax.plot([datetime.fromtimestamp(_[0]) for _ in points], [_[1] for _ in points])
+        ax.set_ylabel(name)
+    fig.autofmt_xdate()
+    plt.show()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Read decimated time series from Megatron logs.")
+    parser.add_argument("log_path", type=str, help="Path to the CSV log or the log archive.")
+    parser.add_argument("-s", "--start", type=str, default=None, help="Start time (ISO format).")
+    parser.add_argument("-e", "--end", type=str, default=None, help="End time (ISO format).")
+    parser.add_argument("-c", "--columns", type=str, nargs="+", default=None, help="Names of the columns.")
+    parser.add_argument("-n", "--max-points", type=int, default=2000, help="Maximum number of points per column.")
+    parser.add_argument("--plot", action="store_true", help="Plot the series instead of printing them.")
+    args = parser.parse_args()
+
+    if args.plot:
+        plot_log(args.log_path, args.start, args.end, args.columns, args.max_points)
+    else:
+        series = query_log(args.log_path, args.start, args.end, args.columns, args.max_points)
+        print("Timestamp,Column,Value")
+        for name, points in series.items():
+            for t, value in points:
+                print(f'{datetime.fromtimestamp(t).isoformat()},"{name}",{value}')
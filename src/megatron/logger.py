@@ -1,40 +1,304 @@
 import os
+import queue
 import asyncio
+import threading
+import time
+import logging
 from datetime import datetime
 from bluesky.utils import make_decorator
+from megatron.signal_cache import signal_cache
+from megatron.log_archive import ParquetLogSink
 
-def ts_periodic_logging_wrapper(plan, signals, log_file_path, period=1):
+_log = logging.getLogger(__name__)
+
+
+class SignalLogSettings:
+    """
+    Logging settings of a single signal. The value is logged when the rate is due or
+    the value changed beyond the deadband since it was last logged. If neither the rate
+    nor the deadbands are set, the value is logged on each tick.
+
+    Parameters
+    ----------
+    rate : float or None
+        Logging interval (seconds).
+    deadband : float or None
+        Absolute change of the value that causes the value to be logged.
+    rdeadband : float or None
+        Change of the value relative to the last logged value (e.g. 0.01 for 1%).
+    """
+
+    __slots__ = ("rate", "deadband", "rdeadband")
+
+    def __init__(self, rate=None, deadband=None, rdeadband=None):
+        self.rate = rate
+        self.deadband = deadband
+        self.rdeadband = rdeadband
+
+    def __repr__(self):
+        return f"SignalLogSettings(rate={self.rate}, deadband={self.deadband}, rdeadband={self.rdeadband})"
+
+    def should_log(self, value, now, last):
+        """
+        Check if the value should be logged.
+
+        Parameters
+        ----------
+        value
+            Current value.
+        now : float
+            Current time.
+        last : tuple or None
+            ``(value, time)`` of the last logged value, ``None`` if the value was not logged yet.
+        """
+        if last is None:
+            return True
+        last_value, last_time = last
+        if self.rate is None and self.deadband is None and self.rdeadband is None:
+            return True
+        if self.rate is not None and now - last_time >= self.rate:
+            return True
+        if self.deadband is None and self.rdeadband is None:
+            return False
+        try:
+            change = abs(value - last_value)
+        except TypeError:
+            return value != last_value
+        if self.deadband is not None and change > self.deadband:
+            return True
+        if self.rdeadband is not None and change > abs(last_value) * self.rdeadband:
+            return True
+        return False
+
+
+class LogSettings:
+    """
+    Settings of the periodic logging, changed by 'lograte' and 'log' commands.
+
+    Parameters
+    ----------
+    period : float
+        Period (seconds) of checking the logged values.
+    """
+
+    def __init__(self, period=1):
+        self.period = period
+        self.signals = {}  # signal name -> SignalLogSettings
+
+    def set_signal(self, name, *, rate=None, deadband=None, rdeadband=None):
+        """
+        Set the logging rate and/or deadbands of the signal. Parameters that are
+        ``None`` are not changed.
+        """
+        settings = self.signals.setdefault(name, SignalLogSettings())
+        if rate is not None:
+            settings.rate = rate
+        if deadband is not None:
+            settings.deadband = deadband
+        if rdeadband is not None:
+            settings.rdeadband = rdeadband
+
+
+def _format_csv_value(value):
+    if isinstance(value, str) and value:
+        return '"' + value.replace('"', '""') + '"'
+    return f"{value}"
+
+
+class _CsvLogSink:
+    """
+    Log sink that appends the rows to the CSV file. The file is kept open until the sink
+    is closed. The header is written if the file does not exist.
+    """
+
+    def __init__(self, log_file_path):
+        self.log_file_path = log_file_path
+        self._file = None
+
+    def _open(self, names):
+        is_new_file = not os.path.isfile(self.log_file_path)
+        if is_new_file:
+            dir, _ = os.path.split(self.log_file_path)
+            os.makedirs(dir or ".", exist_ok=True)
+        f = open(self.log_file_path, "at")
+        if is_new_file:
+            s = ",".join([f'"{_}"' for _ in names])
+            f.write(f"Timestamp,{s}\n")
+        return f
+
+    def write(self, rows):
+        if self._file is None:
+            self._file = self._open(rows[0][1])
+        lines = []
+        for timestamp_ns, _, values in rows:
+            ts = datetime.fromtimestamp(timestamp_ns / 1e9).strftime("%Y-%m-%dT%H:%M:%S.%f")
+            lines.append(f"{ts},{','.join([_format_csv_value(_) for _ in values])}\n")
+        self._file.write("".join(lines))
+        self._file.flush()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class _LogWriter(threading.Thread):
+    """
+    Background thread that writes the log rows to the log sink (CSV file or columnar
+    archive). The rows are written in batches, so that file I/O does not block the
+    event loop of the RunEngine.
+
+    Parameters
+    ----------
+    sink : object
+        Log sink, the object with the methods ``write(rows)`` and ``close()``.
+    flush_interval : float
+        Maximum time (seconds) the rows are buffered before they are passed to the sink.
+    flush_size : int
+        Maximum number of rows buffered before they are passed to the sink.
+    max_queue_size : int
+        Maximum number of rows waiting to be written. New rows are dropped (and counted
+        in ``dropped_rows``) if the queue is full.
+    """
+
+    def __init__(self, sink, *, flush_interval=5.0, flush_size=100, max_queue_size=100000):
+        super().__init__(name="Megatron log writer", daemon=True)
+        self.sink = sink
+        self.flush_interval = flush_interval
+        self.flush_size = max(flush_size, 1)
+        self.dropped_rows = 0
+        self.written_rows = 0
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._stop_requested = object()
+
+    def put(self, timestamp_ns, names, values):
+        """
+        Queue the row. The method does not block.
+
+        Parameters
+        ----------
+        timestamp_ns : int
+            Timestamp (nanoseconds since epoch).
+        names : tuple(str)
+            Column names, used for the header if the file is created.
+        values : tuple
+            Values of the columns.
+        """
+        try:
+            self._queue.put_nowait((timestamp_ns, names, values))
+        except queue.Full:
+            self.dropped_rows += 1
+
+    def close(self):
+        """
+        Write the remaining rows, close the sink and stop the thread.
+        """
+        self._queue.put(self._stop_requested)
+        self.join()
+
+    def run(self):
+        batch = []
+        stop = False
+        flush_time = time.monotonic() + self.flush_interval
+        try:
+            while not stop:
+                try:
+                    row = self._queue.get(timeout=max(flush_time - time.monotonic(), 0))
+                    if row is self._stop_requested:
+                        stop = True
+                    else:
+                        batch.append(row)
+                except queue.Empty:
+                    pass
+
+                if batch and (stop or len(batch) >= self.flush_size or time.monotonic() >= flush_time):
+                    self.sink.write(batch)
+                    self.written_rows += len(batch)
+                    batch = []
+                if time.monotonic() >= flush_time:
+                    flush_time = time.monotonic() + self.flush_interval
+        finally:
+            self.sink.close()
+            if self.dropped_rows:
+                _log.warning("Log writer dropped %s rows (queue is full)", self.dropped_rows)
+
+
+def ts_periodic_logging_wrapper(plan, signals, log_file_path, period=1, flush_interval=5.0, flush_size=100,
+                                max_queue_size=100000, stale_after=None, log_settings=None, log_format="csv",
+                                chunk_size=3600):
+    """
+    Periodically log the values of the signals while the plan is running. The values are
+    read from the signal cache (updated by monitor callbacks). Values that were not
+    received yet are logged as empty cells. If ``stale_after`` (seconds) is set, the
+    last column ('Stale') lists the names of the signals that were not updated for
+    longer than ``stale_after``.
+
+    If ``log_settings`` (``LogSettings``) is passed, the logging period is taken from
+    the settings (instead of ``period``) and may be changed while the plan is running.
+    Signals with rates or deadbands are logged only when needed, the cells of the values
+    that are not logged are left empty and rows without logged values are not written.
+
+    If ``log_format`` is ``"parquet"``, the log is written to the compressed columnar
+    archive (directory ``log_file_path``) in chunks of ``chunk_size`` rows instead of
+    the CSV file (see ``ParquetLogSink``).
+    """
+
+    if log_format == "csv":
+        sink = _CsvLogSink(log_file_path)
+    elif log_format == "parquet":
+        sink = ParquetLogSink(log_file_path, chunk_size=chunk_size)
+    else:
+        raise ValueError(f"Unsupported log format: {log_format!r}")
 
     stop = asyncio.Event()
+    writer = _LogWriter(sink, flush_interval=flush_interval, flush_size=flush_size, max_queue_size=max_queue_size)
 
-    async def logging_coro():
-        while not stop.is_set():
-            is_new_file = False
-            if not os.path.isfile(log_file_path):
-                dir, _ = os.path.split(log_file_path)
-                os.makedirs(dir, exist_ok=True)
-                is_new_file = True
+    last_logged = {}  # signal name -> (value, time) of the last logged value
 
-            timestamp = datetime.now().strftime("%Y-%m-%dT%H:%M:%S.%f")
+    def filter_values(names, values, now):
+        n_logged = 0
+        filtered = []
+        for name, value in zip(names, values):
+            settings = log_settings.signals.get(name)
+            if value != "" and (settings is None or settings.should_log(value, now, last_logged.get(name))):
+                last_logged[name] = (value, now)
+                n_logged += 1
+            else:
+                value = ""
+            filtered.append(value)
+        return filtered, n_logged
 
-            with open(log_file_path, "at") as f:
-                if is_new_file:
-                    s = ",".join([f'"{_}"' for _ in signals.keys()])
-                    f.write(f"Timestamp,{s}\n")
-                s = ",".join([f"{_.value}" for _ in signals.values()])
-                f.write(f"{timestamp},{s}\n")
+    async def logging_coro():
+        while not stop.is_set():
+            timestamp = time.time_ns()
+            now = timestamp / 1e9
+            names = tuple(signals.keys())
+            snapshots = [signal_cache.get_snapshot(_) for _ in signals.values()]
+            values = ["" if ts is None else value for value, ts, _ in snapshots]
+            n_logged = len(values)
+            if log_settings is not None and log_settings.signals:
+                values, n_logged = filter_values(names, values, now)
+            values = tuple(values)
+            if stale_after is not None:
+                stale = [n for n, (_, ts, _) in zip(names, snapshots) if ts is None or now - ts > stale_after]
+                names += ("Stale",)
+                values += (";".join(stale),)
+            if n_logged:
+                writer.put(timestamp, names, values)
 
-            await asyncio.sleep(period)
+            await asyncio.sleep(log_settings.period if log_settings is not None else period)
 
     class StartStopLogging(object):
 
         def __enter__(self):
-            print("Starting periodic logging")
+            _log.info("Starting periodic logging")
+            writer.start()
             asyncio.ensure_future(logging_coro())
 
         def __exit__(self, *args):
-            print("Stopping periodic logging")
+            _log.info("Stopping periodic logging")
             stop.set()
+            writer.close()
 
     def _inner():
         with StartStopLogging():
@@ -1,71 +1,76 @@
-import os
+import uuid
+import logging
 import bluesky.plan_stubs as bps
-from megatron.exceptions import CommandNotFoundError, StopScript
-from megatron.support import wait_for_condition
-import inspect
+from megatron.exceptions import StopScript
+from megatron.registry import CommandRegistry
+from megatron.signal_cache import signal_cache
+
+_log = logging.getLogger(__name__)
 
 active_failif_conditions = {}
 
+megatron_command_registry = CommandRegistry("Megatron")
+
 def process_megatron_command(command, args, context, current_script_path=None):
-    command_dispatcher = {
-        "email": email,
-        "exit": exit_command,
-        "failif": failif,
-        "failifoff": failifoff,
-        "l": l_command,
-        "log": log,
-        "lograte": lograte,
-        "print": print_command,
-        "run": run,
-        "setao": setao,
-        "setdo": setdo,
-        "stop": stop,
-        "t": t_command,
-        "var": var,
-        "waitai": waitai,
-        "waitdi": waitdi
-    }
-
-    if command in command_dispatcher:
-        command_function = command_dispatcher[command]
-
-        sig = inspect.signature(command_function)
-        params = list(sig.parameters)
-
-        kwargs = {"args": args, "context": context, "current_script_path": current_script_path}
-        dynamic_args = [kwargs[param] for param in params if param in kwargs]
-
-        yield from command_function(*dynamic_args)
-    else:
-        raise CommandNotFoundError(command)
+    yield from megatron_command_registry.dispatch(command, args, context, current_script_path)
 
+@megatron_command_registry.command("l")
 def l_command(block, context):
     for line in block:
         yield from process_megatron_command(line[0], line[1:], context)
 
+@megatron_command_registry.command("t", min_args=1, arg_types=(float,))
 def t_command(args):
     timer_duration = float(args[0])
-    print(f"Executing timer for {timer_duration} seconds")
+    _log.info("Executing timer for %s seconds", timer_duration)
     yield from bps.sleep(timer_duration)
 
+@megatron_command_registry.command("exit")
 def exit_command():
-    print("Exiting the interpreter.")
+    _log.info("Exiting the interpreter.")
     raise SystemExit
 
-def lograte(args):
-    print(f"Setting lograte to {args[0]}")
+@megatron_command_registry.command("lograte", min_args=1, null_only=True)
+def lograte(args, context):
+    # lograte <period>
+    # lograte "<signal>", <rate>[, deadband=<value>][, rdeadband=<fraction>]
+    if len(args) == 1:
+        period = float(args[0])
+        _log.info("Setting lograte to %s", period)
+        context.log_settings.period = period
+    else:
+        signal_name, rate = args[0], float(args[1])
+        options = _parse_log_options(args[2:])
+        _log.info("Setting lograte of %s to %s %s", signal_name, rate, options)
+        context.log_settings.set_signal(signal_name, rate=rate, **options)
     yield from bps.null()
 
+def _parse_log_options(tokens):
+    """
+    Parse 'rate=<s>', 'deadband=<value>' and 'rdeadband=<fraction>' options of 'log'
+    and 'lograte' commands. Raises ``ValueError`` if an option is not supported.
+    """
+    options = {}
+    for token in tokens:
+        key, _, value = token.partition("=")
+        key = key.strip().lower()
+        if key not in ("rate", "deadband", "rdeadband") or not value:
+            raise ValueError(f"Unsupported logging option: {token!r}")
+        options[key] = float(value)
+    return options
+
+@megatron_command_registry.command("email", min_args=2, noop=True)
 def email(args):
     subject = args[0]
     message = args[1]
     recipients = args[2:]
-    print(f"Sending email with subject '{subject}' to {recipients}")
+    _log.info("Sending email with subject '%s' to %s", subject, recipients)
     yield from bps.null()
 
+@megatron_command_registry.command("failif", min_args=3, max_args=3, null_only=True)
 def failif(args, context):
     pv_name, expected_value, fail_script = args
-    print(f"Setting failif on {pv_name} for value {expected_value}.")
+    _log.info("Setting failif on %s for value %s.", pv_name, expected_value)
 
     device_name = context.device_mapping.get(pv_name)
     if not device_name:
@@ -77,92 +82,166 @@ def failif(args, context):
 
     def check_pv_value(value, **kwargs):
         if value == expected_value:
-            print(f"Failif triggered! {pv_name} reached value {expected_value}. Running {fail_script}.")
-            called_script_path = os.path.join(context.script_dir, fail_script)
+            _log.warning("Failif triggered! %s reached value %s. Running %s.", pv_name, expected_value, fail_script)
+            called_script_path = context.resolve_script_callback(fail_script)
             context.run_script_callback(called_script_path)
 
     token = pv_signal.subscribe(check_pv_value)
     active_failif_conditions[pv_name] = (pv_signal, token)
+    context.failif_conditions[pv_name] = (expected_value, fail_script)
     yield from bps.null()
 
-def failifoff(args):
+@megatron_command_registry.command("failifoff", min_args=1, null_only=True)
+def failifoff(args, context):
     pv_name = args[0]
+    context.failif_conditions.pop(pv_name, None)
     if pv_name in active_failif_conditions:
         pv_signal, token = active_failif_conditions.pop(pv_name)
         pv_signal.clear_sub(token)
-        print(f"Failif condition disabled for {pv_name}.")
+        _log.info("Failif condition disabled for %s.", pv_name)
     else:
-        print(f"No active failif condition found for {pv_name}.")
+        _log.warning("No active failif condition found for %s.", pv_name)
     yield from bps.null()
 
+@megatron_command_registry.command("log", min_args=1, null_only=True)
 def log(args, context):
-    signal_name = args[0]
-    if signal_name in context.device_mapping:
-        signal_device_name = context.device_mapping[signal_name]
-        signal = getattr(context.devices, signal_device_name)
-        context.logged_signals[signal_name] = signal 
-        print(f"Added {signal_name} to logging signals.")
-    else:
-        raise RuntimeError(f"Signal {signal_name} not found in device mapping.")
+    # log "<signal>"[, "<signal>" ...][, rate=<s>][, deadband=<value>][, rdeadband=<fraction>]
+    signal_names = [_ for _ in args if "=" not in _]
+    options = _parse_log_options([_ for _ in args if "=" in _])
+    for signal_name in signal_names:
+        if signal_name in context.device_mapping:
+            signal_device_name = context.device_mapping[signal_name]
+            signal = getattr(context.devices, signal_device_name)
+            context.logged_signals[signal_name] = signal
+            signal_cache.add(signal)
+            if options:
+                context.log_settings.set_signal(signal_name, **options)
+            _log.info("Added %s to logging signals.", signal_name)
+        else:
+            raise RuntimeError(f"Signal {signal_name} not found in device mapping.")
+    yield from bps.null()
+
+
+@megatron_command_registry.command("plot", min_args=1, null_only=True)
+def plot(args, context):
+    # plot "<signal>"[, "<signal>" ...][ +x,y,width,height]
+    # The plotted signals are logged, so that the plots can be built from the log
+    # (see 'megatron.log_reader'). The window geometry is saved for the front end.
+    n_names = next((i for i, _ in enumerate(args) if _.startswith("+")), len(args))
+    geometry = tuple(args[n_names:])
+    for signal_name in args[:n_names]:
+        context.plotted_signals[signal_name] = geometry
+        if signal_name in context.device_mapping:
+            signal = getattr(context.devices, context.device_mapping[signal_name])
+            context.logged_signals[signal_name] = signal
+            signal_cache.add(signal)
+        else:
+            _log.warning("Signal %s not found in device mapping, it is not logged.", signal_name)
+    _log.info("Plotting signals: %s", ", ".join(args[:n_names]))
     yield from bps.null()
 
 
+@megatron_command_registry.command("print", null_only=True)
 def print_command(args):
     text = ' '.join(args)
-    print(f"Executing 'print' command with text: {text}")
+    _log.info("Executing 'print' command with text: %s", text)
     yield from bps.null()
 
+@megatron_command_registry.command("run", min_args=1)
 def run(args, context):
     script_name = args[0]
 
-    called_script_path = os.path.join(context.script_dir, script_name)
-    print(f"Running script: {script_name} ({called_script_path})")
+    called_script_path = context.resolve_script_callback(script_name)
+    _log.info("Running script: %s (%s)", script_name, called_script_path)
 
     yield from context.run_script_callback(called_script_path)
 
-def setao(args):
+@megatron_command_registry.command("setao", min_args=2, arg_types=(None, float))
+def setao(args, context):
     sp = args[0]
     value = float(args[1])
-    print(f"Setting analog output {sp} to {value}")
-    yield from bps.null()
+    _log.info("Setting analog output %s to %s", sp, value)
+    signal = _get_output_signal(sp, context)
+    if signal is not None:
+        yield from bps.mv(signal, value)
+    else:
+        yield from bps.null()
 
-def setdo(args):
+@megatron_command_registry.command("setdo", min_args=2, arg_types=(None, int))
+def setdo(args, context):
     pv = args[0]
     value = int(args[1])
-    print(f"Setting digital output {pv} to {value}")
-    yield from bps.null()
-
+    _log.info("Setting digital output %s to %s", pv, value)
+    signal = _get_output_signal(pv, context)
+    if signal is not None:
+        yield from bps.mv(signal, value)
+    else:
+        yield from bps.null()
+
+def _get_output_signal(name, context):
+    # Outputs that are not in the device mapping are not written (only reported).
+    device_name = context.device_mapping.get(name)
+    return getattr(context.devices, device_name) if device_name else None
+
+def set_outputs(instructions, context):
+    """
+    Execute a group of consecutive 'setdo' and 'setao' commands (compiled instructions).
+    All values are set in parallel and the plan waits once for all of them to complete.
+    The group must not contain more than one write to the same output.
+    """
+    group = str(uuid.uuid4())
+    for instruction in instructions:
+        name = instruction.args[0]
+        if instruction.command == "setdo":
+            value = int(instruction.args[1])
+            _log.info("Setting digital output %s to %s", name, value)
+        else:
+            value = float(instruction.args[1])
+            _log.info("Setting analog output %s to %s", name, value)
+        signal = _get_output_signal(name, context)
+        if signal is not None:
+            yield from bps.abs_set(signal, value, group=group)
+    yield from bps.wait(group=group)
+
+@megatron_command_registry.command("stop")
 def stop(args):
-    print("Stopping the current script.")
+    _log.info("Stopping the current script.")
     raise StopScript()
 
+@megatron_command_registry.command("var", min_args=2, noop=True)
 def var(args):
     variable = args[0]
     expression = args[1]
-    print(f"Setting variable {variable} to {expression}")
+    _log.info("Setting variable %s to %s", variable, expression)
     yield from bps.null()
 
+@megatron_command_registry.command("waitai", min_args=3, max_args=5, arg_types=(None, None, float, float, float))
 def waitai(args, context):
-    source = args[0]
-    operator = args[1]
-    value = float(args[2])
-    tolerance = float(args[3]) if len(args) > 3 else 0
-    timeout = float(args[4]) if len(args) > 4 else None
-
-    if source in context.device_mapping:
-        device_name = context.device_mapping[source]
-        signal = getattr(context.devices, device_name)
-    else:
-        raise RuntimeError(f"Unrecognized device name: {source!r}")
-
-    yield from wait_for_condition(
-        signal=signal, target=value / 1000000, operator=operator, tolerance=tolerance, timeout=timeout
-    )
+    from megatron.support import wait_for_condition  # Imports ophyd
+    condition = _get_wait_condition("waitai", args, context)
+    yield from wait_for_condition(**condition)
 
+@megatron_command_registry.command("waitdi", min_args=2, max_args=3, arg_types=(None, int, float))
 def waitdi(args, context):
+    from megatron.support import wait_for_condition  # Imports ophyd
+    condition = _get_wait_condition("waitdi", args, context)
+    yield from wait_for_condition(**condition)
+
+def _get_wait_condition(command, args, context):
+    """
+    Returns the parameters of ``wait_for_condition`` for 'waitai' or 'waitdi' command.
+    """
     source = args[0]
-    value = int(args[1])
-    timeout = float(args[2]) if len(args) > 2 else None
+    if command == "waitai":
+        operator = args[1]
+        value = float(args[2])
+        tolerance = float(args[3]) if len(args) > 3 else 0
+        timeout = float(args[4]) if len(args) > 4 else None
+    else:
+        operator = "=="
+        value = int(args[1])
+        tolerance = 0
+        timeout = float(args[2]) if len(args) > 2 else None
 
     if source in context.device_mapping:
         device_name = context.device_mapping[source]
@@ -170,6 +249,17 @@ def waitdi(args, context):
     else:
         raise RuntimeError(f"Unrecognized device name: {source!r}")
 
-    yield from wait_for_condition(
-        signal=signal, target=value / 1000000, operator="==", tolerance=0, timeout=timeout
-    )
+    return dict(signal=signal, target=value / 1000000, operator=operator, tolerance=tolerance, timeout=timeout)
+
+def wait_for_all(instructions, context, simultaneous=False):
+    """
+    Execute a group of consecutive 'waitai' and 'waitdi' commands (compiled instructions)
+    as a single wait. Timeouts are applied to individual conditions and start when
+    the group wait starts. If ``simultaneous`` is ``True``, all conditions must be met
+    at the same time.
+    """
+    from megatron.support import wait_for_conditions  # Imports ophyd
+    conditions = [_get_wait_condition(_.command, _.args, context) for _ in instructions]
+    for condition in conditions:
+        _log.info("Waiting for %s %s %s", condition["signal"].name, condition["operator"], condition["target"])
+    yield from wait_for_conditions(conditions, simultaneous=simultaneous)
@@ -0,0 +1,183 @@
+import os
+import json
+import time
+import bisect
+
+# Upper bounds (seconds) of the histogram buckets: 100 us to 10000 s in 1-2.5-5 steps
+DEFAULT_BUCKETS = tuple(round(m * 10.0 ** e, 6) for e in range(-4, 4) for m in (1, 2.5, 5)) + (10000.0,)
+
+# Kind of the measured item -> (name of the Prometheus metric, label, help)
+_metric_kinds = {
+    "command": ("megatron_command_seconds", "command", "Wall time of the Megatron commands."),
+    "script": ("megatron_script_seconds", "script", "Wall time of the script invocations."),
+    "loop": ("megatron_loop_seconds", "depth", "Wall time of the loops (all iterations) by nesting depth."),
+}
+
+
+class LatencyHistogram:
+    """
+    Histogram of the durations with fixed bucket bounds. Recording a duration costs
+    one binary search, so the histogram may be updated for every executed command.
+
+    Parameters
+    ----------
+    buckets : tuple(float)
+        Sorted upper bounds of the buckets (seconds). The durations above the last
+        bound are counted in the overflow bucket.
+    """
+
+    __slots__ = ("buckets", "counts", "count", "sum", "min", "max")
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.min = float("inf")
+        self.max = 0.0
+
+    def observe(self, duration):
+        self.counts[bisect.bisect_left(self.buckets, duration)] += 1
+        self.count += 1
+        self.sum += duration
+        if duration < self.min:
+            self.min = duration
+        if duration > self.max:
+            self.max = duration
+
+    def quantile(self, q):
+        """
+        Estimate the quantile (linear interpolation inside the bucket).
+        """
+        if not self.count:
+            return float("nan")
+        rank = q * self.count
+        cumulative = 0
+        for n, count in enumerate(self.counts):
+            if count and cumulative + count >= rank:
+                low = self.buckets[n - 1] if n else 0.0
+                high = self.buckets[n] if n < len(self.buckets) else self.max
+                value = low + (high - low) * (rank - cumulative) / count
+                return min(max(value, self.min), self.max)
+            cumulative += count
+        return self.max
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "min": self.min if self.count else None,
+            "max": self.max,
+            "p50": self.quantile(0.5) if self.count else None,
+            "p99": self.quantile(0.99) if self.count else None,
+            "buckets": [[le, n] for le, n in zip(self.buckets + ("+Inf",), self.counts)],
+        }
+
+
+def _escape_label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class CommandMetrics:
+    """
+    Latency histograms of the commands, sub-script invocations and loops recorded
+    by the interpreter (see ``MegatronInterpreter``). The metrics may be exported
+    periodically to the Prometheus text file (e.g. for the textfile collector of the node
+    exporter) and to the JSON file. The files are rewritten atomically.
+
+    Parameters
+    ----------
+    prometheus_path : str or None
+        Path to the Prometheus text file.
+    json_path : str or None
+        Path to the JSON file.
+    export_interval : float
+        Minimum time (seconds) between the exports while the metrics are recorded.
+    buckets : tuple(float)
+        Upper bounds of the histogram buckets (seconds).
+    """
+
+    def __init__(self, prometheus_path=None, json_path=None, export_interval=10.0, buckets=DEFAULT_BUCKETS):
+        self.prometheus_path = prometheus_path
+        self.json_path = json_path
+        self.export_interval = export_interval
+        self.buckets = buckets
+        self.histograms = {kind: {} for kind in _metric_kinds}
+        self._next_export = time.monotonic() + export_interval
+
+    def observe(self, kind, name, duration):
+        """
+        Record the duration (seconds) of the command, script or loop (``kind``).
+        """
+        histograms = self.histograms[kind]
+        histogram = histograms.get(name)
+        if histogram is None:
+            histogram = histograms[name] = LatencyHistogram(self.buckets)
+        histogram.observe(duration)
+        if (self.prometheus_path or self.json_path) and time.monotonic() >= self._next_export:
+            self.export()
+
+    def export(self):
+        """
+        Rewrite the export files.
+        """
+        self._next_export = time.monotonic() + self.export_interval
+        if self.prometheus_path:
+            _write_atomic(self.prometheus_path, self.to_prometheus())
+        if self.json_path:
+            _write_atomic(self.json_path, json.dumps(self.to_dict(), indent=1))
+
+    def to_dict(self):
+        return {
+            kind: {name: histogram.to_dict() for name, histogram in histograms.items()}
+            for kind, histograms in self.histograms.items()
+        }
+
+    def to_prometheus(self):
+        """
+        Returns the metrics in the Prometheus text exposition format.
+        """
+        lines = []
+        for kind, (metric, label, help) in _metric_kinds.items():
+            lines.append(f"# HELP {metric} {help}")
+            lines.append(f"# TYPE {metric} histogram")
+            for name, histogram in sorted(self.histograms[kind].items()):
+                label_value = f'{label}="{_escape_label(name)}"'
+                cumulative = 0
+                for le, count in zip(histogram.buckets, histogram.counts):
+                    cumulative += count
+                    lines.append(f'{metric}_bucket{{{label_value},le="{le:g}"}} {cumulative}')
+                lines.append(f'{metric}_bucket{{{label_value},le="+Inf"}} {histogram.count}')
+                lines.append(f"{metric}_sum{{{label_value}}} {histogram.sum:.6f}")
+                lines.append(f"{metric}_count{{{label_value}}} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def summary(self, top=20):
+        """
+        Returns the human readable summary: the items with the largest total time of each kind.
+        """
+        lines = []
+        for kind, histograms in self.histograms.items():
+            if not histograms:
+                continue
+            lines.append(
+                f"{kind.capitalize() + 's':<32} {'count':>9} {'total, s':>11} {'mean, s':>10} {'p50, s':>10} "
+                f"{'p99, s':>10} {'max, s':>10}"
+            )
+            for name, h in sorted(histograms.items(), key=lambda _: -_[1].sum)[:top]:
+                lines.append(
+                    f"{str(name)[-32:]:<32} {h.count:>9} {h.sum:>11.3f} {h.sum / h.count:>10.4f} "
+                    f"{h.quantile(0.5):>10.4f} {h.quantile(0.99):>10.4f} {h.max:>10.4f}"
+                )
+            lines.append("")
+        return "\n".join(lines)
+
+
+def _write_atomic(path, text):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wt") as f:
+        f.write(text)
+    os.replace(tmp_path, path)
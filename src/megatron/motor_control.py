@@ -1,231 +1,261 @@
+import logging
 import bluesky.plan_stubs as bps
-from megatron.exceptions import CommandNotFoundError
-from megatron.support import motor_move, motor_stop, motor_home
-import inspect
+from megatron.registry import CommandRegistry
+from megatron.signal_cache import signal_cache
 
-def process_motor_command(command, args, context):
-    command_dispatcher = {
-        "ac": ac, "af": af, "ba": ba, "bg": bg, "bi": bi, "bl": bl, "bm": bm,
-        "bt": bt, "bz": bz, "cc": cc, "ce": ce, "cn": cn, "dc": dc, "dp": dp,
-        "er": er, "fa": fa, "fe": fe, "fl": fl, "fv": fv, "hm": hm, "hv": hv, 
-        "ib": ib, "iht": iht, "il": il, "kd": kd, "ki": ki, "kp": kp, "ld": ld, 
-        "mo": mo, "mt": mt, "op": op, "pa": pa, "pr": pr, "pv": pv, "sc": sc, 
-        "sh": sh, "sp": sp, "st": st, "ta": ta, "tp": tp, "xq": xq
-    }
-
-    if command in command_dispatcher:
-        command_function = command_dispatcher[command]
+_log = logging.getLogger(__name__)
 
-        sig = inspect.signature(command_function)
-        params = list(sig.parameters)
+motor_command_registry = CommandRegistry("Motor")
 
-        kwargs = {"args": args, "context": context}
-        dynamic_args = [kwargs[param] for param in params if param in kwargs]
-
-        yield from command_function(*dynamic_args)
-    else:
-        raise CommandNotFoundError(command)
+def process_motor_command(command, args, context):
+    yield from motor_command_registry.dispatch(command, args, context)
 
+@motor_command_registry.command("ac", min_args=1, arg_types=(float,))
 def ac(args, context):
     acceleration = float(args[0])
-    print(f"Setting acceleration to {acceleration}")
+    _log.info("Setting acceleration to %s", acceleration)
     galil = context.devices.galil
     yield from bps.mv(galil.acceleration, acceleration)
 
+@motor_command_registry.command("af", noop=True)
 def af(args):
-    print(f"Executing 'af' (Analog Feedback Select) command with args: {args}")
+    _log.info("Executing 'af' (Analog Feedback Select) command with args: %s", args)
     yield from bps.null()
 
+@motor_command_registry.command("ba", noop=True)
 def ba(args):
-    print(f"Executing 'ba' command with args: {args}")
+    _log.info("Executing 'ba' command with args: %s", args)
     yield from bps.null()
 
+@motor_command_registry.command("bg")
 def bg(context):
-    print(f"Begin movement")
+    from megatron.support import motor_move  # Imports ophyd
+    _log.info("Begin movement")
     galil = context.devices.galil
     yield from bps.mv(galil.velocity, context.galil_speed / 1000000)
     yield from bps.checkpoint()
     yield from motor_move(galil, context.galil_pos / 1000000, is_rel=context.galil_abs_rel)
 
+@motor_command_registry.command("bi", noop=True)
 def bi(args):
-    print(f"Executing 'bi' command with args: {args}")
+    _log.info("Executing 'bi' command with args: %s", args)
     yield from bps.null()
 
+@motor_command_registry.command("bl", noop=True)
 def bl(args):
-    print(f"Executing 'bl' (Reverse Software Limit) command with args: {args}")
+    _log.info("Executing 'bl' (Reverse Software Limit) command with args: %s", args)
     yield from bps.null()
 
+@motor_command_registry.command("bm", noop=True)
 def bm(args):
-    print(f"Executing 'bm' command with args: {args}")
+    _log.info("Executing 'bm' command with args: %s", args)
     yield from bps.null()
 
+@motor_command_registry.command("bt", noop=True)
 def bt(args):
-    print(f"Executing 'bt' command with args: {args}")
+    _log.info("Executing 'bt' command with args: %s", args)
     yield from bps.null()
 
+@motor_command_registry.command("bz", noop=True)
 def bz(args):
-    print(f"Executing 'bz' (Brushless Zero) command with args: {args}")
+    _log.info("Executing 'bz' (Brushless Zero) command with args: %s", args)
     yield from bps.null()
 
+@motor_command_registry.command("cc", noop=True)
 def cc(args):
-    print(f"Executing 'cc' (Configure Communications) command with args: {args}")
+    _log.info("Executing 'cc' (Configure Communications) command with args: %s", args)
     yield from bps.null()
 
+@motor_command_registry.command("ce", noop=True)
 def ce(args):
-    print(f"Executing 'ce' (Configure Encoder) command with args: {args}")
+    _log.info("Executing 'ce' (Configure Encoder) command with args: %s", args)
     yield from bps.null()
 
+@motor_command_registry.command("cn", noop=True)
 def cn(args):
-    print(f"Executing 'cn' command with args: {args}")
+    _log.info("Executing 'cn' command with args: %s", args)
     yield from bps.null()
 
+@motor_command_registry.command("dc", min_args=1, arg_types=(float,))
 def dc(args, context):
     deceleration = float(args[0])
-    print(f"Setting deceleration to {deceleration}")
+    _log.info("Setting deceleration to %s", deceleration)
     galil = context.devices.galil
     yield from bps.mv(galil.acceleration, deceleration)  
 
+@motor_command_registry.command("dp", min_args=1, arg_types=(float,), null_only=True)
 def dp(args, context):
     position = float(args[0])
-    print(f"Defining position: {position}")
+    _log.info("Defining position: %s", position)
     galil = context.devices.galil
     galil.set_current_position(position)
     yield from bps.null()
 
+@motor_command_registry.command("er", min_args=1, arg_types=(float,))
 def er(args, context):
     error_limit = float(args[0])
-    print(f"Setting error limit to {error_limit}")
+    _log.info("Setting error limit to %s", error_limit)
     galil = context.devices.galil
     yield from bps.mv(galil.error_limit, error_limit)  # placeholder, depends on the motor configuration
 
+@motor_command_registry.command("fa", noop=True)
 def fa(args):
-    print(f"Executing 'fa' (Acceleration Feedforward) command with args: {args}")
+    _log.info("Executing 'fa' (Acceleration Feedforward) command with args: %s", args)
     yield from bps.null()
 
+@motor_command_registry.command("fe", noop=True)
 def fe(args):
-    print(f"Executing 'fe' (Find Edge) command with args: {args}")
+    _log.info("Executing 'fe' (Find Edge) command with args: %s", args)
     yield from bps.null()
 
+@motor_command_registry.command("fl", noop=True)
 def fl(args):
-    print(f"Executing 'fl' (Forward Software Limit) command with args: {args}")
+    _log.info("Executing 'fl' (Forward Software Limit) command with args: %s", args)
     yield from bps.null()
 
+@motor_command_registry.command("fv", min_args=1, arg_types=(float,))
 def fv(args, context):
     velocity_feedforward = float(args[0])
-    print(f"Setting velocity feedforward to {velocity_feedforward}")
+    _log.info("Setting velocity feedforward to %s", velocity_feedforward)
     galil = context.devices.galil
     yield from bps.mv(galil.velocity, velocity_feedforward)
 
+@motor_command_registry.command("hm")
 def hm(context):
-    print("Homing device")
+    from megatron.support import motor_home  # Imports ophyd
+    _log.info("Homing device")
     galil = context.devices.galil
     yield from motor_home(galil)
 
+@motor_command_registry.command("hv", min_args=1, arg_types=(float,))
 def hv(args, context):
     homing_velocity = float(args[0])
-    print(f"Setting homing velocity to {homing_velocity}")
+    _log.info("Setting homing velocity to %s", homing_velocity)
     galil = context.devices.galil
     yield from bps.mv(galil.homing_velocity, homing_velocity)
 
+@motor_command_registry.command("ib", noop=True)
 def ib(args):
-    print(f"Executing 'ib' command with args: {args}")
+    _log.info("Executing 'ib' command with args: %s", args)
     yield from bps.null()
 
+@motor_command_registry.command("iht", noop=True)
 def iht(args):
-    print(f"Executing 'iht' (Close IP Handle) command with args: {args}")
+    _log.info("Executing 'iht' (Close IP Handle) command with args: %s", args)
     yield from bps.null()
 
+@motor_command_registry.command("il", min_args=1, arg_types=(float,))
 def il(args, context):
     integrator_limit = float(args[0])
-    print(f"Setting integrator limit to {integrator_limit}")
+    _log.info("Setting integrator limit to %s", integrator_limit)
     galil = context.devices.galil
     yield from bps.mv(galil.integrator_limit, integrator_limit)
 
+@motor_command_registry.command("kd", min_args=1, arg_types=(float,))
 def kd(args, context):
     derivative_gain = float(args[0])
-    print(f"Setting derivative gain to {derivative_gain}")
+    _log.info("Setting derivative gain to %s", derivative_gain)
     galil = context.devices.galil
     yield from bps.mv(galil.kd, derivative_gain)
 
+@motor_command_registry.command("ki", min_args=1, arg_types=(float,))
 def ki(args, context):
     integrator_gain = float(args[0])
-    print(f"Setting integrator gain to {integrator_gain}")
+    _log.info("Setting integrator gain to %s", integrator_gain)
     galil = context.devices.galil
     yield from bps.mv(galil.ki, integrator_gain)
 
+@motor_command_registry.command("kp", min_args=1, arg_types=(float,))
 def kp(args, context):
     proportional_gain = float(args[0])
-    print(f"Setting proportional gain to {proportional_gain}")
+    _log.info("Setting proportional gain to %s", proportional_gain)
     galil = context.devices.galil
     yield from bps.mv(galil.kp, proportional_gain)
 
+@motor_command_registry.command("ld", noop=True)
 def ld(args):
-    print(f"Executing 'ld' (Limit Disable) command with args: {args}")
+    _log.info("Executing 'ld' (Limit Disable) command with args: %s", args)
     yield from bps.null()
 
+@motor_command_registry.command("mo", null_only=True)
 def mo():
-    print(f"Turning motor off")
+    _log.info("Turning motor off")
     galil.stop()  # assume motor off is the same as stop
     yield from bps.null()
 
+@motor_command_registry.command("mt", min_args=1, noop=True)
 def mt(args):
     motor_type = args[0]
-    print(f"Setting motor type to {motor_type}")
+    _log.info("Setting motor type to %s", motor_type)
     yield from bps.null()
 
+@motor_command_registry.command("op", min_args=1, arg_types=(int,), noop=True)
 def op(args):
     output_port = int(args[0])
-    print(f"Setting output port: {output_port}")
+    _log.info("Setting output port: %s", output_port)
     yield from bps.null()
 
+@motor_command_registry.command("pa", min_args=1, arg_types=(float,), null_only=True)
 def pa(args, context):
     position = float(args[0])
-    print(f"Setting absolute position to {position}")
+    _log.info("Setting absolute position to %s", position)
     context.galil_abs_rel = 0
     context.galil_pos = position
     yield from bps.null()
 
+@motor_command_registry.command("pr", min_args=1, arg_types=(float,), null_only=True)
 def pr(args, context):
     position = float(args[0])
-    print(f"Setting relative position to {position}")
+    _log.info("Setting relative position to %s", position)
     context.galil_abs_rel = 1
     context.galil_pos = position
     yield from bps.null()
 
+@motor_command_registry.command("pv", noop=True)
 def pv(args):
-    print(f"Executing 'pv' command with args: {args}")
+    _log.info("Executing 'pv' command with args: %s", args)
     yield from bps.null()
 
+@motor_command_registry.command("sc", null_only=True)
 def sc(context):
-    print(f"Executing 'sc' (stop motor) command")
+    _log.info("Executing 'sc' (stop motor) command")
     galil = context.devices.galil
     galil.stop()
     yield from bps.null()
 
+@motor_command_registry.command("sh", noop=True)
 def sh():
-    print(f"Executing 'sh' (Servo Here) command")
+    _log.info("Executing 'sh' (Servo Here) command")
     yield from bps.null()
 
+@motor_command_registry.command("sp", min_args=1, arg_types=(float,), null_only=True)
 def sp(args, context):
     speed = float(args[0])
     context.galil_speed = speed;
-    print(f"Setting speed to {speed}")
+    _log.info("Setting speed to %s", speed)
     yield from bps.null()
 
+@motor_command_registry.command("st")
 def st(context):
-    print(f"Stopping motor")
+    from megatron.support import motor_stop  # Imports ophyd
+    _log.info("Stopping motor")
     yield from motor_stop(context.devices.galil)
 
+@motor_command_registry.command("ta", noop=True)
 def ta(args):
-    print(f"Executing 'ta' command with args: {args}")
+    _log.info("Executing 'ta' command with args: %s", args)
     yield from bps.null()
 
+@motor_command_registry.command("tp", null_only=True)
 def tp(context):
     galil = context.devices.galil
-    current_position = galil.position
-    print(f"Executing 'tp' (tell position), current position: {current_position}")
+    current_position = signal_cache.get(galil)
+    if current_position is None:
+        current_position = galil.position
+    _log.info("Executing 'tp' (tell position), current position: %s", current_position)
     yield from bps.null()
 
+@motor_command_registry.command("xq", noop=True)
 def xq(args):
-    print(f"Executing 'xq' (execute program) command with args: {args}")
+    _log.info("Executing 'xq' (execute program) command with args: %s", args)
     yield from bps.null()
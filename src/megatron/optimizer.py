@@ -0,0 +1,251 @@
+"""
+Peephole optimizer of the compiled scripts.
+
+The optimizer removes the instructions that only cost RunEngine messages and do not
+change the behavior of the devices:
+
+- blank lines (each yields a 'null' message),
+- commands registered with ``noop=True`` (stubs that only report their arguments),
+- 'l1 ... n' loops (the body is executed once in place) and loops with zero
+  iterations or an empty body,
+- zero timers ('t0'),
+- 'null' messages of the commands registered with ``null_only=True`` (e.g. 'pr', 'sp', 'log'):
+  the commands are executed when the interpreter reaches them, but their messages are
+  not sent to the RunEngine.
+
+Consecutive timers are merged into a single timer, a loop whose body is a single
+timer is replaced with the timer of the total duration (e.g. 'l100', 't.5', 'n' is 't50').
+The order of the other commands is preserved. Since the loops may be removed, the loop
+iteration messages and the loop latency metrics of the optimized script differ.
+
+Run from the ``src`` directory to report the changes without executing the script::
+
+    python -m megatron optimize scripts/run1.txt
+"""
+
+import sys
+import argparse
+from collections import Counter
+from megatron.compiler import OP_COMMAND, OP_LOOP, OP_NULL, OP_TIMER, Instruction, link_loops
+
+
+class OptimizationReport:
+    """
+    Changes made by the optimizer to a single script.
+
+    Attributes
+    ----------
+    instructions_before, instructions_after : int
+        Number of the instructions before and after the optimization.
+    blank_lines : int
+        Number of the removed blank lines.
+    noop_commands : Counter
+        Number of the removed commands by the command name.
+    loops_unwrapped : int
+        Number of the removed 'l1 ... n' loops (the body is kept).
+    loops_removed : int
+        Number of the removed loops with zero iterations or an empty body.
+    loops_folded : int
+        Number of the loops replaced with a single timer.
+    timers_merged : int
+        Number of the timers merged into the preceding timer.
+    zero_timers : int
+        Number of the removed zero timers.
+    null_messages : int
+        Number of the commands executed without their 'null' messages.
+    """
+
+    def __init__(self, script_path=None):
+        self.script_path = script_path
+        self.instructions_before = 0
+        self.instructions_after = 0
+        self.blank_lines = 0
+        self.noop_commands = Counter()
+        self.loops_unwrapped = 0
+        self.loops_removed = 0
+        self.loops_folded = 0
+        self.timers_merged = 0
+        self.zero_timers = 0
+        self.null_messages = 0
+
+    @property
+    def changed(self):
+        return self.instructions_after != self.instructions_before or bool(self.timers_merged or self.null_messages)
+
+    def format(self):
+        lines = [
+            f"{self.script_path or 'Script'}: {self.instructions_before} -> {self.instructions_after} instructions"
+        ]
+        items = [
+            ("blank lines removed", self.blank_lines),
+            ("no-op commands removed", sum(self.noop_commands.values())),
+            ("'l1' loops unwrapped", self.loops_unwrapped),
+            ("empty loops removed", self.loops_removed),
+            ("loops folded into timers", self.loops_folded),
+            ("timers merged", self.timers_merged),
+            ("zero timers removed", self.zero_timers),
+            ("commands without 'null' messages", self.null_messages),
+        ]
+        for name, count in items:
+            if count:
+                lines.append(f"  {name}: {count}")
+        if self.noop_commands:
+            commands = ", ".join(f"{c} ({n})" for c, n in self.noop_commands.most_common())
+            lines.append(f"  removed commands: {commands}")
+        return "\n".join(lines)
+
+
+class _WithoutMessages:
+    """
+    Handler of the ``null_only`` command that executes the command without yielding its messages.
+    """
+
+    __slots__ = ("handler",)
+
+    def __init__(self, handler):
+        self.handler = handler
+
+    def __getattr__(self, name):
+        return getattr(self.handler, name)
+
+    def __call__(self, args, context, current_script_path=None):
+        return _drain(self.handler(args, context, current_script_path))
+
+
+def _drain(plan):
+    for _ in plan:
+        pass
+    return
+    yield
+
+
+def _build_tree(program, start, end):
+    """
+    Returns the list of the instructions and the ``(loop, body, next)`` tuples of the loops
+    in ``program[start:end]``. The loops must be linked (see ``link_loops``).
+    """
+    nodes = []
+    ip = start
+    while ip < end:
+        instruction = program[ip]
+        if instruction.opcode == OP_LOOP:
+            nodes.append((instruction, _build_tree(program, ip + 1, instruction.target), program[instruction.target]))
+            ip = instruction.target + 1
+        else:
+            nodes.append(instruction)
+            ip += 1
+    return nodes
+
+
+def _timer_value(instruction):
+    return float(instruction.args[0])
+
+
+def _make_timer(instruction, seconds):
+    return Instruction(
+        OP_TIMER, instruction.command, (repr(round(seconds, 9)),), instruction.handler, line_no=instruction.line_no
+    )
+
+
+def _append(result, node, report):
+    # Merge the timer with the preceding timer
+    if isinstance(node, Instruction) and node.opcode == OP_TIMER and result:
+        previous = result[-1]
+        if isinstance(previous, Instruction) and previous.opcode == OP_TIMER:
+            result[-1] = _make_timer(previous, _timer_value(previous) + _timer_value(node))
+            report.timers_merged += 1
+            return
+    result.append(node)
+
+
+def _optimize_nodes(nodes, report):
+    result = []
+    for node in nodes:
+        if isinstance(node, tuple):
+            loop, body, next_instruction = node
+            body = _optimize_nodes(body, report)
+            loop_count = loop.args[0]
+            if loop_count < 1 or not body:
+                report.loops_removed += 1
+            elif loop_count == 1:
+                report.loops_unwrapped += 1
+                for _ in body:
+                    _append(result, _, report)
+            elif len(body) == 1 and isinstance(body[0], Instruction) and body[0].opcode == OP_TIMER:
+                report.loops_folded += 1
+                _append(result, _make_timer(body[0], _timer_value(body[0]) * loop_count), report)
+            else:
+                result.append((loop, body, next_instruction))
+            continue
+
+        opcode = node.opcode
+        if opcode == OP_NULL:
+            report.blank_lines += 1
+        elif opcode == OP_COMMAND and getattr(node.handler, "noop", False):
+            report.noop_commands[node.command] += 1
+        elif opcode == OP_TIMER and _timer_value(node) == 0:
+            report.zero_timers += 1
+        elif opcode == OP_COMMAND and getattr(node.handler, "null_only", False):
+            report.null_messages += 1
+            handler = node.handler if isinstance(node.handler, _WithoutMessages) else _WithoutMessages(node.handler)
+            _append(result, Instruction(OP_COMMAND, node.command, node.args, handler, line_no=node.line_no), report)
+        else:
+            _append(result, node, report)
+    return result
+
+
+def _flatten(nodes, program):
+    for node in nodes:
+        if isinstance(node, tuple):
+            loop, body, next_instruction = node
+            program.append(Instruction(OP_LOOP, loop.command, loop.args, line_no=loop.line_no))
+            _flatten(body, program)
+            program.append(Instruction(next_instruction.opcode, next_instruction.command, line_no=next_instruction.line_no))
+        else:
+            program.append(node)
+    return program
+
+
+def optimize_program(program, script_path=None):
+    """
+    Optimize the compiled script (see the module documentation). The program must be
+    compiled with the handlers resolved, the unresolved commands are kept.
+
+    Parameters
+    ----------
+    program : list(Instruction)
+        Compiled script, it is not modified.
+    script_path : str or None
+        Path to the script, saved in the report.
+
+    Returns
+    -------
+    list(Instruction), OptimizationReport
+    """
+    report = OptimizationReport(script_path)
+    report.instructions_before = len(program)
+    nodes = _optimize_nodes(_build_tree(program, 0, len(program)), report)
+    optimized = link_loops(_flatten(nodes, []))
+    report.instructions_after = len(optimized)
+    return optimized, report
+
+
+def main(argv=None, prog=None):
+    """
+    Report the changes made by the optimizer, returns the exit status.
+    """
+    parser = argparse.ArgumentParser(prog=prog, description="Report the changes made by the script optimizer.")
+    parser.add_argument("paths", type=str, nargs="+", help="Scripts.")
+    args = parser.parse_args(argv)
+
+    from megatron.compiler import compile_script
+    from megatron.validator import _resolve_handler
+
+    for path in args.paths:
+        _, report = optimize_program(compile_script(path, _resolve_handler), path)
+        print(report.format())
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,355 @@
+import os
+import re
+import sys
+import fnmatch
+import argparse
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from megatron.compiler import OP_TIMER, OP_COMMAND, OP_LOOP, OP_NEXT, OP_ERROR, compile_lines, parse_line
+from megatron.script_cache import CACHE_DIR_NAME
+
+_separator_pattern = re.compile(r"[\\/]+")
+
+
+def _normalize_arg(value):
+    # Script names are compared as the paths resolved by 'SubScriptCache' (case and
+    # the path separators are ignored)
+    return _separator_pattern.sub("/", str(value).strip().lower())
+
+
+def _match_arg(pattern, value):
+    value = _normalize_arg(value)
+    if any(_ in pattern for _ in "*?["):
+        return fnmatch.fnmatchcase(value, pattern)
+    if pattern == value:
+        return True
+    try:
+        return float(pattern) == float(value)
+    except ValueError:
+        return False
+
+
+class CommandPattern:
+    """
+    Pattern matching the compiled commands. The command matches if the name is the same
+    and the leading arguments match the arguments of the pattern (the command may have
+    more arguments). Arguments are compared ignoring the case and the path separators,
+    numbers are compared by value and shell-style wildcards (``*``, ``?``, ``[...]``)
+    are supported.
+
+    Parameters
+    ----------
+    command : str
+        Command name, e.g. ``"setao"``. Timers and loops are ``"t"`` and ``"l"``.
+    args : iterable(str)
+        Leading arguments of the command.
+    """
+
+    def __init__(self, command, args=()):
+        self.command = command.lower()
+        self.args = tuple(_normalize_arg(_) for _ in args)
+
+    @classmethod
+    def parse(cls, text):
+        """
+        Create the pattern from the script line, e.g. ``'setao "ION Power", 250'``
+        or ``'t600'``. The line is parsed by the script compiler.
+        """
+        instruction = parse_line(text)
+        if instruction is None or instruction.command is None:
+            raise ValueError(f"Invalid command pattern: {text!r}")
+        return cls(instruction.command, instruction.args)
+
+    def matches(self, instruction):
+        if instruction.command != self.command or len(instruction.args) < len(self.args):
+            return False
+        return all(_match_arg(p, a) for p, a in zip(self.args, instruction.args))
+
+    def __repr__(self):
+        return f"CommandPattern({self.command!r}, {self.args!r})"
+
+
+def _as_patterns(patterns):
+    return tuple(CommandPattern.parse(_) if isinstance(_, str) else _ for _ in patterns)
+
+
+def format_instruction(instruction):
+    """
+    Returns the script line of the compiled instruction.
+    """
+    if instruction.opcode == OP_TIMER:
+        return f"t{instruction.args[0]}"
+    if instruction.opcode == OP_LOOP:
+        return f"l{instruction.args[0]}"
+    if instruction.opcode == OP_ERROR:
+        return f"{instruction.command} ({instruction.args[0]})"
+    args = [f'"{_}"' if any(c in _ for c in " ,") else str(_) for _ in instruction.args]
+    return " ".join([instruction.command, ", ".join(args)]) if args else instruction.command
+
+
+class LoopSummary:
+    """
+    Aggregates of the loop (or of the whole script). Timer seconds, command counts and
+    sub-script calls are totals of a single iteration with the nested loops expanded.
+
+    Attributes
+    ----------
+    line_no, end_line_no : int
+        Lines of 'l' and 'n' (0 for the script).
+    count : int
+        Number of iterations.
+    depth : int
+        Nesting depth, 0 for the top-level loops.
+    timer_seconds : float
+        Time of the timers ('t') of a single iteration.
+    command_counts : collections.Counter
+        Command name -> number of executions in a single iteration.
+    sub_scripts : collections.Counter
+        Name of the script called by 'run' -> number of calls in a single iteration.
+    contains : bool
+        ``True`` if the loop contains the commands matching the query sequence
+        (in order, other commands may be in between).
+    """
+
+    __slots__ = (
+        "line_no", "end_line_no", "count", "depth", "timer_seconds", "command_counts", "sub_scripts", "contains",
+        "_progress"
+    )
+
+    def __init__(self, line_no=0, count=1, depth=-1):
+        self.line_no = line_no
+        self.end_line_no = 0
+        self.count = count
+        self.depth = depth
+        self.timer_seconds = 0.0
+        self.command_counts = Counter()
+        self.sub_scripts = Counter()
+        self.contains = False
+        self._progress = 0
+
+    @property
+    def total_timer_seconds(self):
+        """
+        Time of the timers of all iterations.
+        """
+        return self.timer_seconds * self.count
+
+    def __repr__(self):
+        return (
+            f"LoopSummary(line_no={self.line_no}, end_line_no={self.end_line_no}, count={self.count}, "
+            f"depth={self.depth}, timer_seconds={self.timer_seconds}, contains={self.contains})"
+        )
+
+
+class ScriptSummary:
+    """
+    Results of the query of a single script.
+
+    Attributes
+    ----------
+    script_path : str
+        Path to the script.
+    script : LoopSummary
+        Aggregates of the whole script.
+    loops : list(LoopSummary)
+        All loops in the order of the 'l' lines.
+    uses : list(tuple)
+        ``(line_no, line)`` of the commands matching any of the ``uses`` patterns.
+    errors : list(tuple)
+        ``(line_no, message)`` of the unmatched loops.
+    """
+
+    def __init__(self, script_path):
+        self.script_path = script_path
+        self.script = LoopSummary()
+        self.loops = []
+        self.uses = []
+        self.errors = []
+
+    @property
+    def top_level_loops(self):
+        return [_ for _ in self.loops if _.depth == 0]
+
+    @property
+    def matching_loops(self):
+        return [_ for _ in self.loops if _.contains]
+
+
+def summarize_program(program, uses=(), sequence=(), script_path=None):
+    """
+    Compute the aggregates and match the patterns in a single pass over the compiled script.
+
+    Parameters
+    ----------
+    program : list(Instruction)
+        Script compiled by ``compile_lines`` (not grouped).
+    uses : iterable(CommandPattern or str)
+        Patterns of the commands to find.
+    sequence : iterable(CommandPattern or str)
+        Sequence of the patterns the loops are tested for (see ``LoopSummary.contains``).
+    script_path : str or None
+        Path saved in the summary.
+
+    Returns
+    -------
+    ScriptSummary
+    """
+    uses, sequence = _as_patterns(uses), _as_patterns(sequence)
+    uses_by_command = {}  # Only the patterns of the same command are tested
+    for pattern in uses:
+        uses_by_command.setdefault(pattern.command, []).append(pattern)
+    sequence_commands = {_.command for _ in sequence}
+
+    summary = ScriptSummary(script_path)
+    frames = [summary.script]  # The script and the open loops
+    frame = summary.script
+    for instruction in program:
+        opcode = instruction.opcode
+        if opcode == OP_COMMAND or opcode == OP_TIMER:
+            command = instruction.command
+            frame.command_counts[command] += 1
+            if opcode == OP_TIMER:
+                frame.timer_seconds += float(instruction.args[0])
+            elif command == "run":
+                frame.sub_scripts[instruction.args[0]] += 1
+            patterns = uses_by_command.get(command)
+            if patterns and any(_.matches(instruction) for _ in patterns):
+                summary.uses.append((instruction.line_no, format_instruction(instruction)))
+            if command in sequence_commands:
+                # Each of the open loops (and the script) advances through the sequence
+                for open_frame in frames:
+                    if not open_frame.contains and sequence[open_frame._progress].matches(instruction):
+                        open_frame._progress += 1
+                        open_frame.contains = open_frame._progress == len(sequence)
+        elif opcode == OP_LOOP:
+            frame = LoopSummary(instruction.line_no, instruction.args[0], len(frames) - 1)
+            summary.loops.append(frame)
+            frames.append(frame)
+        elif opcode == OP_NEXT:
+            loop = frames.pop()
+            loop.end_line_no = instruction.line_no
+            frame = frames[-1]
+            frame.timer_seconds += loop.total_timer_seconds
+            if loop.count:
+                frame.command_counts.update({k: v * loop.count for k, v in loop.command_counts.items()})
+                frame.sub_scripts.update({k: v * loop.count for k, v in loop.sub_scripts.items()})
+        elif opcode == OP_ERROR:
+            summary.errors.append((instruction.line_no, instruction.args[0]))
+    return summary
+
+
+def query_script(script_path, uses=(), sequence=()):
+    """
+    Compile the script and query it (see ``summarize_program``).
+    """
+    with open(script_path, "r", encoding="utf-8", errors="replace") as f:
+        program = compile_lines(f)
+    return summarize_program(program, uses, sequence, script_path)
+
+
+def _query_script(args):
+    return query_script(*args)
+
+
+def find_scripts(paths):
+    """
+    Returns the paths of the scripts. Directories are searched for scripts ('*.txt') recursively.
+    """
+    script_paths = []
+    for path in paths:
+        if os.path.isdir(path):
+            for dir_path, dir_names, file_names in os.walk(path):
+                dir_names[:] = [_ for _ in dir_names if _ != CACHE_DIR_NAME]
+                script_paths.extend([os.path.join(dir_path, _) for _ in file_names if _.lower().endswith(".txt")])
+        else:
+            script_paths.append(path)
+    return script_paths
+
+
+def query_scripts(paths, uses=(), sequence=(), max_workers=None):
+    """
+    Query the scripts. The scripts are queried in parallel by a pool of processes.
+
+    Parameters
+    ----------
+    paths : iterable(str)
+        Scripts or directories with scripts.
+    uses, sequence : iterable(CommandPattern or str)
+        See ``summarize_program``.
+    max_workers : int or None
+        Number of worker processes, the number of CPUs if ``None``. The scripts are
+        queried in the current process if ``max_workers`` is 1 or there are few scripts.
+
+    Yields
+    ------
+    ScriptSummary
+        Summaries in the order of the scripts.
+    """
+    uses, sequence = _as_patterns(uses), _as_patterns(sequence)
+    tasks = [(_, uses, sequence) for _ in find_scripts(paths)]
+    if len(tasks) > 4 and max_workers != 1:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            yield from executor.map(_query_script, tasks, chunksize=8)
+    else:
+        yield from map(_query_script, tasks)
+
+
+def main(argv=None, prog=None):
+    """
+    Command line interface of the query engine, returns the exit status.
+    """
+    parser = argparse.ArgumentParser(
+        prog=prog, description="Query Megatron scripts by their structure (loops, commands and their arguments)."
+    )
+    parser.add_argument("paths", type=str, nargs="+", help="Scripts or directories with scripts.")
+    parser.add_argument(
+        "-u", "--uses", type=str, action="append", default=[],
+        help="Find the commands matching the pattern, e.g. 'failif \"Galil Failed\"'. May be repeated."
+    )
+    parser.add_argument(
+        "-c", "--loop-contains", type=str, action="append", default=[],
+        help="Find the loops containing the commands matching the patterns in order. May be repeated."
+    )
+    parser.add_argument("-t", "--loop-timers", action="store_true", help="Report the timer totals of the loops.")
+    parser.add_argument("--all-loops", action="store_true", help="Report the nested loops, not only the top-level.")
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="Number of worker processes.")
+    args = parser.parse_args(argv)
+
+    try:
+        summaries = query_scripts(args.paths, args.uses, args.loop_contains, max_workers=args.jobs)
+        n_scripts = n_matches = 0
+        for summary in summaries:
+            n_scripts += 1
+            script_path = summary.script_path
+            for line_no, line in summary.uses:
+                print(f"{script_path}:{line_no}: {line}")
+            n_matches += len(summary.uses)
+            if args.loop_contains:
+                loops = summary.matching_loops if args.all_loops else [
+                    _ for _ in summary.matching_loops if _.depth == 0
+                ]
+                for loop in loops:
+                    print(f"{script_path}:{loop.line_no}-{loop.end_line_no}: l{loop.count}")
+                n_matches += len(loops)
+            if args.loop_timers:
+                for loop in summary.loops if args.all_loops else summary.top_level_loops:
+                    print(
+                        f"{script_path}:{loop.line_no}-{loop.end_line_no}: l{loop.count}: "
+                        f"{loop.timer_seconds:g} s per iteration, {loop.total_timer_seconds:g} s total"
+                    )
+            if not (args.uses or args.loop_contains or args.loop_timers):
+                script = summary.script
+                print(
+                    f"{script_path}: {len(summary.loops)} loops, {script.timer_seconds:g} s of timers, "
+                    f"{sum(script.command_counts.values())} commands, {len(script.sub_scripts)} sub-scripts"
+                )
+        if args.uses or args.loop_contains:
+            print(f"{n_matches} matches in {n_scripts} scripts")
+    except ValueError as ex:
+        print(ex)
+        return 2
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
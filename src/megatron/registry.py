@@ -0,0 +1,189 @@
+import inspect
+import hashlib
+from megatron.exceptions import CommandNotFoundError, InvalidArgumentError
+
+# Parameters that command handlers may declare, passed by the dispatcher
+_handler_parameters = ("args", "context", "current_script_path")
+
+
+class Command:
+    """
+    Registered command handler. The parameters expected by the handler are determined
+    once at registration, so calling the command does not require introspection.
+
+    Parameters
+    ----------
+    name : str
+        Command name (lower case).
+    function : callable
+        Generator function implementing the command. It may accept any of the parameters
+        ``args``, ``context`` and ``current_script_path`` (by name, in any order).
+    min_args : int
+        Minimum number of arguments.
+    max_args : int or None
+        Maximum number of arguments, ``None`` if the number is not limited.
+    arg_types : tuple
+        Functions (e.g. ``float``) used to validate the arguments at the respective positions.
+        ``None`` skips validation of the argument.
+    noop : bool
+        The command only reports its arguments: it does not access the devices or change
+        the context, so the optimizer may remove it (see ``megatron.optimizer``).
+    null_only : bool
+        The command yields only 'null' messages (it does not access the devices through
+        the RunEngine), so the optimizer may execute it without the messages.
+    """
+
+    __slots__ = (
+        "name", "function", "parameters", "min_args", "max_args", "arg_types", "noop", "null_only", "_invoke"
+    )
+
+    def __init__(self, name, function, *, min_args=0, max_args=None, arg_types=(), noop=False, null_only=False):
+        self.name = name
+        self.function = function
+        self.min_args = min_args
+        self.max_args = max_args
+        self.arg_types = tuple(arg_types)
+        self.noop = noop
+        self.null_only = null_only
+
+        params = tuple(inspect.signature(function).parameters)
+        self.parameters = tuple(_ for _ in params if _ in _handler_parameters)
+        self._invoke = _make_invoke(function, self.parameters)
+
+    def __repr__(self):
+        return f"Command({self.name!r}, {self.function.__module__}.{self.function.__name__})"
+
+    @property
+    def signature(self):
+        """
+        Parameters of the command that change the compiled scripts (see ``registry_signature``).
+        """
+        arg_types = ",".join([getattr(_, "__qualname__", repr(_)) if _ is not None else "" for _ in self.arg_types])
+        return f"{self.name}({self.min_args},{self.max_args},[{arg_types}],{self.noop:d},{self.null_only:d})"
+
+    def __call__(self, args, context, current_script_path=None):
+        """
+        Returns the generator executing the command.
+        """
+        return self._invoke(args, context, current_script_path)
+
+    def validate(self, args):
+        """
+        Check the number and the types of the arguments.
+
+        Raises
+        ------
+        InvalidArgumentError
+        """
+        n_args = len(args)
+        if n_args < self.min_args or (self.max_args is not None and n_args > self.max_args):
+            raise InvalidArgumentError(self.name, list(args))
+        for arg, arg_type in zip(args, self.arg_types):
+            if arg_type is None:
+                continue
+            try:
+                arg_type(arg)
+            except (TypeError, ValueError):
+                raise InvalidArgumentError(self.name, list(args))
+
+
+def _make_invoke(function, parameters):
+    if parameters == ():
+        return lambda args, context, current_script_path: function()
+    elif parameters == ("args",):
+        return lambda args, context, current_script_path: function(args)
+    elif parameters == ("context",):
+        return lambda args, context, current_script_path: function(context)
+    elif parameters == ("args", "context"):
+        return lambda args, context, current_script_path: function(args, context)
+
+    def invoke(args, context, current_script_path):
+        kwargs = {"args": args, "context": context, "current_script_path": current_script_path}
+        return function(*[kwargs[_] for _ in parameters])
+
+    return invoke
+
+
+class CommandRegistry:
+    """
+    Registry of commands. Handlers are registered with the ``command`` decorator.
+
+    Parameters
+    ----------
+    name : str
+        Name of the command group, used in messages.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self._commands = {}
+        self._signature = None
+
+    def __contains__(self, command):
+        return command in self._commands
+
+    def __iter__(self):
+        return iter(self._commands)
+
+    def __len__(self):
+        return len(self._commands)
+
+    def __repr__(self):
+        return f"CommandRegistry({self.name!r}, commands={list(self._commands)})"
+
+    def command(self, name, *, min_args=0, max_args=None, arg_types=(), noop=False, null_only=False):
+        """
+        Decorator that registers a handler for the command. See ``Command`` for the description
+        of the parameters.
+        """
+
+        def decorator(function):
+            self._commands[name] = Command(
+                name, function, min_args=min_args, max_args=max_args, arg_types=arg_types, noop=noop,
+                null_only=null_only
+            )
+            self._signature = None
+            return function
+
+        return decorator
+
+    @property
+    def signature(self):
+        """
+        Signature of the registered commands: the names, the numbers and the types of the arguments
+        and the flags of the commands, sorted by the name.
+        """
+        if self._signature is None:
+            self._signature = ";".join([self._commands[_].signature for _ in sorted(self._commands)])
+        return self._signature
+
+    def get(self, command):
+        """
+        Returns registered ``Command`` or ``None`` if the command is not registered.
+        """
+        return self._commands.get(command)
+
+    def dispatch(self, command, args, context, current_script_path=None):
+        """
+        Execute the command (generator).
+
+        Raises
+        ------
+        CommandNotFoundError
+        """
+        try:
+            handler = self._commands[command]
+        except KeyError:
+            raise CommandNotFoundError(command)
+        yield from handler(args, context, current_script_path)
+
+
+def registry_signature(*registries):
+    """
+    Returns the hash of the signatures of the registries. The compiled scripts and the validation
+    results depend on the registered commands, so the hash is a part of the keys of the cached results.
+    """
+    h = hashlib.blake2b(digest_size=8)
+    for registry in registries:
+        h.update(f"{registry.name}:{registry.signature}\n".encode())
+    return h.hexdigest()
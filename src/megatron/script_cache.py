@@ -0,0 +1,289 @@
+import io
+import re
+import os
+import glob
+import pickle
+import hashlib
+import logging
+from megatron.compiler import (
+    COMPILER_VERSION, OP_COMMAND, OP_TIMER, OP_ERROR, Instruction, compile_lines
+)
+from megatron.exceptions import CommandNotFoundError
+
+_log = logging.getLogger(__name__)
+
+CACHE_DIR_NAME = "__megatron_cache__"
+
+
+def _pack_program(program):
+    """
+    Convert the program to the compact serializable form. Handlers are not saved,
+    they are resolved again when the program is loaded. Equal argument tuples are
+    shared, so that each of them is serialized only once.
+    """
+    shared_args = {}
+    return [
+        (_.opcode, _.command, shared_args.setdefault(_.args, _.args), _.target, _.line_no) for _ in program
+    ]
+
+
+def _unpack_program(packed, resolve_handler):
+    handlers = {}
+    program = []
+    for opcode, command, args, target, line_no in packed:
+        handler = None
+        if resolve_handler and opcode in (OP_COMMAND, OP_TIMER):
+            if command not in handlers:
+                handlers[command] = resolve_handler(command)
+            handler = handlers[command]
+            if handler is None:
+                opcode, args = OP_ERROR, (str(CommandNotFoundError(command)),)
+        program.append(Instruction(opcode, command, args, handler, target, line_no))
+    return program
+
+
+class CompiledScriptCache:
+    """
+    Persistent on-disk cache of compiled scripts. The compiled script is saved in
+    the compact serialized form and keyed by the hash of the script contents, the version
+    of the compiler and the signature of the command registries, so that the cache entry
+    is invalidated automatically when the script or the registered commands are changed.
+
+    Parameters
+    ----------
+    cache_dir : str or None
+        Directory for the cached files. If ``None``, then the cache is saved in
+        the ``__megatron_cache__`` directory next to each script.
+    signature : str
+        Signature of the command registries used to compile the scripts (see ``registry_signature``).
+    """
+
+    def __init__(self, cache_dir=None, signature=""):
+        self.cache_dir = os.path.abspath(os.path.expanduser(cache_dir)) if cache_dir else None
+        self.signature = signature
+
+    def _get_cache_dir(self, script_path):
+        if self.cache_dir:
+            return self.cache_dir
+        return os.path.join(os.path.dirname(script_path), CACHE_DIR_NAME)
+
+    def _get_cache_path(self, script_path, digest):
+        script_name = os.path.basename(script_path)
+        return os.path.join(self._get_cache_dir(script_path), f"{script_name}.{digest}.pickle")
+
+    def compute_digest(self, data):
+        h = hashlib.blake2b(data, digest_size=16)
+        h.update(f"v{COMPILER_VERSION}.{self.signature}".encode())
+        return h.hexdigest()
+
+    def load(self, script_path, resolve_handler=None):
+        """
+        Load the compiled script from cache or compile the script and save it to cache.
+
+        Parameters
+        ----------
+        script_path : str
+            Absolute path to the script.
+        resolve_handler : callable or None
+            Passed to the compiler, see ``compile_lines``.
+
+        Returns
+        -------
+        list(Instruction)
+        """
+        with open(script_path, "rb") as script_file:
+            data = script_file.read()
+
+        digest = self.compute_digest(data)
+        cache_path = self._get_cache_path(script_path, digest)
+
+        try:
+            with open(cache_path, "rb") as f:
+                packed = pickle.loads(f.read())
+            return _unpack_program(packed, resolve_handler)
+        except FileNotFoundError:
+            pass
+        except Exception as ex:
+            _log.warning("Failed to load compiled script from cache %r: %s", cache_path, ex)
+
+        program = compile_lines(io.StringIO(data.decode("utf-8", errors="replace")), resolve_handler)
+        self.save(script_path, cache_path, program)
+        return program
+
+    def save(self, script_path, cache_path, program):
+        """
+        Save the compiled script. Outdated entries of the same script are removed
+        if the cache is saved next to the script. Failure to write the cache (e.g. read-only script directory) is not an error.
+        """
+        cache_dir, cache_name = os.path.split(cache_path)
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            if not self.cache_dir:
+                pattern = f"{glob.escape(os.path.basename(script_path))}.*.pickle"
+                for outdated_path in glob.glob(os.path.join(glob.escape(cache_dir), pattern)):
+                    if os.path.basename(outdated_path).count(".") == cache_name.count("."):
+                        os.remove(outdated_path)
+
+            tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(pickle.dumps(_pack_program(program), protocol=pickle.HIGHEST_PROTOCOL))
+            os.replace(tmp_path, cache_path)
+        except OSError as ex:
+            _log.warning("Failed to save compiled script to cache %r: %s", cache_path, ex)
+
+
+class SubScriptCache:
+    """
+    In-memory cache of compiled scripts, used by the interpreter to avoid reading and
+    compiling the same sub-script each time it is called with the 'run' command.
+    Cached scripts are re-validated by comparing modification time and size of the file.
+    Script names are resolved once and the result is memoized while the searched directories
+    are unchanged.
+
+    Parameters
+    ----------
+    load_script : callable
+        Function that accepts the absolute path to the script and returns the compiled script.
+    """
+
+    def __init__(self, load_script):
+        self._load_script = load_script
+        self._scripts = {}
+        self._resolved_paths = {}
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "scripts": len(self._scripts)}
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}(hits={self.hits}, misses={self.misses}, scripts={len(self._scripts)})"
+
+    def clear(self):
+        self._scripts.clear()
+        self._resolved_paths.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def load(self, script_path):
+        """
+        Returns the compiled script. The script is compiled only if it is not cached
+        or the file was changed since it was cached.
+        """
+        st = os.stat(script_path)
+        key = (st.st_mtime_ns, st.st_size)
+        cached = self._scripts.get(script_path)
+        if cached is not None and cached[0] == key:
+            self.hits += 1
+            return cached[1]
+
+        self.misses += 1
+        program = self._load_script(script_path)
+        self._scripts[script_path] = (key, program)
+        return program
+
+    def resolve(self, script_name, script_dir, root_dir=None):
+        """
+        Resolve the script name used in 'run' or 'failif' command to the absolute path.
+        Windows path separators are accepted, '.txt' extension may be omitted and
+        the names are matched case-insensitively if there is no exact match. The script
+        is searched in ``script_dir`` and then in its parent directories up to ``root_dir``
+        (the root of the scripts tree, see ``default_scripts_root``). The resolved path is
+        memoized and re-checked by the modification time and size of the searched directories.
+
+        Returns
+        -------
+        str
+            Absolute path to the script. If the script is not found, the path relative to
+            ``script_dir`` is returned.
+        """
+        key = (script_name, script_dir, root_dir)
+        cached = self._resolved_paths.get(key)
+        if cached is not None and all(_stat_key(d) == k for d, k in cached[1]):
+            return cached[0]
+
+        parts = [_ for _ in re.split(r"[\\/]+", os.path.expanduser(script_name)) if _]
+        if os.path.isabs(script_name):
+            script_dir = root_dir = os.path.abspath(os.sep)
+        search_dirs = [script_dir]
+        if root_dir is not None and _is_subdir(script_dir, root_dir):
+            while os.path.normcase(search_dirs[-1]) != os.path.normcase(root_dir):
+                search_dirs.append(os.path.dirname(search_dirs[-1]))
+        searched = []
+        script_path = None
+        for search_dir in search_dirs:
+            script_path = _find_script(search_dir, parts, searched)
+            if script_path is not None:
+                break
+
+        if script_path is None:
+            script_path = os.path.join(script_dir, *parts)
+        script_path = os.path.abspath(os.path.expanduser(script_path))
+        self._resolved_paths[key] = (script_path, [(_, _stat_key(_)) for _ in searched])
+        return script_path
+
+
+def default_scripts_root(script_dir):
+    """
+    Returns the default root of the scripts tree for the top-level script in ``script_dir``:
+    the current directory if it contains the script, otherwise ``script_dir``.
+    """
+    cwd = os.getcwd()
+    return cwd if _is_subdir(script_dir, cwd) else script_dir
+
+
+def _is_subdir(path, directory):
+    path, directory = os.path.normcase(os.path.abspath(path)), os.path.normcase(os.path.abspath(directory))
+    try:
+        return os.path.commonpath([path, directory]) == directory
+    except ValueError:
+        return False
+
+
+def _stat_key(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+
+def _find_name(directory, name):
+    """
+    Find the file or directory with the given name in the directory, ignoring the case
+    if there is no exact match. Returns ``None`` if nothing is found.
+    """
+    if os.path.exists(os.path.join(directory, name)):
+        return name
+    try:
+        entries = os.listdir(directory)
+    except OSError:
+        return None
+    name_lower = name.lower()
+    for entry in entries:
+        if entry.lower() == name_lower:
+            return entry
+    return None
+
+
+def _find_script(directory, parts, searched):
+    """
+    Find the script ``parts`` (path components) in the directory. The searched directories
+    are appended to ``searched``.
+    """
+    if not parts:
+        return None
+    searched.append(directory)
+    for name in parts[:-1]:
+        name = _find_name(directory, name)
+        if name is None:
+            return None
+        directory = os.path.join(directory, name)
+        searched.append(directory)
+
+    for name in (parts[-1], parts[-1] + ".txt"):
+        name = _find_name(directory, name)
+        if name is not None and os.path.isfile(os.path.join(directory, name)):
+            return os.path.join(directory, name)
+    return None
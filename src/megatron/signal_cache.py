@@ -0,0 +1,141 @@
+import threading
+import time
+
+
+class _SignalSnapshot:
+    """
+    Latest value of a single signal, updated from the monitor callback.
+    """
+
+    __slots__ = ("signal", "event_type", "value", "timestamp", "has_value", "listeners")
+
+    def __init__(self, signal):
+        self.signal = signal
+        self.event_type = signal.SUB_READBACK if hasattr(signal, "SUB_READBACK") else signal.SUB_VALUE
+        self.value = None
+        self.timestamp = None
+        self.has_value = False
+        self.listeners = ()
+
+    def on_update(self, *args, value=None, timestamp=None, **kwargs):
+        self.value = value
+        self.timestamp = timestamp if timestamp is not None else time.time()
+        self.has_value = True
+        for listener in self.listeners:
+            listener(value)
+
+
+class SignalSnapshotCache:
+    """
+    Cache of the latest values of signals. Each signal is subscribed once when it is
+    first accessed and the cache is updated from the monitor callbacks, so reading
+    the value never requires a round trip to the control system.
+
+    Parameters
+    ----------
+    stale_after : float or None
+        Age (seconds since the last update) after which the value is considered stale.
+        If ``None``, values are never stale once received.
+    """
+
+    def __init__(self, stale_after=None):
+        self.stale_after = stale_after
+        self._lock = threading.Lock()
+        self._snapshots = {}
+
+    def __contains__(self, signal):
+        return signal in self._snapshots
+
+    def _get_snapshot(self, signal):
+        snapshot = self._snapshots.get(signal)
+        if snapshot is None:
+            with self._lock:
+                snapshot = self._snapshots.get(signal)
+                if snapshot is None:
+                    snapshot = _SignalSnapshot(signal)
+                    self._snapshots[signal] = snapshot
+                    # The callback is called with the current value if it is available
+                    signal.subscribe(snapshot.on_update, event_type=snapshot.event_type)
+                    if not snapshot.has_value:
+                        self._read_initial_value(snapshot)
+        return snapshot
+
+    @staticmethod
+    def _read_initial_value(snapshot):
+        # Signals that did not report the value yet are read once, all later
+        # values are received by the monitor callback.
+        signal = snapshot.signal
+        try:
+            value = signal.position if hasattr(signal, "position") else signal.get()
+        except Exception:
+            return
+        if not snapshot.has_value:
+            snapshot.value = value
+            snapshot.timestamp = getattr(signal, "timestamp", None) or time.time()
+            snapshot.has_value = True
+
+    def add(self, signal):
+        """
+        Start monitoring the signal.
+        """
+        self._get_snapshot(signal)
+
+    def get(self, signal, default=None):
+        """
+        Returns the latest value of the signal or ``default`` if no value was received yet.
+        """
+        snapshot = self._get_snapshot(signal)
+        return snapshot.value if snapshot.has_value else default
+
+    def get_snapshot(self, signal):
+        """
+        Returns the tuple ``(value, timestamp, is_stale)``. The value and timestamp are
+        ``None`` if no value was received yet (such value is considered stale).
+        """
+        snapshot = self._get_snapshot(signal)
+        if not snapshot.has_value:
+            return None, None, True
+        timestamp = snapshot.timestamp
+        return snapshot.value, timestamp, self._is_stale(timestamp)
+
+    def _is_stale(self, timestamp):
+        return self.stale_after is not None and time.time() - timestamp > self.stale_after
+
+    def age(self, signal):
+        """
+        Returns the time (seconds) since the last update or ``None`` if no value was received.
+        """
+        snapshot = self._get_snapshot(signal)
+        return time.time() - snapshot.timestamp if snapshot.has_value else None
+
+    def is_stale(self, signal):
+        snapshot = self._get_snapshot(signal)
+        return not snapshot.has_value or self._is_stale(snapshot.timestamp)
+
+    def add_listener(self, signal, listener):
+        """
+        Call ``listener(value)`` on each update of the signal (from the thread that processes
+        the signal updates). Returns ``True`` if the current value is available.
+        """
+        snapshot = self._get_snapshot(signal)
+        with self._lock:
+            snapshot.listeners = snapshot.listeners + (listener,)
+        return snapshot.has_value
+
+    def remove_listener(self, signal, listener):
+        snapshot = self._snapshots.get(signal)
+        if snapshot is not None:
+            with self._lock:
+                snapshot.listeners = tuple(_ for _ in snapshot.listeners if _ is not listener)
+
+    def clear(self):
+        """
+        Remove all subscriptions and cached values.
+        """
+        with self._lock:
+            for signal, snapshot in self._snapshots.items():
+                signal.clear_sub(snapshot.on_update)
+            self._snapshots.clear()
+
+
+signal_cache = SignalSnapshotCache()
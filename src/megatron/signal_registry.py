@@ -0,0 +1,235 @@
+import os
+import re
+import csv
+import time
+
+# ophyd is imported when the signals are created, so that the registry can be loaded
+# (e.g. by the validator) without loading it.
+
+SIGNAL_KINDS = ("ro", "rw")
+
+_device_name_pattern = re.compile(r"\W+")
+
+
+class SignalSpec:
+    """
+    Description of the signal referenced by scripts.
+
+    Parameters
+    ----------
+    name : str
+        Name of the signal used in scripts, e.g. ``"ION Power"``.
+    pv : str
+        Read PV.
+    kind : str
+        ``"ro"`` (``EpicsSignalRO``, inputs) or ``"rw"`` (``EpicsSignal``, outputs).
+    write_pv : str or None
+        Write PV of ``"rw"`` signals if it is different from the read PV.
+    device_name : str or None
+        Name of the device in the shared context, generated from the signal name if ``None``.
+    """
+
+    __slots__ = ("name", "pv", "kind", "write_pv", "device_name")
+
+    def __init__(self, name, pv, kind="ro", write_pv=None, device_name=None):
+        kind = kind.lower()
+        if kind not in SIGNAL_KINDS:
+            raise ValueError(f"Unsupported kind of signal {name!r}: {kind!r}")
+        self.name = name
+        self.pv = pv
+        self.kind = kind
+        self.write_pv = write_pv or None
+        self.device_name = device_name or _device_name_pattern.sub("_", name.strip().lower()).strip("_")
+
+    def create(self):
+        """
+        Create the signal. The connection is started in the background (see ``connect_signals``).
+        """
+        from ophyd import EpicsSignal, EpicsSignalRO
+
+        if self.kind == "rw":
+            return EpicsSignal(self.pv, write_pv=self.write_pv, name=self.device_name, auto_monitor=True)
+        return EpicsSignalRO(self.pv, name=self.device_name, auto_monitor=True)
+
+    def __repr__(self):
+        return (
+            f"SignalSpec({self.name!r}, {self.pv!r}, kind={self.kind!r}, write_pv={self.write_pv!r}, "
+            f"device_name={self.device_name!r})"
+        )
+
+
+class SignalRegistry:
+    """
+    Registry of the signals referenced by scripts. The registry maps the names used
+    in scripts to PVs and kinds of signals and creates the signals on demand.
+
+    Parameters
+    ----------
+    specs : iterable(SignalSpec)
+        Signals of the registry.
+    """
+
+    def __init__(self, specs=()):
+        self.specs = {}
+        for spec in specs:
+            self.add(spec)
+
+    def add(self, spec):
+        if spec.name in self.specs:
+            raise ValueError(f"Signal {spec.name!r} is defined more than once")
+        self.specs[spec.name] = spec
+
+    def __contains__(self, name):
+        return name in self.specs
+
+    def __len__(self):
+        return len(self.specs)
+
+    @property
+    def device_mapping(self):
+        """
+        Dictionary: signal name -> device name (see ``create_shared_context``).
+        """
+        return {name: spec.device_name for name, spec in self.specs.items()}
+
+    def get_by_device_name(self, device_name):
+        return next((_ for _ in self.specs.values() if _.device_name == device_name), None)
+
+    @classmethod
+    def from_file(cls, path):
+        """
+        Load the registry from the YAML or CSV file.
+
+        The YAML file maps the signal names to PVs or to dictionaries with
+        ``pv``, ``kind``, ``write_pv`` and ``device`` keys::
+
+            ION Power: {pv: "XF:31ID-ION{PS:1}Pwr-I", kind: rw, write_pv: "XF:31ID-ION{PS:1}Pwr-SP"}
+            Chamber Pressure: "XF:31ID-VA{Gauge:1}P-I"
+
+        The CSV file has the header ``name,pv,kind,write_pv,device`` (all columns
+        except ``name`` and ``pv`` are optional).
+        """
+        if os.path.splitext(path)[1].lower() == ".csv":
+            with open(path, "rt", newline="") as f:
+                rows = [_ for _ in csv.DictReader(f) if _.get("name")]
+            specs = [
+                SignalSpec(
+                    row["name"].strip(), row["pv"].strip(), (row.get("kind") or "ro").strip(),
+                    (row.get("write_pv") or "").strip(), (row.get("device") or "").strip()
+                )
+                for row in rows
+            ]
+        else:
+            import yaml
+
+            with open(path, "rt") as f:
+                config = yaml.safe_load(f) or {}
+            specs = []
+            for name, value in config.items():
+                if isinstance(value, dict):
+                    specs.append(
+                        SignalSpec(
+                            str(name), value["pv"], value.get("kind", "ro"), value.get("write_pv"), value.get("device")
+                        )
+                    )
+                else:
+                    specs.append(SignalSpec(str(name), str(value)))
+        return cls(specs)
+
+    def create_signals(self, names):
+        """
+        Create the signals of the registry referenced by the names (unknown names are ignored).
+
+        Returns
+        -------
+        dict
+            Device name -> signal.
+        """
+        specs = [self.specs[_] for _ in dict.fromkeys(names) if _ in self.specs]
+        return {spec.device_name: spec.create() for spec in specs}
+
+
+def connect_signals(signals, timeout=10.0):
+    """
+    Wait for the connection of the signals (or other ophyd objects). The connections are
+    made concurrently, so the total wait time is limited by the single timeout.
+
+    Parameters
+    ----------
+    signals : iterable
+        Signals with the started connections (the objects are connected in the background
+        once they are created).
+    timeout : float
+        Overall timeout (seconds).
+
+    Raises
+    ------
+    TimeoutError
+        If any of the signals is not connected. All unconnected signals are listed.
+    """
+    deadline = time.monotonic() + timeout
+    failed = []
+    for signal in signals:
+        try:
+            signal.wait_for_connection(timeout=max(deadline - time.monotonic(), 0.001))
+        except TimeoutError:
+            failed.append(signal.name)
+    if failed:
+        raise TimeoutError(f"Signals not connected after {timeout} s: {', '.join(failed)}")
+
+
+def find_script_signals(script_path, cache_path=None, scripts_root=None):
+    """
+    Pre-scan the script and the sub-scripts it runs for the names of the referenced signals.
+
+    Parameters
+    ----------
+    script_path : str
+        Path to the script.
+    cache_path : str or None
+        Path to the cache of the validator (see ``ScriptValidator``).
+    scripts_root : str or None
+        Root of the scripts tree (see ``ScriptValidator``).
+
+    Returns
+    -------
+    list(str)
+        Names of the signals in the order of the first reference.
+    """
+    from megatron.validator import ScriptValidator
+
+    validator = ScriptValidator(cache_path=cache_path, scripts_root=scripts_root)
+    validator.validate([script_path])
+    return list(validator.referenced_devices)
+
+
+class LazyDevices:
+    """
+    Namespace of the devices (see ``create_shared_context``) that creates the signals of
+    the registry when they are accessed for the first time, e.g. signals of the
+    sub-scripts run by 'failif' that were not found by the pre-scan.
+
+    Parameters
+    ----------
+    devices : dict
+        Device name -> device created in advance.
+    registry : SignalRegistry
+        Registry of the signals created on demand.
+    timeout : float
+        Connection timeout of the signals created on demand.
+    """
+
+    def __init__(self, devices, registry, timeout=10.0):
+        self.__dict__.update(devices)
+        self._registry = registry
+        self._timeout = timeout
+
+    def __getattr__(self, device_name):
+        # Called only for the devices that were not created yet
+        spec = self._registry.get_by_device_name(device_name) if not device_name.startswith("_") else None
+        if spec is None:
+            raise AttributeError(f"Device {device_name!r} not found")
+        signal = spec.create()
+        connect_signals([signal], self._timeout)
+        setattr(self, device_name, signal)
+        return signal
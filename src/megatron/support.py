@@ -1,4 +1,7 @@
 import asyncio
+import functools
+import itertools
+import threading
 import time
 import uuid
 
@@ -7,6 +10,8 @@ import numpy as np
 from bluesky import Msg
 from ophyd import Component as Cpt
 from ophyd import DeviceStatus, EpicsMotor, EpicsSignal, EpicsSignalRO
+from ophyd.status import StatusBase
+from megatron.signal_cache import signal_cache
 
 
 class EpicsMotorGalil(EpicsMotor):
@@ -21,6 +26,132 @@ class EpicsMotorGalil(EpicsMotor):
         return st
 
 
+def _make_comparator(operator, target, tolerance=0):
+    """
+    Returns the function that accepts the value and checks if the condition is satisfied.
+
+    Parameters
+    ----------
+    operator : str
+        One of "<", "<=", ">", ">=", "=", "==", "!="
+    target : float
+        Target value
+    tolerance : float, optional
+        Tolerance for "==" and "!=" operators.
+    """
+    tolerance = max(tolerance or 0, 0)
+    if operator == "<":
+        return lambda value: value < target
+    elif operator == "<=":
+        return lambda value: value <= target
+    elif operator == ">":
+        return lambda value: value > target
+    elif operator == ">=":
+        return lambda value: value >= target
+    elif operator in ("=", "=="):
+        low, high = target - tolerance, target + tolerance
+        return lambda value: low <= value <= high
+    elif operator == "!=":
+        low, high = target - tolerance, target + tolerance
+        return lambda value: value <= low or value >= high
+    else:
+        raise RuntimeError(f"Invalid operator: {operator!r}")
+
+
+class _SignalConditions:
+    """
+    Pending conditions of a single signal. The conditions are evaluated in one pass
+    on each update received by the signal cache.
+    """
+
+    def __init__(self, signal):
+        self.signal = signal
+        self.lock = threading.Lock()
+        self.conditions = {}  # key -> (is_met, callback)
+        self.pending = ()  # Snapshot of 'conditions' values, iterated without the lock
+        signal_cache.add_listener(signal, self._on_update)
+
+    def _on_update(self, value):
+        for is_met, callback in self.pending:
+            callback(is_met(value), value)
+
+    def add(self, key, is_met, callback):
+        with self.lock:
+            self.conditions[key] = (is_met, callback)
+            self.pending = tuple(self.conditions.values())
+
+    def remove(self, key):
+        with self.lock:
+            if self.conditions.pop(key, None) is not None:
+                self.pending = tuple(self.conditions.values())
+
+    def clear(self):
+        signal_cache.remove_listener(self.signal, self._on_update)
+
+
+class _ConditionEngine:
+    """
+    Evaluates conditions on signal values. The values are received from the signal
+    cache (see ``SignalSnapshotCache``), so each signal is subscribed once and waiting
+    for a condition does not add or remove subscriptions.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._signals = {}
+        self._keys = itertools.count()
+
+    def _get_signal_conditions(self, signal):
+        with self._lock:
+            signal_conditions = self._signals.get(signal)
+            if signal_conditions is None:
+                signal_conditions = _SignalConditions(signal)
+                self._signals[signal] = signal_conditions
+            return signal_conditions
+
+    def add(self, signal, is_met, callback):
+        """
+        Add the condition. The callback is called with the result of ``is_met`` and
+        the new value on each update of the signal, starting with the current value.
+        The callback is called from the thread that processes the signal updates.
+
+        Returns
+        -------
+        key
+            Key used to remove the condition.
+        """
+        key = next(self._keys)
+        signal_conditions = self._get_signal_conditions(signal)
+        signal_conditions.add(key, is_met, callback)
+        value, timestamp, _ = signal_cache.get_snapshot(signal)
+        if timestamp is not None:
+            callback(is_met(value), value)
+        return key
+
+    def remove(self, signal, key):
+        signal_conditions = self._signals.get(signal)
+        if signal_conditions is not None:
+            signal_conditions.remove(key)
+
+    def get_value(self, signal, default=None):
+        """
+        Returns the last value received from the signal or ``default``.
+        """
+        return signal_cache.get(signal, default)
+
+    def clear(self):
+        """
+        Remove all pending conditions. Pending conditions are not evaluated anymore.
+        """
+        with self._lock:
+            for signal_conditions in self._signals.values():
+                signal_conditions.clear()
+            self._signals.clear()
+
+
+_condition_engine = _ConditionEngine()
+
+
 class _ConditionStatus(DeviceStatus):
     """
     Status object that waits for a variable to reach specified target value.
@@ -52,7 +183,9 @@ class _ConditionStatus(DeviceStatus):
         self.pos = signal
         self.target = target
         self.start_ts = start_ts
-        self.start_pos = self.pos.position if hasattr(self.pos, "position") else self.pos.value
+        self.start_pos = _condition_engine.get_value(signal, None)
+        if self.start_pos is None:
+            self.start_pos = self.pos.position if hasattr(self.pos, "position") else self.pos.value
         self.finish_ts = None
         self.finish_pos = None
 
@@ -63,46 +196,26 @@ class _ConditionStatus(DeviceStatus):
         # call the base class
         super().__init__(signal, **kwargs)
 
-        def cb(*args, obj=None, sub_type=None, **kwargs):
-            # timestamp = kwargs.get("timestamp")
-            value = kwargs.get("value")
-
-            success = False
-            if operator == "<":
-                if value < target:
-                    success = True
-            elif operator == "<=":
-                if value <= target:
-                    success = True
-            elif operator == ">":
-                if value > target:
-                    success = True
-            elif operator == ">=":
-                if value >= target:
-                    success = True
-            elif operator in ("=", "=="):
-                if target - tolerance <= value <= target + tolerance:
-                    success = True
-            elif operator == "!=":
-                if value <= target - tolerance or value >= target + tolerance:
-                    success = True
-            else:
-                raise RuntimeError(f"Invalid operator: {operator!r}")
-
-            if success:
-                signal.clear_sub(cb)
-                self.set_finished()
-
-        if hasattr(signal, "SUB_READBACK"):
-            event_type = signal.SUB_READBACK
-        else:
-            event_type = signal.SUB_VALUE
-        signal.subscribe(cb, event_type=event_type)
-
+        self._lock = threading.Lock()
+        self._completed = False
+        self._condition_key = None
+        key = _condition_engine.add(signal, _make_comparator(operator, target, tolerance), self._on_update)
+        with self._lock:
+            self._condition_key = key
+            completed = self._completed
+        if completed:
+            _condition_engine.remove(signal, key)
+
+    def _on_update(self, is_met, value):
+        with self._lock:
+            if self._completed:
+                return
+            self._completed = is_met
         # Notify watchers (things like progress bars) of new values
         # at the device's natural update rate.
-        if not self.done:
-            self.pos.subscribe(self._notify_watchers, event_type=event_type)
+        self._notify_watchers(value)
+        if is_met:
+            self.set_finished()
 
     def watch(self, func):
         """
@@ -182,10 +295,13 @@ class _ConditionStatus(DeviceStatus):
     def _settled(self):
         """Hook for when motion has completed and settled"""
         super()._settled()
-        self.pos.clear_sub(self._notify_watchers)
+        with self._lock:
+            key = self._condition_key
+        if key is not None:
+            _condition_engine.remove(self.pos, key)
         self._watchers.clear()
         self.finish_ts = time.time()
-        self.finish_pos = self.pos.position if hasattr(self.pos, "position") else self.pos.value
+        self.finish_pos = _condition_engine.get_value(self.pos, None)
 
     @property
     def elapsed(self):
@@ -206,6 +322,84 @@ class _ConditionStatus(DeviceStatus):
     __repr__ = __str__
 
 
+class _ConditionGroupStatus(StatusBase):
+    """
+    Status object that waits for a group of conditions. The status succeeds when all
+    conditions are met and fails if a condition is not met before its timeout expires.
+
+    Parameters
+    ----------
+    conditions : list(dict)
+        Conditions with the keys ``signal``, ``target``, ``operator`` and optional
+        ``tolerance`` and ``timeout``. See ``_ConditionStatus`` for details.
+    simultaneous : bool, optional
+        If ``False`` (default), each condition is considered satisfied once it was met,
+        which is equivalent to waiting for the conditions one by one. If ``True``,
+        all conditions must be met at the same time.
+    """
+
+    def __init__(self, conditions, *, simultaneous=False, **kwargs):
+        super().__init__(**kwargs)
+        self._simultaneous = simultaneous
+        self._lock = threading.Lock()
+        self._completed = False
+        self._met = [False] * len(conditions)
+        self._keys = []
+        self._timers = []
+
+        if not conditions:
+            self.set_finished()
+            return
+
+        for n, condition in enumerate(conditions):
+            timeout = condition.get("timeout", None)
+            if timeout is not None:
+                timer = threading.Timer(timeout, self._timeout_expired, args=(n, condition["signal"].name, timeout))
+                timer.daemon = True
+                self._timers.append(timer)
+
+        # Conditions are evaluated with the current values when added,
+        # so the status may complete before all conditions are added.
+        for n, condition in enumerate(conditions):
+            if self._completed:
+                break
+            signal = condition["signal"]
+            is_met = _make_comparator(condition["operator"], condition["target"], condition.get("tolerance", 0))
+            key = _condition_engine.add(signal, is_met, functools.partial(self._update, n))
+            self._keys.append((signal, key))
+        if self._completed:
+            self._cleanup()
+            return
+        for timer in self._timers:
+            timer.start()
+
+    def _update(self, n, is_met, value=None):
+        with self._lock:
+            if self._completed:
+                return
+            if is_met or self._simultaneous:
+                self._met[n] = is_met
+            if not all(self._met):
+                return
+            self._completed = True
+        self._cleanup()
+        self.set_finished()
+
+    def _timeout_expired(self, n, name, timeout):
+        with self._lock:
+            if self._completed or self._met[n]:
+                return
+            self._completed = True
+        self._cleanup()
+        self.set_exception(TimeoutError(f"Condition for {name!r} was not met in {timeout} s"))
+
+    def _cleanup(self):
+        for signal, key in self._keys:
+            _condition_engine.remove(signal, key)
+        for timer in self._timers:
+            timer.cancel()
+
+
 def gen_set_condition(re):
 
     async def _inner(msg):
@@ -237,14 +431,50 @@ def gen_set_condition(re):
     return _inner
 
 
+def gen_set_conditions(re):
+
+    async def _inner(msg):
+        conditions = msg.kwargs["conditions"]
+        simultaneous = msg.kwargs.get("simultaneous", False)
+        group = msg.kwargs["group"]
+
+        pardon_failures = re._pardon_failures
+        p_event = asyncio.Event(**re._loop_for_kwargs)
+        ret = _ConditionGroupStatus(conditions, simultaneous=simultaneous)
+
+        def done_callback(status=None):
+            re._loop.call_soon_threadsafe(re._status_object_completed, ret, p_event, pardon_failures)
+
+        ret.add_callback(done_callback)
+
+        re._groups[group].add(p_event.wait)
+        re._status_objs[group].add(ret)
+
+        return (ret,)
+
+    return _inner
+
+
 def register_custom_instructions(re):
     _set_condition = gen_set_condition(re=re)
     re.register_command("set_condition", _set_condition)
+    _set_conditions = gen_set_conditions(re=re)
+    re.register_command("set_conditions", _set_conditions)
 
 
 def wait_for_condition(signal, target, operator, tolerance=0, timeout=None):
     group = str(uuid.uuid4())
-    yield Msg("set_condition", signal=signal, target=target, operator=operator, group=group)
+    yield Msg("set_condition", signal=signal, target=target, operator=operator, tolerance=tolerance, group=group)
+    yield Msg("wait", None, group=group, timeout=timeout)
+
+
+def wait_for_conditions(conditions, simultaneous=False, timeout=None):
+    """
+    Wait for a group of conditions using a single RunEngine wait. See ``_ConditionGroupStatus``
+    for the description of the parameters. ``timeout`` is the timeout for the whole group.
+    """
+    group = str(uuid.uuid4())
+    yield Msg("set_conditions", conditions=conditions, simultaneous=simultaneous, group=group)
     yield Msg("wait", None, group=group, timeout=timeout)
 
 
@@ -0,0 +1,255 @@
+"""
+Event trace of the interpreter and the command handlers.
+
+The modules of the package report the executed commands through the standard ``logging``
+loggers under the ``megatron`` namespace (e.g. ``megatron.motor_control``): INFO for the
+executed commands and loop iterations, DEBUG for the details, WARNING and ERROR for the
+problems. ``start_trace`` attaches a queue handler to the ``megatron`` logger, so the
+caller only creates the record and puts it in the queue; the records are formatted
+and written by the listener thread:
+
+- to the JSONL trace file (one JSON object per record, see ``JsonlTraceHandler``),
+- to the console, at most ``console_rate`` records per second (the number of the
+  suppressed records is reported, warnings and errors are never suppressed).
+
+In the quiet mode only the warnings and errors are emitted, the other records are
+rejected by the level check of the logger before they are created.
+"""
+
+import os
+import sys
+import json
+import time
+import queue
+import logging
+import logging.handlers
+
+LOGGER_NAME = "megatron"
+
+
+class _TraceQueueHandler(logging.handlers.QueueHandler):
+    """
+    Queue handler that passes the records unformatted: the message is formatted
+    by the listener thread instead of the thread executing the script.
+    """
+
+    def prepare(self, record):
+        if record.exc_info:
+            # The traceback can not be formatted later, the frames may be gone
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class _BatchingQueueListener(logging.handlers.QueueListener):
+    """
+    Queue listener that processes the queued records in batches every ``interval``
+    seconds instead of waking up for each record, so that the listener thread does not
+    compete for the GIL with the thread executing the script on each record.
+    """
+
+    def __init__(self, queue, *handlers, interval=0.1, respect_handler_level=False):
+        super().__init__(queue, *handlers, respect_handler_level=respect_handler_level)
+        self.interval = interval
+
+    def _monitor(self):
+        record_queue = self.queue
+        while True:
+            time.sleep(self.interval)
+            while True:
+                try:
+                    record = record_queue.get_nowait()
+                except queue.Empty:
+                    break
+                if record is self._sentinel:
+                    return
+                self.handle(record)
+
+
+def _json_default(value):
+    return repr(value)
+
+
+class JsonlTraceHandler(logging.Handler):
+    """
+    Write the records to the file as JSON lines::
+
+        {"t": 1700000000.123456, "level": "INFO", "source": "motor_control", "event": "ac",
+         "msg": "Setting acceleration to 1000.0", "args": [1000.0]}
+
+    ``event`` is the name of the function that emitted the record (the command handler),
+    ``args`` are the arguments of the message.
+
+    Parameters
+    ----------
+    path : str
+        Path to the trace file (appended).
+    flush_interval : float
+        Maximum time (seconds) between the writes to the file.
+    """
+
+    def __init__(self, path, flush_interval=1.0):
+        super().__init__()
+        self.path = path
+        self.flush_interval = flush_interval
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._file = open(path, "at", encoding="utf-8", buffering=1 << 16)
+        self._last_flush = time.monotonic()
+
+    def emit(self, record):
+        try:
+            source = record.name[len(LOGGER_NAME) + 1:] if record.name.startswith(LOGGER_NAME + ".") else record.name
+            entry = {
+                "t": round(record.created, 6),
+                "level": record.levelname,
+                "source": source,
+                "event": record.funcName,
+                "msg": record.getMessage(),
+            }
+            if record.args:
+                entry["args"] = record.args if isinstance(record.args, tuple) else [record.args]
+            if record.exc_text:
+                entry["exc"] = record.exc_text
+            self._file.write(json.dumps(entry, default=_json_default, separators=(",", ":")) + "\n")
+            now = time.monotonic()
+            if now - self._last_flush >= self.flush_interval:
+                self._file.flush()
+                self._last_flush = now
+        except Exception:
+            self.handleError(record)
+
+    def flush(self):
+        if not self._file.closed:
+            self._file.flush()
+
+    def close(self):
+        try:
+            self._file.close()
+        finally:
+            super().close()
+
+
+class RateLimitedConsoleHandler(logging.StreamHandler):
+    """
+    Console handler that emits at most ``rate`` records per second (with the bursts of
+    up to ``rate`` records). The records above the rate are counted and their number
+    is reported with the next emitted record. Records at ``always_level`` or above are
+    always emitted.
+
+    Parameters
+    ----------
+    stream : file or None
+        Output stream, ``sys.stderr`` by default.
+    rate : float
+        Maximum number of records per second.
+    always_level : int
+        Level of the records that are never suppressed.
+    """
+
+    def __init__(self, stream=None, rate=20.0, always_level=logging.WARNING):
+        super().__init__(stream)
+        self.rate = rate
+        self.always_level = always_level
+        self.suppressed = 0
+        self._tokens = rate
+        self._last_time = time.monotonic()
+
+    def emit(self, record):
+        now = time.monotonic()
+        self._tokens = min(self.rate, self._tokens + (now - self._last_time) * self.rate)
+        self._last_time = now
+        if record.levelno < self.always_level:
+            if self._tokens < 1:
+                self.suppressed += 1
+                return
+            self._tokens -= 1
+        self.report_suppressed()
+        super().emit(record)
+
+    def report_suppressed(self):
+        if self.suppressed:
+            self.stream.write(f"... {self.suppressed} messages suppressed{self.terminator}")
+            self.suppressed = 0
+
+
+class TraceSession:
+    """
+    Queue handler and listener attached to the ``megatron`` logger by ``start_trace``.
+    Call ``stop`` (or use as the context manager) to write the remaining records
+    and detach the handlers.
+    """
+
+    def __init__(self, logger, queue_handler, listener, handlers, previous_state):
+        self.logger = logger
+        self.queue_handler = queue_handler
+        self.listener = listener
+        self.handlers = handlers
+        self._previous_state = previous_state
+
+    def stop(self):
+        if self.listener is None:
+            return
+        self.listener.stop()  # Processes the records remaining in the queue
+        self.listener = None
+        self.logger.removeHandler(self.queue_handler)
+        self.logger.setLevel(self._previous_state[0])
+        self.logger.propagate = self._previous_state[1]
+        for handler in self.handlers:
+            if isinstance(handler, RateLimitedConsoleHandler):
+                handler.report_suppressed()
+            handler.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def start_trace(trace_path=None, *, quiet=False, verbose=False, console_rate=20.0, stream=None):
+    """
+    Start writing the event trace of the package (see the module documentation).
+
+    Parameters
+    ----------
+    trace_path : str or None
+        Path to the JSONL trace file. The file receives the records at the DEBUG level
+        if ``verbose``, otherwise the INFO level.
+    quiet : bool
+        Emit only the warnings and errors (to the console and the trace file).
+    verbose : bool
+        Emit also the DEBUG records.
+    console_rate : float
+        Maximum number of the INFO/DEBUG records printed per second, 0 disables them.
+    stream : file or None
+        Console stream, ``sys.stdout`` by default.
+
+    Returns
+    -------
+    TraceSession
+    """
+    level = logging.WARNING if quiet else logging.DEBUG if verbose else logging.INFO
+    handlers = []
+    if trace_path:
+        trace_handler = JsonlTraceHandler(trace_path)
+        trace_handler.setLevel(level)
+        handlers.append(trace_handler)
+    console_handler = RateLimitedConsoleHandler(stream or sys.stdout, rate=console_rate)
+    console_handler.setLevel(level if console_rate > 0 else logging.WARNING)
+    console_handler.setFormatter(logging.Formatter("%(message)s"))
+    handlers.append(console_handler)
+
+    record_queue = queue.SimpleQueue()
+    queue_handler = _TraceQueueHandler(record_queue)
+    listener = _BatchingQueueListener(record_queue, *handlers, respect_handler_level=True)
+
+    logger = logging.getLogger(LOGGER_NAME)
+    previous_state = (logger.level, logger.propagate)
+    # Records below the lowest handler level are not created at all
+    logger.setLevel(min(_.level for _ in handlers))
+    logger.propagate = False
+    logger.addHandler(queue_handler)
+    listener.start()
+    return TraceSession(logger, queue_handler, listener, handlers, previous_state)
@@ -0,0 +1,315 @@
+import os
+import io
+import sys
+import pickle
+import hashlib
+import logging
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from megatron.compiler import COMPILER_VERSION, OP_COMMAND, OP_ERROR, compile_lines
+from megatron.registry import registry_signature
+from megatron.script_cache import CACHE_DIR_NAME, SubScriptCache, default_scripts_root
+
+_log = logging.getLogger(__name__)
+
+# Version of the cached validation results. Must be changed each time the checks change.
+VALIDATOR_VERSION = 1
+
+CACHE_FILE_NAME = "validation.pickle"
+
+# Commands with the device name as the first argument
+_device_commands = ("setdo", "setao", "waitai", "waitdi", "failif", "failifoff")
+
+
+def _resolve_handler(command):
+    from megatron.megatron_control import megatron_command_registry
+    from megatron.motor_control import motor_command_registry
+
+    return megatron_command_registry.get(command) or motor_command_registry.get(command)
+
+
+def _registry_signature():
+    from megatron.megatron_control import megatron_command_registry
+    from megatron.motor_control import motor_command_registry
+
+    return registry_signature(megatron_command_registry, motor_command_registry)
+
+
+def compute_digest(data):
+    h = hashlib.blake2b(data, digest_size=16)
+    h.update(f"v{COMPILER_VERSION}.{VALIDATOR_VERSION}.{_registry_signature()}".encode())
+    return h.hexdigest()
+
+
+def check_script_data(data):
+    """
+    Check the single script. Only the checks that depend on the contents of the script
+    are performed, so that the result can be cached by the hash of the contents.
+
+    Parameters
+    ----------
+    data : bytes
+        Contents of the script.
+
+    Returns
+    -------
+    dict
+        ``"diagnostics"``: list of ``(line_no, severity, message)`` (unknown commands, invalid
+        arguments, unmatched 'l' and 'n'), ``"scripts"``: dictionary of the names of the scripts
+        referenced by 'run' and 'failif', ``"devices"``: dictionary of the device names.
+        The dictionaries map the names to ``(first_line_no, number_of_references)``.
+    """
+    program = compile_lines(io.StringIO(data.decode("utf-8", errors="replace")), _resolve_handler)
+    diagnostics, scripts, devices = [], {}, {}
+
+    def add_reference(references, name, line_no):
+        first_line_no, count = references.get(name, (line_no, 0))
+        references[name] = (first_line_no, count + 1)
+
+    for instruction in program:
+        opcode, command, args, line_no = instruction.opcode, instruction.command, instruction.args, instruction.line_no
+        if opcode == OP_ERROR:
+            diagnostics.append((line_no, "error", args[0]))
+            continue
+        if opcode != OP_COMMAND:
+            continue
+        if command == "run":
+            add_reference(scripts, args[0], line_no)
+        elif command == "failif":
+            add_reference(scripts, args[2], line_no)
+
+        if command in _device_commands:
+            names = args[:1]
+        elif command == "log":
+            names = [_ for _ in args if "=" not in _]
+        elif command == "plot":
+            names = [_ for _ in args if not _.startswith("+") and not _.isdigit()]
+        elif command == "lograte" and len(args) > 1:
+            names = args[:1]
+        else:
+            continue
+        for name in names:
+            add_reference(devices, name, line_no)
+    return {"diagnostics": diagnostics, "scripts": scripts, "devices": devices}
+
+
+def _check_file(script_path):
+    """
+    Worker function: returns ``(script_path, stat_key, digest, result)``.
+    """
+    st = os.stat(script_path)
+    with open(script_path, "rb") as f:
+        data = f.read()
+    return script_path, (st.st_mtime_ns, st.st_size), compute_digest(data), check_script_data(data)
+
+
+class ScriptValidator:
+    """
+    Validator of scripts. Each script is checked for unknown commands, invalid arguments
+    and unmatched loops, sub-scripts referenced by 'run' and 'failif' are resolved (and
+    validated) and the device names are checked against the device mapping. The results
+    of the per-file checks are cached by the hash of the file contents and the files
+    that are not cached are checked in parallel by a pool of processes.
+
+    Parameters
+    ----------
+    device_mapping : dict or None
+        Device mapping (see ``create_shared_context``). Device names are not checked if ``None``.
+    cache_path : str or None
+        Path to the cache file. Results are not cached if ``None``.
+    max_workers : int or None
+        Number of worker processes, the number of CPUs if ``None``. The files are checked
+        in the current process if ``max_workers`` is 1 or there are few files to check.
+    scripts_root : str or None
+        Root of the scripts tree, the sub-scripts are not searched above it. The current
+        directory if it contains the script, otherwise the directory of the script if ``None``.
+    """
+
+    def __init__(self, device_mapping=None, cache_path=None, max_workers=None, scripts_root=None):
+        self.device_mapping = device_mapping
+        self.scripts_root = os.path.abspath(os.path.expanduser(scripts_root)) if scripts_root else None
+        self.cache_path = cache_path
+        self.max_workers = max_workers
+        self.resolver = SubScriptCache(None)
+        self.checked_files = 0
+        self.cached_files = 0
+        self.referenced_devices = {}  # Device name -> (script path, line number) of the first reference
+        self._cache = self._load_cache()
+
+    def _load_cache(self):
+        if not self.cache_path:
+            return {}
+        try:
+            with open(self.cache_path, "rb") as f:
+                return pickle.load(f)
+        except FileNotFoundError:
+            return {}
+        except Exception as ex:
+            _log.warning("Failed to load validation cache %r: %s", self.cache_path, ex)
+            return {}
+
+    def _save_cache(self):
+        if not self.cache_path:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.cache_path), exist_ok=True)
+            tmp_path = f"{self.cache_path}.{os.getpid()}.tmp"
+            with open(tmp_path, "wb") as f:
+                pickle.dump(self._cache, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, self.cache_path)
+        except OSError as ex:
+            _log.warning("Failed to save validation cache %r: %s", self.cache_path, ex)
+
+    def _get_cached(self, script_path):
+        cached = self._cache.get(script_path)
+        if cached is None:
+            return None
+        stat_key, digest, result = cached
+        st = os.stat(script_path)
+        if stat_key == (st.st_mtime_ns, st.st_size):
+            return result
+        # The file was touched, but the contents may be the same
+        with open(script_path, "rb") as f:
+            if compute_digest(f.read()) != digest:
+                return None
+        self._cache[script_path] = ((st.st_mtime_ns, st.st_size), digest, result)
+        return result
+
+    def _check_files(self, script_paths):
+        """
+        Returns the dictionary: script path -> result of ``check_script_data``.
+        """
+        results, to_check = {}, []
+        for script_path in script_paths:
+            result = self._get_cached(script_path)
+            if result is None:
+                to_check.append(script_path)
+            else:
+                results[script_path] = result
+                self.cached_files += 1
+
+        if len(to_check) > 4 and self.max_workers != 1:
+            with ProcessPoolExecutor(max_workers=self.max_workers) as executor:
+                checked = list(executor.map(_check_file, to_check, chunksize=8))
+        else:
+            checked = [_check_file(_) for _ in to_check]
+        for script_path, stat_key, digest, result in checked:
+            self._cache[script_path] = (stat_key, digest, result)
+            results[script_path] = result
+        self.checked_files += len(checked)
+        return results
+
+    def validate(self, paths):
+        """
+        Validate the scripts and all sub-scripts they reference. Directories are searched
+        for scripts ('*.txt') recursively.
+
+        Returns
+        -------
+        list(tuple)
+            Sorted diagnostics ``(script_path, line_no, severity, message)``.
+        """
+        pending = []
+        for path in paths:
+            path = os.path.abspath(os.path.expanduser(path))
+            if os.path.isdir(path):
+                for dir_path, dir_names, file_names in os.walk(path):
+                    dir_names[:] = [_ for _ in dir_names if _ != CACHE_DIR_NAME]
+                    pending.extend([os.path.join(dir_path, _) for _ in file_names if _.lower().endswith(".txt")])
+            else:
+                pending.append(path)
+
+        diagnostics = []
+        validated = set()
+        while pending:
+            script_paths = []
+            for script_path in pending:
+                if script_path in validated:
+                    continue
+                validated.add(script_path)
+                if os.path.isfile(script_path):
+                    script_paths.append(script_path)
+                else:
+                    diagnostics.append((script_path, 0, "error", "Script not found"))
+            pending = []
+
+            for script_path, result in self._check_files(script_paths).items():
+                diagnostics.extend([(script_path, *_) for _ in result["diagnostics"]])
+                pending.extend(self._check_references(script_path, result, diagnostics))
+
+        self._save_cache()
+        return sorted(diagnostics)
+
+    def _check_references(self, script_path, result, diagnostics):
+        """
+        Check the sub-scripts and devices referenced by the script. Returns the paths
+        of the referenced sub-scripts.
+        """
+        script_dir = os.path.dirname(script_path)
+        sub_scripts = []
+        for script_name, (line_no, count) in result["scripts"].items():
+            scripts_root = self.scripts_root or default_scripts_root(script_dir)
+            sub_script_path = self.resolver.resolve(script_name, script_dir, scripts_root)
+            if os.path.isfile(sub_script_path):
+                sub_scripts.append(sub_script_path)
+            else:
+                diagnostics.append(
+                    (script_path, line_no, "error", f"Sub-script {script_name!r} not found{_format_count(count)}")
+                )
+
+        for device_name, (line_no, _) in result["devices"].items():
+            self.referenced_devices.setdefault(device_name, (script_path, line_no))
+        if self.device_mapping is not None:
+            for device_name, (line_no, count) in result["devices"].items():
+                if device_name not in self.device_mapping:
+                    diagnostics.append(
+                        (script_path, line_no, "warning", f"Device {device_name!r} is not mapped{_format_count(count)}")
+                    )
+        return sub_scripts
+
+
+def _format_count(count):
+    return f" ({count} references)" if count > 1 else ""
+
+
+def main(argv=None, prog=None):
+    """
+    Command line interface of the validator, returns the exit status.
+    """
+    parser = argparse.ArgumentParser(
+        prog=prog, description="Validate Megatron scripts and the sub-scripts they run."
+    )
+    parser.add_argument("paths", type=str, nargs="+", help="Scripts or directories with scripts.")
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="Number of worker processes.")
+    parser.add_argument("--ignore-devices", action="store_true", help="Do not check the device names.")
+    parser.add_argument("--signals", type=str, default=None, help="Signal registry (YAML or CSV file).")
+    parser.add_argument(
+        "--cache", type=str, default=None,
+        help=f"Path to the cache file, '{CACHE_DIR_NAME}/{CACHE_FILE_NAME}' in the current directory by default."
+    )
+    parser.add_argument("--no-cache", action="store_true", help="Do not use the cache.")
+    args = parser.parse_args(argv)
+
+    from megatron.context import _device_mapping
+    from megatron.signal_registry import SignalRegistry
+
+    device_mapping = dict(_device_mapping)
+    if args.signals:
+        device_mapping.update(SignalRegistry.from_file(args.signals).device_mapping)
+    cache_path = None if args.no_cache else (args.cache or os.path.join(CACHE_DIR_NAME, CACHE_FILE_NAME))
+    validator = ScriptValidator(
+        device_mapping=None if args.ignore_devices else device_mapping, cache_path=cache_path, max_workers=args.jobs
+    )
+    diagnostics = validator.validate(args.paths)
+    for script_path, line_no, severity, message in diagnostics:
+        print(f"{script_path}:{line_no}: {severity}: {message}")
+    n_errors = sum([_[2] == "error" for _ in diagnostics])
+    print(
+        f"{n_errors} errors, {len(diagnostics) - n_errors} warnings "
+        f"({validator.checked_files} files checked, {validator.cached_files} cached)"
+    )
+    return 1 if n_errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
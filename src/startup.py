@@ -26,12 +26,25 @@ from ophyd import EpicsSignal, EpicsSignalRO
 from megatron.context import create_shared_context
 from megatron.interpreter import MegatronInterpreter
 from megatron.logger import ts_periodic_logging_decorator
+from megatron.script_cache import CACHE_DIR_NAME
+from megatron.signal_registry import SignalRegistry, connect_signals, find_script_signals
+from megatron.validator import CACHE_FILE_NAME
 from megatron.support import register_custom_instructions, EpicsMotorGalil
+from megatron.trace import start_trace
 
 parser = argparse.ArgumentParser(description="Run a Megatron script.")
 parser.add_argument(
     "-p", "--path", type=str, help="The path to the Megatron script to execute."
 )
+parser.add_argument(
+    "-s", "--signals", type=str, default="signals.yaml", help="Signal registry (YAML or CSV file)."
+)
+parser.add_argument(
+    "--timeout", type=float, default=10.0, help="Connection timeout of all signals (seconds)."
+)
+parser.add_argument(
+    "-q", "--quiet", action="store_true", help="Report only the warnings and errors."
+)
 args = parser.parse_args()
 
 prefix = "Test{DMC:1}A"
@@ -45,27 +58,35 @@ galil_rbv = EpicsSignalRO(f'{prefix}.RBV', name='galil_rbv', auto_monitor=True)
 # galil_val = EpicsSignal('sim:mtr1.VAL', name='galil_val', auto_monitor=True)
 # galil_rbv = EpicsSignalRO('sim:mtr1.RBV', name='galil_rbv', auto_monitor=True)
 
-galil.wait_for_connection()
-galil_val.wait_for_connection()
-galil_rbv.wait_for_connection()
+script_path = args.path if args.path else "scripts/run1.txt"
 
+# Only the signals referenced by the script (and its sub-scripts) are created,
+# all signals are connected concurrently
+registry = SignalRegistry.from_file(args.signals) if os.path.isfile(args.signals) else SignalRegistry()
 devices = {"galil": galil, "galil_val": galil_val, "galil_rbv": galil_rbv}
+signal_names = find_script_signals(script_path, cache_path=os.path.join(CACHE_DIR_NAME, CACHE_FILE_NAME))
+devices.update(registry.create_signals(signal_names))
+connect_signals(devices.values(), timeout=args.timeout)
 
 RE = RunEngine({})
 RE.waiting_hook = ProgressBarManager()
 
 register_custom_instructions(re=RE)
 
-context = create_shared_context(devices)
+context = create_shared_context(devices, registry)
 interpreter = MegatronInterpreter(shared_context=context)
 
-script_path = args.path if args.path else "scripts/run1.txt"
 logging_dir = "./logs"
 log_file_name = datetime.now().strftime("%Y%m%d_%H%M%S") + ".csv"
 log_file_path = os.path.join(logging_dir, log_file_name)
 
+# Messages of the commands are printed (at most 20 per second) and written to the trace
+trace = start_trace(os.path.splitext(log_file_path)[0] + ".trace.jsonl", quiet=args.quiet)
+
 @bp.reset_positions_decorator([galil.velocity])
-@ts_periodic_logging_decorator(signals=context.logged_signals, log_file_path=log_file_path, period=1)
+@ts_periodic_logging_decorator(
+    signals=context.logged_signals, log_file_path=log_file_path, log_settings=context.log_settings
+)
 def run_with_logging(script_path):
     yield from interpreter.execute_script(script_path)
 
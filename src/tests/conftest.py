@@ -0,0 +1,106 @@
+"""
+Fixtures of the tests. The scripts are executed by a real RunEngine against ``ophyd.sim``
+devices (see ``benchmarks.bench_suite``): 'sleep' messages advance a virtual clock and
+the wait conditions are met immediately.
+
+Run from the ``src`` directory::
+
+    python -m pytest tests
+"""
+
+import pytest
+from bluesky.run_engine import RunEngine
+from ophyd import Signal
+
+from benchmarks.bench_suite import _SimGalil, _VirtualClock, _condition_met
+from megatron.context import create_shared_context
+from megatron.interpreter import MegatronInterpreter
+from megatron.megatron_control import megatron_command_registry
+from megatron.motor_control import motor_command_registry
+
+# Names of the simulated signals that may be used by the test scripts
+SIGNAL_NAMES = ("Out A", "Out B", "Out C", "In A", "In B")
+
+# Messages that change the devices or the time, compared by the tests
+DEVICE_COMMANDS = ("set", "sleep", "set_condition", "set_conditions")
+
+
+def resolve_handler(command):
+    return megatron_command_registry.get(command) or motor_command_registry.get(command)
+
+
+def write_script(directory, name, text):
+    """
+    Write the script (``text`` is dedented line by line), returns its path.
+    """
+    path = directory / name
+    path.write_text("\n".join(_.strip() for _ in text.strip().splitlines()) + "\n")
+    return str(path)
+
+
+def create_interpreter(**options):
+    """
+    Returns the interpreter with the simulated Galil motor and the signals ``SIGNAL_NAMES``.
+    """
+    devices = {
+        "galil": _SimGalil(name="galil"),
+        "galil_val": Signal(name="galil_val", value=0),
+        "galil_rbv": Signal(name="galil_rbv", value=0),
+    }
+    device_mapping = {}
+    for n, signal_name in enumerate(SIGNAL_NAMES):
+        device_name = f"sim_signal_{n}"
+        devices[device_name] = Signal(name=device_name, value=0)
+        device_mapping[signal_name] = device_name
+    context = create_shared_context(devices)
+    context.device_mapping = {**context.device_mapping, **device_mapping}
+    return MegatronInterpreter(shared_context=context, use_cache=False, **options)
+
+
+def limit_messages(plan, max_messages):
+    """
+    Pass through at most ``max_messages`` messages of the plan, then close it (interrupted run).
+    """
+    response = None
+    for _ in range(max_messages):
+        try:
+            msg = plan.send(response)
+        except StopIteration:
+            return
+        response = yield msg
+    plan.close()
+
+
+class PlanRunner:
+    """
+    Executes the plans with the RunEngine and records the device messages.
+    """
+
+    def __init__(self):
+        self.RE = RunEngine({})
+        self.RE.register_command("set_condition", _condition_met)
+        self.RE.register_command("set_conditions", _condition_met)
+        self.messages = []
+        self.clock = None
+        self.RE.msg_hook = self._msg_hook
+
+    def _msg_hook(self, msg):
+        if msg.command in DEVICE_COMMANDS:
+            args = msg.args if msg.command in ("set", "sleep") else ()
+            self.messages.append((msg.command, getattr(msg.obj, "name", None), args))
+
+    def __call__(self, plan):
+        """
+        Execute the plan, returns the list of ``(command, device name, args)`` of the device
+        messages and the total sleep time.
+        """
+        self.messages = []
+        self.clock = _VirtualClock()
+        self.RE.register_command("sleep", self.clock.sleep)
+        self.RE(plan)
+        return self.messages, self.clock.time
+
+
+@pytest.fixture(scope="session")
+def run_plan():
+    return PlanRunner()
@@ -0,0 +1,209 @@
+import os
+import json
+
+import pytest
+
+from megatron.checkpoint import SLOT_SIZE, CheckpointWriter, ScriptFrame, load_checkpoint
+from megatron.exceptions import CheckpointError
+from tests.conftest import create_interpreter, limit_messages, write_script
+
+_options = {"group_writes": True, "group_waits": True, "optimize": False}
+
+
+def _create_writer(path, context=None):
+    writer = CheckpointWriter(str(path))
+    writer.bind(context or create_interpreter().context, _options)
+    return writer
+
+
+def test_save_and_load(tmp_path):
+    script_path = write_script(tmp_path, "script.txt", "t1")
+    sub_script_path = write_script(tmp_path, "sub.txt", "t1")
+    interpreter = create_interpreter()
+    context = interpreter.context
+    context.galil_pos = 5000
+    context.galil_speed = float("nan")
+    context.plotted_signals["In A"] = (1, 2)
+
+    with _create_writer(tmp_path / "run.checkpoint", context) as writer:
+        frame = writer.push(script_path)
+        sub_frame = writer.push(sub_script_path)
+        writer.save(frame, 3, [[2, 5, 0.0]])
+        writer.save(sub_frame, 1, [[1, 2, 0.0], [3, 4, 0.0]])
+
+    checkpoint = load_checkpoint(str(tmp_path / "run.checkpoint"))
+    assert not checkpoint.completed
+    assert checkpoint.instructions == 2
+    assert checkpoint.options == _options
+    assert [_.script_path for _ in checkpoint.frames] == [script_path, sub_script_path]
+    assert [(_.ip, _.loops) for _ in checkpoint.frames] == [(3, [[2, 5]]), (1, [[1, 2], [3, 4]])]
+    assert checkpoint.context["galil_pos"] == 5000
+    assert checkpoint.context["galil_speed"] != checkpoint.context["galil_speed"]  # NaN
+    assert checkpoint.context["plotted_signals"] == {"In A": [1, 2]}
+    checkpoint.check(_options)
+
+
+def test_completed(tmp_path):
+    script_path = write_script(tmp_path, "script.txt", "t1")
+    with _create_writer(tmp_path / "run.checkpoint") as writer:
+        writer.save(writer.push(script_path), 0, [])
+        writer.write(completed=True)
+
+    checkpoint = load_checkpoint(str(tmp_path / "run.checkpoint"))
+    assert checkpoint.completed
+    with pytest.raises(CheckpointError):
+        checkpoint.check(_options)
+
+
+def test_check(tmp_path):
+    script_path = write_script(tmp_path, "script.txt", "t1")
+    with _create_writer(tmp_path / "run.checkpoint") as writer:
+        writer.save(writer.push(script_path), 0, [])
+
+    checkpoint = load_checkpoint(str(tmp_path / "run.checkpoint"))
+    with pytest.raises(CheckpointError):
+        checkpoint.check({**_options, "optimize": True})
+    write_script(tmp_path, "script.txt", "t2\nt3")
+    with pytest.raises(CheckpointError):
+        checkpoint.check(_options)
+
+
+def test_torn_slot_is_ignored(tmp_path):
+    script_path = write_script(tmp_path, "script.txt", "t1")
+    path = tmp_path / "run.checkpoint"
+    with _create_writer(path) as writer:
+        frame = writer.push(script_path)
+        writer.save(frame, 0, [])
+        writer.save(frame, 1, [])
+
+    # The last state is in the first slot (written second), tear it
+    with open(path, "r+b") as f:
+        f.seek(40)
+        f.write(b"\xff" * 8)
+    checkpoint = load_checkpoint(str(path))
+    assert checkpoint.instructions == 1
+    assert checkpoint.frames[0].ip == 0
+
+    with open(path, "r+b") as f:
+        f.seek(SLOT_SIZE + 40)
+        f.write(b"\xff" * 8)
+    with pytest.raises(CheckpointError):
+        load_checkpoint(str(path))
+
+
+def test_truncated_file(tmp_path):
+    script_path = write_script(tmp_path, "script.txt", "t1")
+    path = tmp_path / "run.checkpoint"
+    with _create_writer(path) as writer:
+        writer.save(writer.push(script_path), 0, [])
+
+    os.truncate(path, 20)
+    with pytest.raises(CheckpointError):
+        load_checkpoint(str(path))
+    with pytest.raises(CheckpointError):
+        load_checkpoint(str(tmp_path / "missing.checkpoint"))
+
+
+def test_frame_serialization():
+    frame = ScriptFrame("/scripts/a \"b\".txt", 7, [[1, 3, 0.5]], stat=[10, 20])
+    assert ScriptFrame.from_list(json.loads(frame.to_json())).to_list() == frame.to_list()
+
+
+_script = """
+    sp 2000
+    log "In A"
+    l2
+    setdo "Out A", 1
+    pa 1000
+    bg
+    run sub.txt
+    t1
+    n
+    setao "Out C", 2.5
+"""
+
+_sub_script = """
+    setdo "Out B", 1
+    l3
+    t0.5
+    setao "Out C", 0.5
+    n
+    sp 500
+    pa 0
+    bg
+"""
+
+
+def _run_with_checkpoint(script_path, checkpoint_path, run_plan, max_messages=None, resume=None):
+    """
+    Run the script (or resume the ``resume`` checkpoint) with the checkpoints, returns
+    the messages and the number of the messages sent before each saved instruction.
+    """
+    writer = CheckpointWriter(str(checkpoint_path))
+    interpreter = create_interpreter(checkpoint=writer)
+    message_counts = {}
+    save = writer.save
+
+    def counting_save(*args, **kwargs):
+        save(*args, **kwargs)
+        message_counts[writer.instructions] = len(run_plan.messages)
+
+    writer.save = counting_save
+    plan = interpreter.resume_script(resume) if resume is not None else interpreter.execute_script(script_path)
+    if max_messages is not None:
+        plan = limit_messages(plan, max_messages)
+    with writer:
+        messages, _ = run_plan(plan)
+    return messages, message_counts
+
+
+def test_resume(tmp_path, run_plan):
+    write_script(tmp_path, "sub.txt", _sub_script)
+    script_path = write_script(tmp_path, "script.txt", _script)
+    checkpoint_path = tmp_path / "run.checkpoint"
+    messages, message_counts = _run_with_checkpoint(script_path, checkpoint_path, run_plan)
+    assert load_checkpoint(str(checkpoint_path)).completed
+    assert len(messages) > 20
+
+    interrupted_in_sub_script = False
+    for max_messages in range(1, 200, 3):
+        _run_with_checkpoint(script_path, checkpoint_path, run_plan, max_messages)
+        checkpoint = load_checkpoint(str(checkpoint_path))
+        if checkpoint.completed:
+            break
+        interrupted_in_sub_script |= len(checkpoint.frames) > 1
+
+        interpreter = create_interpreter()
+        resumed_messages, _ = run_plan(interpreter.resume_script(checkpoint))
+        # The interrupted instruction is executed again
+        assert resumed_messages == messages[message_counts[checkpoint.instructions]:]
+        assert interpreter.context.galil_speed == 500
+        assert "In A" in interpreter.context.logged_signals
+    assert interrupted_in_sub_script
+
+
+def test_resume_twice(tmp_path, run_plan):
+    write_script(tmp_path, "sub.txt", _sub_script)
+    script_path = write_script(tmp_path, "script.txt", _script)
+    checkpoint_path = tmp_path / "run.checkpoint"
+    messages, message_counts = _run_with_checkpoint(script_path, checkpoint_path, run_plan)
+
+    interrupted_in_sub_script = False
+    for max_messages in range(1, 200, 3):
+        _run_with_checkpoint(script_path, checkpoint_path, run_plan, max_messages)
+        checkpoint = load_checkpoint(str(checkpoint_path))
+        if checkpoint.completed:
+            break
+
+        # Resume with the checkpoints and interrupt again
+        _run_with_checkpoint(script_path, checkpoint_path, run_plan, 4, resume=checkpoint)
+        second_checkpoint = load_checkpoint(str(checkpoint_path))
+        if second_checkpoint.completed:
+            continue
+        interrupted_in_sub_script |= len(second_checkpoint.frames) > 1
+
+        resumed_messages, _ = run_plan(create_interpreter().resume_script(second_checkpoint))
+        # The first instruction saved by the resumed run is the instruction of the first checkpoint
+        instructions = checkpoint.instructions + second_checkpoint.instructions - 1
+        assert resumed_messages == messages[message_counts[instructions]:]
+    assert interrupted_in_sub_script
@@ -0,0 +1,98 @@
+import io
+
+import pytest
+
+from megatron.compiler import (
+    OP_COMMAND, OP_ERROR, OP_LOOP, OP_NEXT, OP_NULL, OP_TIMER, Instruction, compile_lines, is_fatal_error, link_loops
+)
+from megatron.exceptions import InvalidArgumentError
+from tests.conftest import create_interpreter, resolve_handler, write_script
+
+
+def _compile(text):
+    return compile_lines(io.StringIO(text), resolve_handler)
+
+
+def test_compile_lines():
+    program = _compile('# Comment\nt1.5\n\nsetdo "Out A", 1\nSETAO "Out C", 2.5\n')
+    assert [_.opcode for _ in program] == [OP_TIMER, OP_NULL, OP_COMMAND, OP_COMMAND]
+    assert [_.line_no for _ in program] == [2, 3, 4, 5]
+    assert program[0].args == ("1.5",)
+    assert program[2].args == ("Out A", "1")
+    assert program[3].command == "setao"
+    assert program[3].args == ("Out C", "2.5")
+    assert program[2].handler is resolve_handler("setdo")
+
+
+def test_unknown_command():
+    program = _compile("foo 1\n")
+    assert program[0].opcode == OP_ERROR
+    assert program[0].command == "foo"
+    assert "foo" in program[0].args[0]
+
+
+def test_nested_loops_are_linked():
+    program = _compile("l2\nt1\nl3\nt2\nn\nn\nl1\nn\n")
+    opcodes = [_.opcode for _ in program]
+    assert opcodes == [OP_LOOP, OP_TIMER, OP_LOOP, OP_TIMER, OP_NEXT, OP_NEXT, OP_LOOP, OP_NEXT]
+    assert [_.target for _ in program if _.opcode in (OP_LOOP, OP_NEXT)] == [5, 4, 2, 0, 7, 6]
+
+
+def test_unmatched_next():
+    program = _compile("t1\nn\nl2\nt1\nn\nn\n")
+    assert [_.opcode for _ in program] == [OP_TIMER, OP_ERROR, OP_LOOP, OP_TIMER, OP_NEXT, OP_ERROR]
+    assert program[1].command == "n"
+    assert program[1].line_no == 2
+    assert "Unrecognized command 'n'" in program[1].args[0]
+    assert (program[2].target, program[4].target) == (4, 2)
+
+
+def test_unmatched_loop():
+    program = _compile("l2\nl3\nt1\nn\n")
+    assert [_.opcode for _ in program] == [OP_ERROR, OP_LOOP, OP_TIMER, OP_NEXT]
+    assert program[0].command == "l"
+    assert program[0].line_no == 1
+    assert "without matching 'n'" in program[0].args[0]
+    assert (program[1].target, program[3].target) == (3, 1)
+
+
+def test_link_loops_after_pass():
+    # Passes that change the instruction indices link the loops again
+    program = _compile("l2\nt1\nt2\nn\n")
+    del program[1]
+    link_loops(program)
+    assert (program[0].target, program[2].target) == (2, 0)
+
+    program.append(Instruction(OP_NEXT, command="n", line_no=5))
+    link_loops(program)
+    assert program[3].opcode == OP_ERROR
+    assert program[3].line_no == 5
+
+
+def test_invalid_arguments_are_fatal():
+    program = _compile('waitai "In A", >, abc\nsetao "Out C", high\nsetdo "Out A"\nfoo 1\n')
+    assert [_.opcode for _ in program] == [OP_ERROR] * 4
+    assert [is_fatal_error(_) for _ in program] == [True, True, True, False]
+
+
+def test_script_stops_at_invalid_arguments(tmp_path, run_plan):
+    script_path = write_script(tmp_path, "script.txt", """
+        setdo "Out A", 1
+        foo 1
+        sp %Velocity%
+        pa 1000
+        bg
+    """)
+    interpreter = create_interpreter()
+    with pytest.raises(InvalidArgumentError):
+        run_plan(interpreter.execute_script(script_path))
+    assert run_plan.messages == [("set", "sim_signal_0", (1,))]
+
+    interpreter.streaming = True
+    with pytest.raises(InvalidArgumentError):
+        run_plan(interpreter.execute_script(script_path))
+    assert run_plan.messages == [("set", "sim_signal_0", (1,))]
+
+    report = interpreter.dry_run(script_path)
+    assert [_[1] for _ in report.errors] == [2, 3]
+    assert not report.command_counts["bg"]
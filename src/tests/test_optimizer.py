@@ -0,0 +1,239 @@
+import io
+
+import pytest
+
+from megatron.compiler import OP_COMMAND, OP_LOOP, OP_NEXT, OP_TIMER, compile_lines
+from megatron.optimizer import optimize_program
+from tests.conftest import create_interpreter, resolve_handler, write_script
+
+
+def _compile(text):
+    lines = [_.strip() for _ in text.strip().splitlines()]
+    return compile_lines(io.StringIO("\n".join(lines) + "\n"), resolve_handler)
+
+
+def _lines(program):
+    """
+    Returns the script lines of the program.
+    """
+    lines = []
+    for instruction in program:
+        if instruction.opcode == OP_TIMER:
+            lines.append(f"t{float(instruction.args[0]):g}")
+        elif instruction.opcode == OP_LOOP:
+            lines.append(f"l{instruction.args[0]}")
+        elif instruction.opcode == OP_NEXT:
+            lines.append("n")
+        else:
+            lines.append(" ".join([instruction.command, *map(str, instruction.args)]))
+    return lines
+
+
+def _check_loops(program):
+    for n, instruction in enumerate(program):
+        if instruction.opcode == OP_LOOP:
+            assert program[instruction.target].opcode == OP_NEXT
+            assert program[instruction.target].target == n
+
+
+def test_nested_l1_loops_are_unwrapped():
+    program, report = optimize_program(_compile("""
+        l1
+        setdo "Out A", 1
+        l1
+        l1
+        setdo "Out B", 0
+        n
+        n
+        n
+    """))
+    assert _lines(program) == ["setdo Out A 1", "setdo Out B 0"]
+    assert report.loops_unwrapped == 3
+
+
+def test_loops_inside_l1_are_kept_and_linked():
+    program, _ = optimize_program(_compile("""
+        l1
+        l3
+        setdo "Out A", 1
+        t1
+        n
+        n
+        l2
+        setao "Out C", 0.5
+        n
+    """))
+    assert _lines(program) == ["l3", "setdo Out A 1", "t1", "n", "l2", "setao Out C 0.5", "n"]
+    _check_loops(program)
+
+
+def test_timers_are_merged_across_removed_instructions():
+    program, report = optimize_program(_compile("""
+        t1
+        t2.5
+
+        af 1
+        t0.5
+        setdo "Out A", 1
+        t0
+        t2
+    """))
+    assert _lines(program) == ["t4", "setdo Out A 1", "t2"]
+    assert report.timers_merged == 2
+    assert report.zero_timers == 1
+    assert report.blank_lines == 1
+
+
+def test_loop_with_single_timer_is_folded():
+    program, report = optimize_program(_compile("""
+        t1
+        l100
+        t.5
+        n
+    """))
+    assert _lines(program) == ["t51"]
+    assert report.loops_folded == 1
+
+
+def test_empty_loops_are_removed():
+    program, report = optimize_program(_compile("""
+        l0
+        setdo "Out A", 1
+        n
+        l5
+
+        cn 1
+        n
+        setdo "Out B", 1
+    """))
+    assert _lines(program) == ["setdo Out B 1"]
+    assert report.loops_removed == 2
+
+
+def test_noop_commands_are_removed():
+    program, report = optimize_program(_compile("""
+        af 1
+        ba A
+        setdo "Out A", 1
+        var x, 1
+    """))
+    assert _lines(program) == ["setdo Out A 1"]
+    assert report.noop_commands == {"af": 1, "ba": 1, "var": 1}
+
+
+def test_null_only_commands_are_executed_without_messages():
+    program, report = optimize_program(_compile("""
+        sp 2000
+        pa 5000
+    """))
+    assert _lines(program) == ["sp 2000", "pa 5000"]
+    assert report.null_messages == 2
+
+    interpreter = create_interpreter()
+    messages = []
+    for instruction in program:
+        assert instruction.opcode == OP_COMMAND
+        messages.extend(interpreter.execute_instruction(instruction))
+    assert messages == []
+    assert interpreter.context.galil_speed == 2000
+    assert interpreter.context.galil_pos == 5000
+
+
+def test_program_is_not_modified():
+    program = _compile("""
+        l1
+        t1
+        t2
+        n
+        sp 2000
+    """)
+    lines = _lines(program)
+    handlers = [_.handler for _ in program]
+    optimize_program(program)
+    assert _lines(program) == lines
+    assert [_.handler for _ in program] == handlers
+
+
+_equivalence_scripts = {
+    "nested_loops": """
+        l2
+        setdo "Out A", 1
+        l1
+        t1
+        t0.5
+        n
+        l3
+        t.25
+        n
+        setdo "Out A", 0
+        t0
+        n
+    """,
+    "motion": """
+        sp 2000
+        ac 1000
+        af 1
+        pa 5000
+
+        bg
+        l1
+        t2
+        n
+        sp 500
+        pa 0
+        bg
+        tp
+    """,
+    "sub_script": """
+        l2
+        run sub.txt
+        t1
+        n
+        setao "Out C", 1.5
+    """,
+    "waits": """
+        setdo "Out A", 1
+        setdo "Out B", 1
+        waitai "In A", >, 1
+        waitdi "In B", 1
+        log "In A"
+        t1
+        lograte 1
+        t2
+    """,
+}
+
+
+def _merge_sleeps(messages):
+    """
+    Replace the consecutive 'sleep' messages with a single message of the total time,
+    remove the zero 'sleep' messages.
+    """
+    merged = []
+    for message in messages:
+        if message[0] == "sleep" and not message[2][0]:
+            continue
+        if message[0] == "sleep" and merged and merged[-1][0] == "sleep":
+            merged[-1] = ("sleep", None, (round(merged[-1][2][0] + message[2][0], 9),))
+        else:
+            merged.append(message)
+    return merged
+
+
+@pytest.mark.parametrize("name", sorted(_equivalence_scripts))
+def test_optimized_script_is_equivalent(name, tmp_path, run_plan):
+    write_script(tmp_path, "sub.txt", """
+        l1
+        setdo "Out B", 1
+        n
+        t0.5
+        cc 1
+        t0.5
+    """)
+    script_path = write_script(tmp_path, "script.txt", _equivalence_scripts[name])
+
+    messages, sleep_time = run_plan(create_interpreter().execute_script(script_path))
+    optimized_messages, optimized_sleep_time = run_plan(create_interpreter(optimize=True).execute_script(script_path))
+
+    assert _merge_sleeps(optimized_messages) == _merge_sleeps(messages)
+    assert optimized_sleep_time == pytest.approx(sleep_time)
@@ -0,0 +1,74 @@
+import os
+
+from megatron.registry import CommandRegistry, registry_signature
+from megatron.script_cache import CompiledScriptCache, SubScriptCache
+
+
+def _touch(path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        f.write("t1\n")
+    return str(path)
+
+
+def test_resolve_in_parent_directories(tmp_path):
+    root = tmp_path / "scripts"
+    relay_path = _touch(root / "SubScripts" / "Relay switch 5.txt")
+    script_dir = str(root / "tests of chamber" / "2024_05")
+    os.makedirs(script_dir)
+
+    resolver = SubScriptCache(None)
+    assert resolver.resolve("SubScripts\\relay switch 5", script_dir, str(root)) == relay_path
+    assert resolver.resolve("subscripts/Relay switch 5.txt", str(root), str(root)) == relay_path
+
+
+def test_search_stops_at_root(tmp_path):
+    _touch(tmp_path / "foo.txt")
+    root = tmp_path / "scripts"
+    script_dir = str(root / "MLL")
+    os.makedirs(script_dir)
+
+    resolver = SubScriptCache(None)
+    assert resolver.resolve("foo", script_dir, str(root)) == os.path.join(script_dir, "foo")
+    # Without the root only the directory of the calling script is searched
+    assert resolver.resolve("foo", script_dir) == os.path.join(script_dir, "foo")
+    assert resolver.resolve("foo", script_dir, str(tmp_path)) == str(tmp_path / "foo.txt")
+
+
+def test_resolution_is_rechecked(tmp_path):
+    root = tmp_path / "scripts"
+    script_dir = str(root / "MLL")
+    parent_path = _touch(root / "SubScripts" / "init.txt")
+    os.makedirs(script_dir)
+
+    resolver = SubScriptCache(None)
+    assert resolver.resolve("SubScripts\\init", script_dir, str(root)) == parent_path
+    assert resolver.resolve("SubScripts\\init", script_dir, str(root)) == parent_path
+
+    # A closer script is found after it is created
+    local_path = _touch(root / "MLL" / "SubScripts" / "init.txt")
+    assert resolver.resolve("SubScripts\\init", script_dir, str(root)) == local_path
+
+    os.remove(local_path)
+    assert resolver.resolve("SubScripts\\init", script_dir, str(root)) == parent_path
+
+
+def test_registry_changes_invalidate_compiled_scripts(tmp_path):
+    registry = CommandRegistry("test")
+
+    @registry.command("foo", min_args=1, max_args=1)
+    def foo(args, context):
+        yield from ()
+
+    script_path = _touch(tmp_path / "script.txt")
+    cache = CompiledScriptCache(None, registry_signature(registry))
+    cache.load(script_path)
+    cached_names = os.listdir(tmp_path / "__megatron_cache__")
+
+    # The same command with the different number of arguments
+    registry.command("foo", min_args=1, max_args=2)(foo)
+    new_cache = CompiledScriptCache(None, registry_signature(registry))
+    assert new_cache.signature != cache.signature
+    new_cache.load(script_path)
+    new_cached_names = os.listdir(tmp_path / "__megatron_cache__")
+    assert len(new_cached_names) == 1 and new_cached_names != cached_names
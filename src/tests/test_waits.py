@@ -0,0 +1,33 @@
+import pytest
+from bluesky.run_engine import RunEngine, WaitForTimeoutError
+from bluesky.utils import FailedStatus
+
+from megatron.support import register_custom_instructions
+from tests.conftest import create_interpreter, write_script
+
+
+@pytest.fixture(scope="module")
+def RE():
+    RE = RunEngine({})
+    register_custom_instructions(RE)
+    return RE
+
+
+@pytest.mark.parametrize("group_waits", [False, True])
+def test_waitai_tolerance(tmp_path, RE, group_waits):
+    # Without 'waitdi' the single 'waitai' is not grouped
+    lines = ['waitai "In A", ==, 1, 0.1, 0.5']
+    if group_waits:
+        lines.append('waitdi "In B", 1, 0.5')
+    script_path = write_script(tmp_path, "script.txt", "\n".join(lines))
+    interpreter = create_interpreter(group_waits=group_waits)
+    interpreter.context.devices.sim_signal_4.put(1e-6)
+
+    # The target is 1e-6, the value is within the tolerance
+    interpreter.context.devices.sim_signal_3.put(0.05)
+    RE(interpreter.execute_script(script_path))
+
+    interpreter.context.devices.sim_signal_3.put(0.5)
+    # The single wait times out in the RunEngine, the timeout of the grouped condition fails the status
+    with pytest.raises(FailedStatus if group_waits else WaitForTimeoutError):
+        RE(interpreter.execute_script(script_path))
@@ -1,77 +1,280 @@
+import io
 import os
 import re
 import argparse
 import sys
+import pickle
+import mmap
+import shutil
+import tempfile
+import functools
+import hashlib
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+
+# Version of the index format, the index is rebuilt if the version is different
+INDEX_VERSION = 1
+INDEX_DIR_NAME = "__megatron_cache__"
+INDEX_FILE_NAME = "search_index.pickle"
+
+_key_pattern = re.compile(r'\w+')
+_timer_key_pattern = re.compile(r'^t\d+')
+_loop_key_pattern = re.compile(r'^l\d+')
+# Key of the lines consisting of 'n' only (loop ends)
+_loop_end_key = ' n'
+
+def _compile_keywords(keywords):
+    # Keywords made of word characters are matched by a single lookup of the first word of
+    # the line, so that all keywords are matched in one pass over the file (a combined
+    # alternation would report only one keyword per line). Other keywords are matched by
+    # their own patterns.
+    word_keywords = set()
+    patterns = []
+    for keyword_lower in dict.fromkeys(_.lower() for _ in keywords):
+        if keyword_lower in ('t', 'l'):
+            continue
+        if _key_pattern.fullmatch(keyword_lower):
+            word_keywords.add(keyword_lower)
+        else:
+            patterns.append((keyword_lower, re.compile(rf'^{keyword_lower}\b')))
+    return word_keywords, patterns
 
 def find_keywords_in_file(file_path, keywords):
+    keywords_lower = [_.lower() for _ in keywords]
+    find_timers = 't' in keywords_lower
+    find_loops = 'l' in keywords_lower
+    word_keywords, patterns = _compile_keywords(keywords)
     result = {}
-    with open(file_path, 'r', encoding='utf-8', errors='ignore') as file:
-        lines = file.readlines()
-        for line_number, line in enumerate(lines, 1):
-            line_lower = line.strip().lower()
-            for keyword in keywords:
-                keyword_lower = keyword.lower()
-                if keyword_lower == 't':
-                    if re.match(r'^t\d+', line_lower):
-                        if keyword_lower not in result:
-                            result[keyword_lower] = []
-                        result[keyword_lower].append((line.strip(), line_number))
-                elif keyword_lower == 'l':
-                    if re.match(r'^l\d+', line_lower):
-                        loop_start_line = line_number
-                        for sub_line_number in range(line_number + 1, len(lines)):
-                            if lines[sub_line_number].strip().lower() == 'n':
-                                if keyword_lower not in result:
-                                    result[keyword_lower] = []
-                                result[keyword_lower].append((line.strip(), loop_start_line))
-                                result[keyword_lower].append((lines[sub_line_number].strip(), sub_line_number + 1))
-                                break
-                else:
-                    if re.match(rf'^{keyword_lower}\b', line_lower):
-                        if keyword_lower not in result:
-                            result[keyword_lower] = []
-                        result[keyword_lower].append((line.strip(), line_number))
+    loop_starts = []  # Stack of the loops that are not closed yet
+    loops = []
+    with open(file_path, 'rb') as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            return result
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            for line_number, line in enumerate(iter(data.readline, b''), 1):
+                line = line.decode('utf-8', errors='ignore').strip()
+                line_lower = line.lower()
+                match = _key_pattern.match(line_lower)
+                if match:
+                    key = match.group()
+                    if key in word_keywords:
+                        result.setdefault(key, []).append((line, line_number))
+                    if find_timers and _timer_key_pattern.match(key):
+                        result.setdefault('t', []).append((line, line_number))
+                    if find_loops:
+                        if _loop_key_pattern.match(key):
+                            loop_starts.append((line, line_number))
+                        elif line_lower == 'n' and loop_starts:
+                            # Each 'n' closes the innermost open loop
+                            loops.append((loop_starts.pop(), (line, line_number)))
+                for keyword_lower, pattern in patterns:
+                    if pattern.match(line_lower):
+                        result.setdefault(keyword_lower, []).append((line, line_number))
+    if loops:
+        loops.sort(key=lambda _: _[0][1])
+        result['l'] = [_ for loop in loops for _ in loop]
     return result
 
-def write_output(output_path, results, keywords, file_paths, simple):
-    with open(output_path, 'w') as output_file:
-        for keyword in keywords:
-            keyword_lower = keyword.lower()
-            if keyword_lower in results:
-                occurrences = len(results[keyword_lower])
-                output_file.write(f"--- {keyword} --- occurrence: {occurrences}\n")
-                if not simple:
-                    for line, file_path in zip(results[keyword_lower], file_paths[keyword_lower]):
-                        output_file.write(f"{line[0]} (found in {file_path}, line {line[1]})\n")
-                output_file.write("\n\n\n")  
+def _scan_file(directory, keywords, relative_file_path):
+    return relative_file_path, find_keywords_in_file(os.path.join(directory, relative_file_path), keywords)
+
+class OccurrenceWriter:
+    # Collects the occurrences file by file and writes them grouped by keyword. The lines are
+    # kept in temporary files (moved to disk when large), so that the memory use does not
+    # grow with the number of occurrences.
+    def __init__(self, keywords, simple):
+        self.keywords = keywords
+        self.simple = simple
+        self.counts = {}
+        self.buffers = {}
+
+    def add(self, keyword_lower, relative_file_path, lines):
+        # 'lines' are (line, line_number) tuples, or anything of the same length if 'simple' is set
+        if not lines:
+            return
+        self.counts[keyword_lower] = self.counts.get(keyword_lower, 0) + len(lines)
+        if self.simple:
+            return
+        buffer = self.buffers.get(keyword_lower)
+        if buffer is None:
+            buffer = tempfile.SpooledTemporaryFile(max_size=1 << 20, mode='w+', encoding='utf-8')
+            self.buffers[keyword_lower] = buffer
+        buffer.writelines(f"{line} (found in {relative_file_path}, line {line_number})\n" for line, line_number in lines)
+
+    def write(self, output_path):
+        with open(output_path, 'w') as output_file:
+            written = set()
+            for keyword in self.keywords:
+                keyword_lower = keyword.lower()
+                if keyword_lower in written or keyword_lower not in self.counts:
+                    continue
+                written.add(keyword_lower)
+                output_file.write(f"--- {keyword} --- occurrence: {self.counts[keyword_lower]}\n")
+                if not self.simple:
+                    buffer = self.buffers[keyword_lower]
+                    buffer.seek(0)
+                    shutil.copyfileobj(buffer, output_file)
+                output_file.write("\n\n\n")
+
+    def close(self):
+        for buffer in self.buffers.values():
+            buffer.close()
+        self.buffers = {}
+
+def index_file(file_path):
+    # The index of the file maps the first word of each line (lower case) to the line numbers,
+    # so that any keyword made of word characters is matched by a single lookup
+    entries = {}
+    with open(file_path, 'rb') as file:
+        data = file.read()
+    # Lines are split as in the text mode file (universal newlines)
+    text = io.StringIO(data.decode('utf-8', errors='ignore'), newline=None)
+    for line_number, line in enumerate(text, 1):
+        line_lower = line.strip().lower()
+        match = _key_pattern.match(line_lower)
+        if match:
+            entries.setdefault(match.group(), array('I')).append(line_number)
+        if line_lower == 'n':
+            entries.setdefault(_loop_end_key, array('I')).append(line_number)
+    return hashlib.blake2b(data, digest_size=16).hexdigest(), entries
+
+def load_index(index_path):
+    try:
+        with open(index_path, 'rb') as file:
+            index = pickle.load(file)
+        if index.get('version') == INDEX_VERSION:
+            return index
+    except FileNotFoundError:
+        pass
+    except Exception as ex:
+        print(f"Failed to load the index {index_path}: {ex}")
+    return {'version': INDEX_VERSION, 'files': {}}
+
+def save_index(index, index_path):
+    os.makedirs(os.path.dirname(index_path) or '.', exist_ok=True)
+    tmp_path = f"{index_path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as file:
+        pickle.dump(index, file, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, index_path)
+
+def update_index(directory, index_path):
+    # Only the files with changed modification time or size are read, and only the files
+    # with changed contents are indexed again. Returns the index and the list of the files
+    # (relative paths in the order of the directory walk).
+    index = load_index(index_path)
+    old_files = index['files']
+    files = {}
+    file_order = []
+    n_indexed = 0
+    n_updated = 0
+    for root, dirs, names in os.walk(directory):
+        dirs[:] = [_ for _ in dirs if _ != INDEX_DIR_NAME]
+        for name in names:
+            if not name.endswith('.txt'):
+                continue
+            file_path = os.path.join(root, name)
+            relative_file_path = os.path.relpath(file_path, directory)
+            st = os.stat(file_path)
+            stat_key = (st.st_mtime_ns, st.st_size)
+            entry = old_files.get(relative_file_path)
+            if entry is None or entry['stat'] != stat_key:
+                digest, entries = index_file(file_path)
+                if entry is None or entry['digest'] != digest:
+                    entry = {'digest': digest, 'entries': entries}
+                    n_indexed += 1
+                entry['stat'] = stat_key
+                n_updated += 1
+            files[relative_file_path] = entry
+            file_order.append(relative_file_path)
+
+    if n_updated or len(files) != len(old_files) or any(_ not in files for _ in old_files):
+        print(f"Updating the index: {n_indexed} files indexed, {len(files)} files in total")
+        index['files'] = files
+        save_index(index, index_path)
+    return index, file_order
+
+def _find_keyword_lines(entries, keyword_lower):
+    # Returns the sorted line numbers matching the keyword, or None if the keyword
+    # can not be answered from the index
+    if keyword_lower == 't':
+        lines = [n for key, numbers in entries.items() if _timer_key_pattern.match(key) for n in numbers]
+        return sorted(lines)
+    if keyword_lower == 'l':
+        starts = [n for key, numbers in entries.items() if _loop_key_pattern.match(key) for n in numbers]
+        ends = entries.get(_loop_end_key, ())
+        # Each 'n' closes the innermost open loop (as in 'find_keywords_in_file')
+        events = sorted([(n, False) for n in starts] + [(n, True) for n in ends])
+        loop_starts = []
+        loops = []
+        for line_number, is_end in events:
+            if not is_end:
+                loop_starts.append(line_number)
+            elif loop_starts:
+                loops.append((loop_starts.pop(), line_number))
+        loops.sort()
+        return [_ for loop in loops for _ in loop]
+    if _key_pattern.fullmatch(keyword_lower):
+        return list(entries.get(keyword_lower, ()))
+    return None
+
+def search_index(directory, index, file_order, keywords, writer):
+    # Adds the occurrences to the writer file by file. The lines are read only if the full
+    # matches are written.
+    keywords_lower = list(dict.fromkeys(_.lower() for _ in keywords))
+    for relative_file_path in file_order:
+        entries = index['files'][relative_file_path]['entries']
+        found = {}
+        not_indexed = []
+        for keyword_lower in keywords_lower:
+            lines = _find_keyword_lines(entries, keyword_lower)
+            if lines is None:
+                not_indexed.append(keyword_lower)
+            elif lines:
+                found[keyword_lower] = lines
+        file_path = os.path.join(directory, relative_file_path)
+        if not_indexed:
+            # The keywords that are not words are searched in the file
+            found.update(find_keywords_in_file(file_path, not_indexed))
+
+        if found and not writer.simple:
+            line_numbers = {n for lines in found.values() for n in lines if not isinstance(n, tuple)}
+            texts = {}
+            if line_numbers:
+                with open(file_path, 'r', encoding='utf-8', errors='ignore') as file:
+                    for line_number, line in enumerate(file, 1):
+                        if line_number in line_numbers:
+                            texts[line_number] = line.strip()
+            for keyword_lower, lines in found.items():
+                found[keyword_lower] = [_ if isinstance(_, tuple) else (texts[_], _) for _ in lines]
+
+        for keyword_lower in keywords_lower:
+            writer.add(keyword_lower, relative_file_path, found.get(keyword_lower))
 
 def get_keywords_from_file(file_path):
     with open(file_path, 'r') as file:
         return [line.strip() for line in file]
 
-def search_directory(directory, keywords):
-    results = {}
-    file_paths = {}
-    
-    for keyword in keywords:
-        print(f"\n--- Searching for keyword '{keyword}' ---")  
-        for root, _, files in os.walk(directory):
-            for file in files:
-                if file.endswith('.txt'):
-                    file_path = os.path.join(root, file)
-                    relative_file_path = os.path.relpath(file_path, directory)
-                    keyword_results = find_keywords_in_file(file_path, [keyword])
-                    for key, lines in keyword_results.items():
-                        key_lower = key.lower()
-                        if key_lower not in results:
-                            results[key_lower] = []
-                            file_paths[key_lower] = []
-                        results[key_lower].extend(lines)
-                        file_paths[key_lower].extend([relative_file_path] * len(lines))
-        
-        print("\n")  
-
-    return results, file_paths
+def search_directory(directory, keywords, writer, jobs=None):
+    # All keywords are matched in one pass over each file, the files are scanned
+    # by a pool of processes
+    file_order = []
+    for root, dirs, names in os.walk(directory):
+        dirs[:] = [_ for _ in dirs if _ != INDEX_DIR_NAME]
+        for name in names:
+            if name.endswith('.txt'):
+                file_order.append(os.path.relpath(os.path.join(root, name), directory))
+
+    keywords_lower = list(dict.fromkeys(_.lower() for _ in keywords))
+    scan_file = functools.partial(_scan_file, directory, keywords_lower)
+    if jobs == 1 or len(file_order) < 2:
+        for relative_file_path, result in map(scan_file, file_order):
+            for keyword_lower in keywords_lower:
+                writer.add(keyword_lower, relative_file_path, result.get(keyword_lower))
+    else:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            for relative_file_path, result in executor.map(scan_file, file_order, chunksize=8):
+                for keyword_lower in keywords_lower:
+                    writer.add(keyword_lower, relative_file_path, result.get(keyword_lower))
 
 def main():
     parser = argparse.ArgumentParser(description="Search text files for keywords and output results.")
@@ -80,6 +283,9 @@ def main():
     parser.add_argument('--keywords-file', help="Path to a file containing keywords (one per line)")
     parser.add_argument('--output', help="Output file path", required=True)
     parser.add_argument('--simple', action='store_true', help="Only count occurrences and don't print full matches")
+    parser.add_argument('--index', help=f"Index file path (default: <source>/{INDEX_DIR_NAME}/{INDEX_FILE_NAME})")
+    parser.add_argument('--no-index', action='store_true', help="Search the files without using the index")
+    parser.add_argument('--jobs', type=int, help="Number of processes scanning the files without the index (default: number of CPUs)")
     
     args = parser.parse_args()
 
@@ -92,10 +298,19 @@ def main():
         return
 
     print("Starting search...")
-    results, file_paths = search_directory(args.source, keywords)
-    
-    print("Writing results to output file...")
-    write_output(args.output, results, keywords, file_paths, args.simple)
+    writer = OccurrenceWriter(keywords, args.simple)
+    try:
+        if args.no_index:
+            search_directory(args.source, keywords, writer, args.jobs)
+        else:
+            index_path = args.index or os.path.join(args.source, INDEX_DIR_NAME, INDEX_FILE_NAME)
+            index, file_order = update_index(args.source, index_path)
+            search_index(args.source, index, file_order, keywords, writer)
+
+        print("Writing results to output file...")
+        writer.write(args.output)
+    finally:
+        writer.close()
     print("Search complete! Results saved to", args.output)
 
 if __name__ == "__main__":